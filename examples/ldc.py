@@ -2,7 +2,7 @@ import numpy
 
 from fvm import Continuation
 from fvm import Interface
-from fvm import utils
+from fvm import StateLayout
 
 from jadapy import jdqz
 
@@ -19,6 +19,8 @@ def main():
     nz = 1
     n = dof * nx * ny * nz
 
+    layout = StateLayout(nx, ny, nz, dof, dim)
+
     # Define a point of interest
     poi = (nx // 2 - 1, ny // 4 - 1)
 
@@ -29,7 +31,7 @@ def main():
                   'Lid Velocity': 0,
                   # Value describes the value that is traced in the continuation
                   # and time integration methods
-                  'Value': lambda x: utils.create_state_mtx(x, nx, ny, nz, dof)[poi[0], poi[1], 0, 0]}
+                  'Value': lambda x: layout.u(x)[poi[0], poi[1], 0]}
 
     interface = Interface(parameters, nx, ny, nz, dim, dof)
 
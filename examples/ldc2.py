@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 from fvm import Continuation
 from fvm import Interface
 from fvm import plot_utils
-from fvm import utils
+from fvm import StateLayout
 
 def main():
     ''' An example of performing a continuation for a 2D lid-driven cavity and detecting a bifurcation point'''
@@ -16,6 +16,8 @@ def main():
     nz = 1
     n = dof * nx * ny * nz
 
+    layout = StateLayout(nx, ny, nz, dof, dim)
+
     # Define a point of interest
     poi = (nx // 2 - 1, ny // 4 - 1)
 
@@ -32,7 +34,7 @@ def main():
                   'Verbose': True,
                   # Value describes the value that is traced in the continuation
                   # and time integration methods
-                  'Value': lambda x: utils.create_state_mtx(x, nx, ny, nz, dof)[poi[0], poi[1], 0, 0]}
+                  'Value': lambda x: layout.u(x)[poi[0], poi[1], 0]}
 
     interface = Interface(parameters, nx, ny, nz, dim, dof)
 
@@ -83,13 +85,11 @@ def main():
     _, v = interface.eigs(x2, True)
     v = v[:, 0].real
 
-    v = plot_utils.create_state_mtx(v, nx, ny, nz, dof)
-
     # Plot the velocity magnutide
-    plot_utils.plot_velocity_magnitude(v[:, :, 0, 0], v[:, :, 0, 1], interface)
+    plot_utils.plot_velocity_magnitude(layout.u(v)[:, :, 0], layout.v(v)[:, :, 0], interface)
 
     # Plot the pressure
-    plot_utils.plot_value(v[:, :, 0, 2], interface)
+    plot_utils.plot_value(layout.p(v)[:, :, 0], interface)
 
 
 if __name__ == '__main__':
@@ -4,7 +4,7 @@ import matplotlib.pyplot as plt
 
 from fvm import TimeIntegration
 from fvm import Interface
-from fvm import utils
+from fvm import StateLayout
 
 def main():
     ''' An example of performing a "poor man's continuation" for a 2D lid-driven cavity using time integration'''
@@ -15,6 +15,8 @@ def main():
     nz = 1
     n = dof * nx * ny * nz
 
+    layout = StateLayout(nx, ny, nz, dof, dim)
+
     # Define a point of interest
     poi = (nx // 2 - 1, ny // 4 - 1)
 
@@ -31,7 +33,7 @@ def main():
                   'Verbose': True,
                   # Value describes the value that is traced in the continuation
                   # and time integration methods
-                  'Value': lambda x: utils.create_state_mtx(x, nx, ny, nz, dof)[poi[0], poi[1], 0, 0],
+                  'Value': lambda x: layout.u(x)[poi[0], poi[1], 0],
                   'Theta': 1}
 
     interface = Interface(parameters, nx, ny, nz, dim, dof)
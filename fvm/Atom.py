@@ -0,0 +1,259 @@
+import numpy
+
+from itertools import product
+
+class Atom:
+    '''Sparse representation of an atom as defined in Discretization.
+    Instead of storing the full [nx, ny, nz, dof, dof, 3, 3, 3] array,
+    only the active channels (d1, d2, x, y, z) are stored, each as a
+    contiguous [nx, ny, nz] plane. A channel that is not stored is
+    assumed to be zero.
+
+    The atom can be indexed like the dense array, e.g.
+
+    atom[i, j, k, d1, d2, x, y, z]
+    atom[self.nx-1, :, :, :, :, 1, :, :] -= atom[self.nx-1, :, :, :, :, 2, :, :]
+
+    where getting an item always returns a copy. Setting zeros in
+    channels that are not stored does not create them.'''
+
+    # Make sure that numpy defers to our own arithmetic
+    __array_ufunc__ = None
+
+    def __init__(self, nx, ny, nz, dof, planes=None):
+        self.nx = nx
+        self.ny = ny
+        self.nz = nz
+        self.dof = dof
+
+        self.planes = {} if planes is None else planes
+
+    def _get_shape(self):
+        return (self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3)
+
+    shape = property(_get_shape)
+
+    def channel(self, d1, d2, x, y, z):
+        '''Plane of the channel (d1, d2, x, y, z) that can be used for
+        writing. The channel is created if it does not exist yet.'''
+
+        key = (d1, d2, x, y, z)
+        plane = self.planes.get(key)
+        if plane is None:
+            plane = numpy.zeros((self.nx, self.ny, self.nz))
+            self.planes[key] = plane
+        return plane
+
+    def keys(self):
+        '''Keys (d1, d2, x, y, z) of the stored channels sorted in the
+        order in which the dense atom would be traversed when
+        assembling rows of the matrix, which is by d1 and then by
+        (z, y, x, d2).'''
+
+        return Atom.sorted_keys(self.planes.keys())
+
+    @staticmethod
+    def sorted_keys(keys):
+        '''Sort channel keys in the order that is used by keys().'''
+
+        return sorted(keys, key=lambda key: (key[0], key[4], key[3], key[2], key[1]))
+
+    def items(self):
+        return [(key, self.planes[key]) for key in self.keys()]
+
+    def stack(self, keys):
+        '''Values of the channels in keys as a [len(keys), nx * ny * nz]
+        array. Channels that are not stored are zero.'''
+
+        out = numpy.zeros((len(keys), self.nx * self.ny * self.nz))
+        for i, key in enumerate(keys):
+            plane = self.planes.get(key)
+            if plane is not None:
+                out[i, :] = plane.reshape(-1)
+        return out
+
+    def copy(self):
+        return Atom(self.nx, self.ny, self.nz, self.dof,
+                    {key: plane.copy() for key, plane in self.planes.items()})
+
+    def to_array(self):
+        '''Convert to a dense [nx, ny, nz, dof, dof, 3, 3, 3] array.'''
+
+        out = numpy.zeros(self.shape)
+        for key, plane in self.planes.items():
+            out[(slice(None), slice(None), slice(None)) + key] = plane
+        return out
+
+    @staticmethod
+    def from_array(array):
+        '''Create an atom from a dense [nx, ny, nz, dof, dof, 3, 3, 3] array.'''
+
+        nx, ny, nz, dof = array.shape[:4]
+        atom = Atom(nx, ny, nz, dof)
+        for key in zip(*numpy.nonzero(numpy.any(array, axis=(0, 1, 2)))):
+            key = tuple(int(i) for i in key)
+            atom.planes[key] = array[(slice(None), slice(None), slice(None)) + key].copy()
+        return atom
+
+    def _normalize_key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if len(key) > 8:
+            raise IndexError('Too many indices for atom: %d' % len(key))
+
+        key = key + (slice(None),) * (8 - len(key))
+
+        out = []
+        for idx, n in zip(key, self.shape):
+            if isinstance(idx, slice):
+                out.append(idx)
+                continue
+
+            idx = int(idx)
+            if idx < -n or idx >= n:
+                raise IndexError('Index %d is out of bounds for size %d' % (idx, n))
+            out.append(idx % n)
+
+        return tuple(out[:3]), out[3:]
+
+    def _selection(self, key):
+        spatial, channel = self._normalize_key(key)
+
+        ranges = []
+        for idx, n in zip(channel, self.shape[3:]):
+            if isinstance(idx, slice):
+                ranges.append(range(n)[idx])
+            else:
+                ranges.append(idx)
+
+        shape = tuple(len(range(n)[idx]) for idx, n in zip(spatial, self.shape) if isinstance(idx, slice)) + \
+            tuple(len(r) for r in ranges if isinstance(r, range))
+
+        return spatial, ranges, shape
+
+    @staticmethod
+    def _position(ranges, key):
+        '''Position of the channel key in the selection ranges, or None
+        if it is not selected.'''
+
+        pos = ()
+        for r, idx in zip(ranges, key):
+            if isinstance(r, range):
+                if idx not in r:
+                    return None
+                pos += (r.index(idx),)
+            elif r != idx:
+                return None
+        return pos
+
+    def __getitem__(self, key):
+        spatial, ranges, shape = self._selection(key)
+
+        if not any(isinstance(r, range) for r in ranges):
+            # Only one channel is selected
+            plane = self.planes.get(tuple(ranges))
+            if plane is None:
+                return numpy.zeros(shape)[()]
+            return plane[spatial].copy()[()]
+
+        out = numpy.zeros(shape)
+        for channel, plane in self.planes.items():
+            pos = Atom._position(ranges, channel)
+            if pos is not None:
+                out[(Ellipsis,) + pos] = plane[spatial]
+
+        return out[()]
+
+    def __setitem__(self, key, value):
+        spatial, ranges, shape = self._selection(key)
+
+        value = numpy.asarray(value)
+        if value.ndim == 0 and value == 0:
+            # Only existing channels have to be set to zero
+            for channel, plane in self.planes.items():
+                if Atom._position(ranges, channel) is not None:
+                    plane[spatial] = 0
+            return
+
+        value = numpy.broadcast_to(value, shape)
+        for channel in product(*[r if isinstance(r, range) else (r,) for r in ranges]):
+            pos = Atom._position(ranges, channel)
+            sub = value[(Ellipsis,) + pos]
+            if channel not in self.planes and not numpy.any(sub):
+                continue
+
+            self.channel(*channel)[spatial] = sub
+
+    def zero(self):
+        '''Set all stored channels to zero in place. The channels are
+        kept, so they can be reused without allocating them again.'''
+
+        for plane in self.planes.values():
+            plane[:, :, :] = 0
+
+    def assign(self, other):
+        '''Copy the values of other into this atom in place.'''
+
+        for key, plane in self.planes.items():
+            if key not in other.planes:
+                plane[:, :, :] = 0
+
+        for key, plane in other.planes.items():
+            self.channel(*key)[:, :, :] = plane
+
+    def add_scaled(self, alpha, other):
+        '''Add alpha * other to this atom in place.'''
+
+        for key, plane in other.planes.items():
+            self.channel(*key)[:, :, :] += alpha * plane
+
+    def __iadd__(self, other):
+        for key, plane in other.planes.items():
+            if key in self.planes:
+                self.planes[key] += plane
+            else:
+                self.planes[key] = plane.copy()
+        return self
+
+    def __isub__(self, other):
+        for key, plane in other.planes.items():
+            if key in self.planes:
+                self.planes[key] -= plane
+            else:
+                self.planes[key] = -plane
+        return self
+
+    def __imul__(self, x):
+        for plane in self.planes.values():
+            plane *= x
+        return self
+
+    def __itruediv__(self, x):
+        for plane in self.planes.values():
+            plane /= x
+        return self
+
+    def __add__(self, other):
+        out = self.copy()
+        out += other
+        return out
+
+    def __sub__(self, other):
+        out = self.copy()
+        out -= other
+        return out
+
+    def __neg__(self):
+        return Atom(self.nx, self.ny, self.nz, self.dof,
+                    {key: -plane for key, plane in self.planes.items()})
+
+    def __mul__(self, x):
+        return Atom(self.nx, self.ny, self.nz, self.dof,
+                    {key: plane * x for key, plane in self.planes.items()})
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, x):
+        return Atom(self.nx, self.ny, self.nz, self.dof,
+                    {key: plane / x for key, plane in self.planes.items()})
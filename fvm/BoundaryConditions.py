@@ -1,6 +1,4 @@
-import numpy
-
-from .utils import create_state_vec
+from .StateLayout import StateLayout
 
 class BoundaryConditions:
 
@@ -15,6 +13,8 @@ class BoundaryConditions:
         self.y = y
         self.z = z
 
+        self.layout = StateLayout(nx, ny, nz, dof, dim)
+
     def no_slip_east(self, atom):
         # At the boundary u[i] = 0, v[i] + v[i+1] = 2*V similar for w. So v[i+1] = -v[i]+2*V.
         atom[self.nx-1, :, :, :, :, 1, :, :] -= atom[self.nx-1, :, :, :, :, 2, :, :]
@@ -112,15 +112,15 @@ class BoundaryConditions:
         atom[:, :, 0, :, :, :, :, 0] = 0
 
     def moving_lid_north(self, atom, velocity):
-        frc = self._constant_forcing_north(atom[:, :, :, :, 0, :, :, :], 0, 2 * velocity)
+        frc = self._constant_forcing_north(atom, 0, 0, 2 * velocity)
 
         self.no_slip_north(atom)
 
         return frc
 
     def moving_lid_top(self, atom, velocity):
-        frc = self._constant_forcing_top(atom[:, :, :, :, 0, :, :, :], 0, 2 * velocity) + \
-            self._constant_forcing_top(atom[:, :, :, :, 0, :, :, :], 1, 2 * velocity)
+        frc = self._constant_forcing_top(atom, 0, 0, 2 * velocity) + \
+            self._constant_forcing_top(atom, 1, 0, 2 * velocity)
 
         self.no_slip_top(atom)
 
@@ -130,7 +130,7 @@ class BoundaryConditions:
 
     def temperature_east(self, atom, temperature):
         '''T[i] + T[i+1] = 2 * Tb'''
-        frc = self._constant_forcing_east(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, 2 * temperature)
+        frc = self._constant_forcing_east(atom, self.dim+1, self.dim+1, 2 * temperature)
         atom[self.nx-1, :, :, self.dim+1, self.dim+1, 1, :, :] -= atom[self.nx-1, :, :, self.dim+1, self.dim+1, 2, :, :]
         atom[self.nx-1, :, :, self.dim+1, self.dim+1, 2, :, :] = 0
 
@@ -138,7 +138,7 @@ class BoundaryConditions:
 
     def temperature_west(self, atom, temperature):
         '''T[i] + T[i-1] = 2 * Tb'''
-        frc = self._constant_forcing_west(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, 2 * temperature)
+        frc = self._constant_forcing_west(atom, self.dim+1, self.dim+1, 2 * temperature)
         atom[0, :, :, self.dim+1, self.dim+1, 1, :, :] -= atom[0, :, :, self.dim+1, self.dim+1, 0, :, :]
         atom[0, :, :, self.dim+1, self.dim+1, 0, :, :] = 0
 
@@ -146,7 +146,7 @@ class BoundaryConditions:
 
     def temperature_north(self, atom, temperature):
         '''T[j] + T[j+1] = 2 * Tb'''
-        frc = self._constant_forcing_north(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, 2 * temperature)
+        frc = self._constant_forcing_north(atom, self.dim+1, self.dim+1, 2 * temperature)
         atom[:, self.ny-1, :, self.dim+1, self.dim+1, :, 1, :] -= atom[:, self.ny-1, :, self.dim+1, self.dim+1, :, 2, :]
         atom[:, self.ny-1, :, self.dim+1, self.dim+1, :, 2, :] = 0
 
@@ -154,7 +154,7 @@ class BoundaryConditions:
 
     def temperature_south(self, atom, temperature):
         '''T[j] + T[j-1] = 2 * Tb'''
-        frc = self._constant_forcing_south(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, 2 * temperature)
+        frc = self._constant_forcing_south(atom, self.dim+1, self.dim+1, 2 * temperature)
         atom[:, 0, :, self.dim+1, self.dim+1, :, 1, :] -= atom[:, 0, :, self.dim+1, self.dim+1, :, 0, :]
         atom[:, 0, :, self.dim+1, self.dim+1, :, 0, :] = 0
 
@@ -162,7 +162,7 @@ class BoundaryConditions:
 
     def temperature_top(self, atom, temperature):
         '''T[k] + T[k+1] = 2 * Tb'''
-        frc = self._constant_forcing_top(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, 2 * temperature)
+        frc = self._constant_forcing_top(atom, self.dim+1, self.dim+1, 2 * temperature)
         atom[:, :, self.nz-1, self.dim+1, self.dim+1, :, :, 1] -= atom[:, :, self.nz-1, self.dim+1, self.dim+1, :, :, 2]
         atom[:, :, self.nz-1, self.dim+1, self.dim+1, :, :, 2] = 0
 
@@ -170,7 +170,7 @@ class BoundaryConditions:
 
     def temperature_bottom(self, atom, temperature):
         '''T[k] + T[k-1] = 2 * Tb'''
-        frc = self._constant_forcing_bottom(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, 2 * temperature)
+        frc = self._constant_forcing_bottom(atom, self.dim+1, self.dim+1, 2 * temperature)
         atom[:, :, 0, self.dim+1, self.dim+1, :, :, 1] -= atom[:, :, 0, self.dim+1, self.dim+1, :, :, 0]
         atom[:, :, 0, self.dim+1, self.dim+1, :, :, 0] = 0
 
@@ -181,7 +181,7 @@ class BoundaryConditions:
         h = (self.x[self.nx] - self.x[self.nx-2]) / 2
 
         c = 1 + h * biot / 2
-        frc = self._constant_forcing_east(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, -heatflux * h / c)
+        frc = self._constant_forcing_east(atom, self.dim+1, self.dim+1, -heatflux * h / c)
 
         c = (1 - h * biot / 2) / c
         atom[self.nx-1, :, :, self.dim+1, self.dim+1, 1, :, :] += c * atom[self.nx-1, :, :, self.dim+1, self.dim+1, 2, :, :]
@@ -195,7 +195,7 @@ class BoundaryConditions:
         h = (self.x[0] - self.x[-2]) / 2
 
         c = 1 - h * biot / 2
-        frc = self._constant_forcing_west(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, -heatflux * h / c)
+        frc = self._constant_forcing_west(atom, self.dim+1, self.dim+1, -heatflux * h / c)
 
         c = (1 + h * biot / 2) / c
         atom[0, :, :, self.dim+1, self.dim+1, 1, :, :] += c * atom[0, :, :, self.dim+1, self.dim+1, 0, :, :]
@@ -208,7 +208,7 @@ class BoundaryConditions:
         h = (self.y[self.ny] - self.y[self.ny-2]) / 2
 
         c = 1 + h * biot / 2
-        frc = self._constant_forcing_north(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, -heatflux * h / c)
+        frc = self._constant_forcing_north(atom, self.dim+1, self.dim+1, -heatflux * h / c)
 
         c = (1 - h * biot / 2) / c
         atom[:, self.ny-1, :, self.dim+1, self.dim+1, :, 1, :] += c * atom[:, self.ny-1, :, self.dim+1, self.dim+1, :, 2, :]
@@ -222,7 +222,7 @@ class BoundaryConditions:
         h = (self.y[0] - self.y[-2]) / 2
 
         c = 1 - h * biot / 2
-        frc = self._constant_forcing_south(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, -heatflux * h / c)
+        frc = self._constant_forcing_south(atom, self.dim+1, self.dim+1, -heatflux * h / c)
 
         c = (1 + h * biot / 2) / c
         atom[:, 0, :, self.dim+1, self.dim+1, :, 1, :] += c * atom[:, 0, :, self.dim+1, self.dim+1, :, 0, :]
@@ -235,7 +235,7 @@ class BoundaryConditions:
         h = (self.z[self.nz] - self.z[self.nz-2]) / 2
 
         c = 1 + h * biot / 2
-        frc = self._constant_forcing_top(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, -heatflux * h / c)
+        frc = self._constant_forcing_top(atom, self.dim+1, self.dim+1, -heatflux * h / c)
 
         c = (1 - h * biot / 2) / c
         atom[:, :, self.nz-1, self.dim+1, self.dim+1, :, :, 1] += c * atom[:, :, self.nz-1, self.dim+1, self.dim+1, :, :, 2]
@@ -249,7 +249,7 @@ class BoundaryConditions:
         h = (self.z[0] - self.z[-2]) / 2
 
         c = 1 - h * biot / 2
-        frc = self._constant_forcing_bottom(atom[:, :, :, :, self.dim+1, :, :, :], self.dim+1, -heatflux * h / c)
+        frc = self._constant_forcing_bottom(atom, self.dim+1, self.dim+1, -heatflux * h / c)
 
         c = (1 + h * biot / 2) / c
         atom[:, :, 0, self.dim+1, self.dim+1, :, :, 1] += c * atom[:, :, 0, self.dim+1, self.dim+1, :, :, 0]
@@ -257,41 +257,35 @@ class BoundaryConditions:
 
         return frc
 
-    def _constant_forcing(self, atom, nx, ny, var, value):
-        frc = numpy.zeros([nx, ny, self.dof])
-        for j in range(ny):
-            for i in range(nx):
-                for y in range(3):
-                    for x in range(3):
-                        frc[i, j, var] += atom[i, j, var, x, y] * value
-        return frc
+    def _constant_forcing(self, atom, d1, d2, axis, index, offset, value):
+        '''Forcing in equation d1 at the boundary at position index in the
+        direction axis that results from setting variable d2 at the
+        neighbouring position offset outside of the domain to value.'''
+
+        idx = [slice(None)] * 3
+        idx[axis] = index
+        idx = tuple(idx)
+
+        frc = self.layout.zeros()
+        for key, plane in atom.items():
+            if key[0] == d1 and key[1] == d2 and key[2 + axis] == offset:
+                frc[idx + (d1,)] += plane[idx] * value
+        return self.layout.vec(frc)
+
+    def _constant_forcing_east(self, atom, d1, d2, value):
+        return self._constant_forcing(atom, d1, d2, 0, self.nx-1, 2, value)
+
+    def _constant_forcing_west(self, atom, d1, d2, value):
+        return self._constant_forcing(atom, d1, d2, 0, 0, 0, value)
+
+    def _constant_forcing_north(self, atom, d1, d2, value):
+        return self._constant_forcing(atom, d1, d2, 1, self.ny-1, 2, value)
+
+    def _constant_forcing_south(self, atom, d1, d2, value):
+        return self._constant_forcing(atom, d1, d2, 1, 0, 0, value)
+
+    def _constant_forcing_top(self, atom, d1, d2, value):
+        return self._constant_forcing(atom, d1, d2, 2, self.nz-1, 2, value)
 
-    def _constant_forcing_east(self, atom, var, value):
-        frc = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        frc[self.nx-1, :, :, :] = self._constant_forcing(atom[self.nx-1, :, :, :, 2, :, :], self.ny, self.nz, var, value)
-        return create_state_vec(frc, self.nx, self.ny, self.nz, self.dof)
-
-    def _constant_forcing_west(self, atom, var, value):
-        frc = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        frc[0, :, :, :] = self._constant_forcing(atom[0, :, :, :, 0, :, :], self.ny, self.nz, var, value)
-        return create_state_vec(frc, self.nx, self.ny, self.nz, self.dof)
-
-    def _constant_forcing_north(self, atom, var, value):
-        frc = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        frc[:, self.ny-1, :, :] = self._constant_forcing(atom[:, self.ny-1, :, :, :, 2, :], self.nx, self.nz, var, value)
-        return create_state_vec(frc, self.nx, self.ny, self.nz, self.dof)
-
-    def _constant_forcing_south(self, atom, var, value):
-        frc = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        frc[:, 0, :, :] = self._constant_forcing(atom[:, 0, :, :, :, 0, :], self.nx, self.nz, var, value)
-        return create_state_vec(frc, self.nx, self.ny, self.nz, self.dof)
-
-    def _constant_forcing_top(self, atom, var, value):
-        frc = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        frc[:, :, self.nz-1, :] = self._constant_forcing(atom[:, :, self.nz-1, :, :, :, 2], self.nx, self.ny, var, value)
-        return create_state_vec(frc, self.nx, self.ny, self.nz, self.dof)
-
-    def _constant_forcing_bottom(self, atom, var, value):
-        frc = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        frc[:, :, 0, :] = self._constant_forcing(atom[:, :, 0, :, :, :, 0], self.nx, self.ny, var, value)
-        return create_state_vec(frc, self.nx, self.ny, self.nz, self.dof)
+    def _constant_forcing_bottom(self, atom, d1, d2, value):
+        return self._constant_forcing(atom, d1, d2, 2, 0, 0, value)
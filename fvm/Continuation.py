@@ -1,8 +1,11 @@
-import sys
 import numpy
 
 from math import sqrt
 
+from fvm.Events import create_events
+from fvm.JacobianReuse import JacobianReuse
+from fvm.JFNK import create_nonlinear_solver
+
 def norm(x):
     return sqrt(x.dot(x))
 
@@ -17,57 +20,128 @@ class Continuation:
         self.interface = interface
         self.parameters = parameters
 
+        # Timers and counters that are shared with the interface
+        self.stats = interface.stats
+
+        # Observers of the progress, see Events
+        self.events = create_events(parameters)
+
+        # Policy for reusing the Jacobian over multiple iterations and steps
+        self.jacobian_reuse = JacobianReuse(parameters)
+
+        # Jacobian-free Newton-Krylov solver if it is selected by the
+        # 'Nonlinear Solver' parameter, see JFNK
+        self.jfnk = create_nonlinear_solver(interface, parameters)
+
         self.newton_iterations = 0
         self.delta = None
         self.zeta = None
 
     def newton(self, x0, tol=1.e-7, maxit=1000):
         residual_check = self.parameters.get('Residual Check', 'F')
-        verbose = self.parameters.get('Verbose', False)
+        report = self.events.subscribed('newton_iteration')
+        want_fnorm = residual_check == 'F' or report or self.jacobian_reuse.enabled or \
+            self.jfnk is not None
+
+        if self.jfnk:
+            self.jfnk.reset()
+        self.jacobian_reuse.start()
 
+        fnorm = None
         x = x0
         for k in range(maxit):
-            fval = self.interface.rhs(x)
+            fval, jac = self._evaluate(x)
 
-            if residual_check == 'F' or verbose:
+            if want_fnorm:
                 fnorm = norm(fval)
 
             if residual_check == 'F' and fnorm < tol:
-                print('Newton converged in %d iterations with ||F||=%e' % (k, fnorm))
-                sys.stdout.flush()
+                self.events.emit('newton_converged', name='Newton', iterations=k, fnorm=fnorm)
                 break
 
-            jac = self.interface.jacobian(x)
-            dx = self.interface.solve(jac, -fval)
+            jac = self._checked_jacobian(x, jac, fnorm)
+            dx = self._solve(x, fval, jac, -fval, fnorm, tol)
 
             x = x + dx
 
-            if residual_check != 'F' or verbose:
+            self.stats.count('newton iterations')
+
+            if residual_check != 'F' or report:
                 dxnorm = norm(dx)
 
             if residual_check != 'F' and dxnorm < tol:
-                print('Newton converged in %d iterations with ||dx||=%e' % (k, dxnorm))
-                sys.stdout.flush()
+                self.events.emit('newton_converged', name='Newton', iterations=k, dxnorm=dxnorm)
                 break
 
-            if verbose:
-                print('Newton status at iteration %d: ||F||=%e, ||dx||=%e' % (k, fnorm, dxnorm))
-                sys.stdout.flush()
+            if report:
+                self.events.emit('newton_iteration', name='Newton', iteration=k, fnorm=fnorm, dxnorm=dxnorm)
 
         self.newton_iterations = k
 
         return x
 
+    def _evaluate(self, x):
+        '''Compute the residual and the Jacobian at x, where the assembly
+        of the Jacobian is skipped if a previous one is reused.'''
+
+        jac = self.jacobian_reuse.jacobian()
+        if jac is not None:
+            return self.interface.rhs(x), jac
+
+        fval, jac = self.interface.evaluate(x)
+        self.jacobian_reuse.store(jac)
+        return fval, jac
+
+    def _checked_jacobian(self, x, jac, fnorm):
+        '''The Jacobian to use at x, which is jac, unless it is a reused
+        Jacobian that no longer decreases the residual norm fnorm enough,
+        in which case a new one is computed.'''
+
+        reuse = self.jacobian_reuse
+        if reuse.contracting(fnorm):
+            if reuse.enabled and not reuse.fresh:
+                self.stats.count('jacobian reuses')
+            return jac
+
+        jac = self.interface.jacobian(x)
+        reuse.store(jac)
+        return jac
+
+    def _solve(self, x, fval, jac, rhs, fnorm, tol):
+        '''Solve the Newton system at x with right-hand side rhs, which may
+        be a block, with the Jacobian jac, or with the JFNK solver, in which
+        case jac is only used as preconditioner.'''
+
+        if not self.jfnk:
+            return self.interface.solve(jac, rhs)
+
+        op = self.jfnk.operator(x, fval)
+        y = self.jfnk.solve(op, jac, rhs, self.jfnk.forcing_term(fnorm, tol))
+        self.jacobian_reuse.update_iterations(self.jfnk.iterations)
+        return y
+
     def newtoncorrector(self, parameter_name, ds, x, x0, mu, mu0):
         residual_check = self.parameters.get('Residual Check', 'F')
-        verbose = self.parameters.get('Verbose', False)
+        report = self.events.subscribed('newton_iteration')
+        want_fnorm = residual_check == 'F' or report or self.jacobian_reuse.enabled or \
+            self.jfnk is not None
 
         # Set some parameters
         maxit = self.parameters.get('Maximum Newton Iterations', 10)
         tol = self.parameters.get('Newton Tolerance', 1e-4)
+        bordered = self.parameters.get('Bordered Solver', False)
+
+        if bordered and self.jfnk:
+            raise ValueError('The Bordered Solver can not be used with the JFNK nonlinear solver')
 
         self.newton_iterations = 0
 
+        if self.jfnk:
+            self.jfnk.reset()
+        self.jacobian_reuse.start()
+
+        fnorm = None
+
         # Do the main iteration
         for k in range(maxit):
 
@@ -75,32 +149,36 @@ class Continuation:
             self.interface.set_parameter(parameter_name, mu + self.delta)
             dflval = self.interface.rhs(x)
             self.interface.set_parameter(parameter_name, mu)
-            fval = self.interface.rhs(x)
+            fval, jac = self._evaluate(x)
             dflval = (dflval - fval) / self.delta
 
-            if residual_check == 'F' or verbose:
+            if want_fnorm:
                 fnorm = norm(fval)
 
             if residual_check == 'F' and fnorm < tol:
-                print('Newton corrector converged in %d iterations with ||F||=%e' % (k, fnorm))
-                sys.stdout.flush()
+                self.events.emit('newton_converged', name='Newton corrector', iterations=k, fnorm=fnorm)
                 break
 
-            # Compute the jacobian at x
-            jac = self.interface.jacobian(x)
+            jac = self._checked_jacobian(x, jac, fnorm)
 
             # Compute r (2.2.8)
             diff = x - x0
             rnp1 = self.zeta*diff.dot(diff) + (1 - self.zeta) * (mu - mu0) ** 2 - ds ** 2
 
-            if self.parameters.get("Bordered Solver", False):
+            if bordered:
                 # Solve the entire bordered system in one go (2.2.9)
                 dx, dmu = self.interface.solve(jac, -fval, -rnp1, dflval, 2 * self.zeta * diff,
                                                2 * (1 - self.zeta) * (mu - mu0))
             else:
-                # Solve twice with F_x (2.2.9)
-                z1 = self.interface.solve(jac, -fval)
-                z2 = self.interface.solve(jac, dflval)
+                # Solve with F_x for both right-hand sides (2.2.9), at
+                # once if the interface can solve blocks
+                if self.jfnk or getattr(self.interface, 'block_solve', False):
+                    z = self._solve(x, fval, jac, numpy.column_stack((-fval, dflval)), fnorm, tol)
+                    z1 = z[:, 0]
+                    z2 = z[:, 1]
+                else:
+                    z1 = self._solve(x, fval, jac, -fval, fnorm, tol)
+                    z2 = self._solve(x, fval, jac, dflval, fnorm, tol)
 
                 # Compute dmu (2.2.13)
                 dmu = (-rnp1 - 2 * self.zeta * diff.dot(z1)) / (2 * (1 - self.zeta) * (mu - mu0)
@@ -114,21 +192,21 @@ class Continuation:
             mu += dmu
 
             self.newton_iterations += 1
+            self.stats.count('newton corrector iterations')
 
-            if residual_check != 'F' or verbose:
+            if residual_check != 'F' or report:
                 dxnorm = norm(dx)
 
             if residual_check != 'F' and dxnorm < tol:
-                print('Newton corrector converged in %d iterations with ||dx||=%e' % (k, dxnorm))
-                sys.stdout.flush()
+                self.events.emit('newton_converged', name='Newton corrector', iterations=k, dxnorm=dxnorm)
                 break
 
-            if verbose:
-                print('Newton corrector status at iteration %d: ||F||=%e, ||dx||=%e' % (k, fnorm, dxnorm))
-                sys.stdout.flush()
+            if report:
+                self.events.emit('newton_iteration', name='Newton corrector', iteration=k, fnorm=fnorm, dxnorm=dxnorm)
 
         if self.newton_iterations == maxit:
-            print('Newton did not converge. Adjusting step size and trying again')
+            # Do not try again with the same Jacobian
+            self.jacobian_reuse.reset()
             return x0, mu0
 
         self.interface.set_parameter(parameter_name, mu)
@@ -156,9 +234,7 @@ class Continuation:
 
         for j in range(maxit):
             if abs(eigs[0].real) < tol:
-                print("Bifurcation found at %s = %f with eigenvalue %e + %ei" % (
-                    parameter_name, mu, eigs[0].real, eigs[0].imag))
-                sys.stdout.flush()
+                self.events.emit('bifurcation_found', parameter_name=parameter_name, mu=mu, x=x, eigenvalue=eigs[0])
                 break
 
             # Secant method
@@ -178,8 +254,7 @@ class Continuation:
 
         for j in range(maxit):
             if abs(target - mu) < tol:
-                print("Convergence achieved onto target %s = %f" % (parameter_name, mu))
-                sys.stdout.flush()
+                self.events.emit('target_reached', parameter_name=parameter_name, mu=mu, x=x)
                 break
 
             # Secant method
@@ -199,9 +274,13 @@ class Continuation:
         x = x0 + ds * dx
 
         # Corrector (2.2.9 and onward)
-        x, mu = self.newtoncorrector(parameter_name, ds, x, x0, mu, mu0)
+        with self.stats.timer('newton corrector'):
+            x, mu = self.newtoncorrector(parameter_name, ds, x, x0, mu, mu0)
 
         if mu == mu0:
+            self.stats.count('rejected steps')
+            self.events.emit('step_rejected', parameter_name=parameter_name, mu=mu0, ds=ds)
+
             # No convergence was achieved, adjusting the step size
             prev_ds = ds
             ds = self.adjust_step_size(ds)
@@ -210,8 +289,10 @@ class Continuation:
 
             return self.step(parameter_name, x0, mu0, dx, dmu, ds)
 
-        print("%s: %f" % (parameter_name, mu))
-        sys.stdout.flush()
+        self.stats.count('continuation steps')
+
+        self.events.emit('step_accepted', parameter_name=parameter_name, mu=mu, ds=ds, x=x,
+                         iterations=self.newton_iterations)
 
         # Set the new values computed by the corrector
         dmu = mu - mu0
@@ -251,6 +332,7 @@ class Continuation:
         # Compute the jacobian at x and solve with it (2.2.5)
         jac = self.interface.jacobian(x)
         dx = self.interface.solve(jac, -dflval)
+        self.jacobian_reuse.store(jac)
 
         # Scaling of the initial tangent (2.2.7)
         dmu = 1
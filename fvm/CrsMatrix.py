@@ -1,11 +1,18 @@
 import numpy
 
+from collections import OrderedDict
+
+from scipy import sparse
+
 class CrsMatrix:
     def __init__(self, coA=None, jcoA=None, begA=None, compress=True):
         self.coA = coA
         self.jcoA = jcoA
         self.begA = begA
 
+        self._csr = None
+        self._csr_arrays = None
+
         if compress:
             self.compress()
 
@@ -28,86 +35,151 @@ class CrsMatrix:
 
     def compress(self):
         ''' Remove zeros and merge duplicate entries, which may occur in the case of periodic
-        boundary conditions.'''
-        idx = 0
-        beg = self.begA[0]
-        for i in range(len(self.begA) - 1):
-            unique_indices, inverse_indices = numpy.unique(self.jcoA[beg:self.begA[i+1]], return_inverse=True)
+        boundary conditions. This also sorts the column indices within every row.'''
+
+        n = self.n
+        if n < 1:
+            return
+
+        begA = numpy.asarray(self.begA)
+        coA = numpy.asarray(self.coA)[:begA[-1]]
+        jcoA = numpy.asarray(self.jcoA)[:begA[-1]]
+        rows = _rows(begA)
+
+        # Stable sort, so duplicates are summed in their original order
+        idx = numpy.lexsort((jcoA, rows))
+        rows = rows[idx]
+        jcoA = jcoA[idx]
+        coA = coA[idx]
+
+        if len(idx) > 0:
+            start = numpy.ones(len(idx), dtype=bool)
+            start[1:] = (rows[1:] != rows[:-1]) | (jcoA[1:] != jcoA[:-1])
+            start = numpy.flatnonzero(start)
+
+            coA = numpy.add.reduceat(coA, start)
+            rows = rows[start]
+            jcoA = jcoA[start]
+
+        mask = abs(coA) > 1e-14
+        self.coA = coA[mask]
+        self.jcoA = jcoA[mask]
+        self.begA = _row_pointers(rows[mask], n)
+        self._csr = None
+
+    def update(self, coA):
+        '''Replace the values of the matrix while keeping the sparsity
+        pattern. The numerical factorization is discarded, but since
+        jcoA and begA are kept, solvers can still reuse anything that
+        only depends on the pattern (see same_pattern).'''
+
+        if len(coA) < self.begA[-1]:
+            raise ValueError('Expected at least %d values, got %d' % (self.begA[-1], len(coA)))
+
+        self.coA = coA
+        self.lu = None
 
-            values = numpy.zeros(len(unique_indices), dtype=self.coA.dtype)
-            for orig_idx, inverse_idx in enumerate(inverse_indices):
-                values[inverse_idx] += self.coA[beg + orig_idx]
+    def same_pattern(self, other):
+        '''Check whether the sparsity pattern of this matrix equals that of other.
+        This is cheap when the patterns are shared, which is the case for all
+        Jacobians that are computed by the same discretization.'''
 
-            for j in range(len(unique_indices)):
-                if abs(values[j]) > 1e-14:
-                    self.jcoA[idx] = unique_indices[j]
-                    self.coA[idx] = values[j]
-                    idx += 1
+        if self.jcoA is other.jcoA and self.begA is other.begA:
+            return True
 
-            beg = self.begA[i+1]
-            self.begA[i+1] = idx
+        if self.n != other.n or self.begA[-1] != other.begA[-1]:
+            return False
+
+        nnz = self.begA[-1]
+        return numpy.array_equal(self.begA, other.begA) and \
+            numpy.array_equal(self.jcoA[:nnz], other.jcoA[:nnz])
 
     def solve(self, rhs):
-        if len(rhs.shape) < 2:
-            if self.lu.L.dtype != rhs.dtype and numpy.dtype(rhs.dtype.char.upper()) == rhs.dtype:
-                x = rhs.copy()
-                x.real = self.solve(rhs.real)
-                x.imag = self.solve(rhs.imag)
-            else:
-                x = self.lu.solve(rhs)
+        '''Solve A x = rhs with the factorization in lu, where rhs may be a
+        vector or an [n, k] block of right-hand sides. All right-hand sides
+        are solved with a single call of lu.solve. A complex right-hand
+        side of a real matrix is solved as the real block [Re | Im].'''
+
+        if self.dtype != rhs.dtype and numpy.dtype(rhs.dtype.char.upper()) == rhs.dtype:
+            block = rhs.reshape(rhs.shape[0], -1)
+            k = block.shape[1]
+
+            y = self.lu.solve(numpy.hstack((block.real, block.imag)))
+
+            x = numpy.empty(block.shape, dtype=rhs.dtype)
+            x.real = y[:, :k]
+            x.imag = y[:, k:]
+            return x.reshape(rhs.shape)
+
+        return self.lu.solve(rhs)
+
+    def _merge(self, B, alpha):
+        '''Compute self + alpha * B on the union of both sparsity patterns.'''
+
+        jcoA, begA, idxA, idxB = _merge_map(self, B)
+
+        dtype = numpy.result_type(self.coA.dtype, B.coA.dtype, alpha)
+        coA = numpy.zeros(len(jcoA), dtype=dtype)
+        coA[idxA] = self.coA[:self.begA[-1]]
+        if alpha == 1:
+            coA[idxB] += B.coA[:B.begA[-1]]
         else:
-            x = rhs.copy()
-            for i in range(x.shape[1]):
-                x[:, i] = self.solve(rhs[:, i])
-        return x
+            coA[idxB] += alpha * B.coA[:B.begA[-1]]
 
-    def __add__(self, B):
-        A = CrsMatrix(self.coA[:self.begA[-1]].copy(), self.jcoA[:self.begA[-1]].copy(),
-                      self.begA.copy(), False)
+        return CrsMatrix(coA, jcoA, begA, False)
 
-        for i in range(self.n):
-            for j in range(B.begA[i], B.begA[i+1]):
-                if abs(B.coA[j]) < 1e-14:
-                    continue
-
-                found = False
-                for k in range(A.begA[i], A.begA[i+1]):
-                    if B.jcoA[j] == A.jcoA[k]:
-                        A.coA[k] += B.coA[j]
-                        found = True
-                        break
-
-                if not found:
-                    raise Exception('A does not contain the pattern of B', i,
-                                    A.jcoA[A.begA[i]:A.begA[i+1]],
-                                    B.jcoA[B.begA[i]:B.begA[i+1]])
-        return A
+    def __add__(self, B):
+        return self._merge(B, 1)
 
     def __sub__(self, B):
-        A = CrsMatrix(-B.coA[:B.begA[-1]], B.jcoA[:B.begA[-1]], B.begA, False)
-        return self + A
+        return self._merge(B, -1)
+
+    def __neg__(self):
+        return self * -1
 
     def __mul__(self, x):
-        A = CrsMatrix(self.coA[:self.begA[-1]].copy(), self.jcoA[:self.begA[-1]].copy(),
-                      self.begA.copy(), False)
+        return CrsMatrix(self.coA[:self.begA[-1]] * x, self.jcoA, self.begA, False)
 
-        for i in range(self.n):
-            for j in range(A.begA[i], A.begA[i+1]):
-                A.coA[j] *= x
-        return A
+    __rmul__ = __mul__
 
     def __truediv__(self, x):
         return self * (1 / x)
 
+    def __imul__(self, x):
+        if numpy.result_type(self.coA.dtype, x) != self.coA.dtype:
+            return self * x
+
+        self.coA *= x
+        self.lu = None
+        return self
+
+    def __itruediv__(self, x):
+        return self.__imul__(1 / x)
+
+    def to_scipy(self):
+        '''Return a SciPy CSR matrix that shares the memory of this matrix.'''
+
+        nnz = self.begA[-1]
+        if self._csr is None or self._csr_arrays[0] is not self.coA or \
+           self._csr_arrays[1] is not self.jcoA or self._csr_arrays[2] is not self.begA:
+            # Assign the arrays directly, since the constructor might
+            # convert the index arrays
+            self._csr = sparse.csr_matrix(self.shape, dtype=self.dtype)
+            self._csr.data = self.coA[:nnz]
+            self._csr.indices = self.jcoA[:nnz]
+            self._csr.indptr = self.begA
+            self._csr_arrays = (self.coA, self.jcoA, self.begA)
+
+        return self._csr
+
     def matvec(self, x):
-        b = numpy.zeros(self.n, dtype=x.dtype)
-        for i in range(self.n):
-            for j in range(self.begA[i], self.begA[i+1]):
-                b[i] += self.coA[j] * x[self.jcoA[j]]
-        return b
+        return self.to_scipy() @ x
+
+    def matmat(self, x):
+        return self.to_scipy() @ x
 
     def __matmul__(self, x):
-        return self.matvec(x)
+        return self.to_scipy() @ x
 
     def __str__(self):
         out = ''
@@ -115,3 +187,54 @@ class CrsMatrix:
             for j in range(self.begA[i], self.begA[i+1]):
                 out += '%5d %5d %e\n' % (i, self.jcoA[j], self.coA[j])
         return out
+
+
+def _rows(begA):
+    '''Row index of every entry of a CRS matrix.'''
+    return numpy.repeat(numpy.arange(len(begA) - 1), numpy.diff(begA))
+
+def _row_pointers(rows, n):
+    '''Row pointers of a CRS matrix with entries in the sorted rows.'''
+    begA = numpy.zeros(n+1, dtype=int)
+    numpy.cumsum(numpy.bincount(rows, minlength=n), out=begA[1:])
+    return begA
+
+
+# Merge maps of recently added matrices. Since the patterns of the
+# matrices are usually shared, e.g. for all Jacobians that are computed
+# by the same discretization, this prevents recomputing the union of
+# the sparsity patterns when computing J - M / dt or beta * J - alpha * M.
+_merge_maps = OrderedDict()
+_merge_maps_size = 8
+
+def _merge_map(A, B):
+    '''Compute the union of the sparsity patterns of A and B and the
+    positions of the entries of A and B in the union. A and B are
+    assumed to be compressed.'''
+
+    if A.n != B.n:
+        raise ValueError('Matrix dimensions %d and %d do not match' % (A.n, B.n))
+
+    key = (id(A.jcoA), id(A.begA), id(B.jcoA), id(B.begA))
+    cached = _merge_maps.get(key)
+    if cached is not None and cached[0] is A.jcoA and cached[1] is A.begA and \
+       cached[2] is B.jcoA and cached[3] is B.begA:
+        _merge_maps.move_to_end(key)
+        return cached[4:]
+
+    n = A.n
+    keysA = _rows(A.begA) * n + A.jcoA[:A.begA[-1]]
+    keysB = _rows(B.begA) * n + B.jcoA[:B.begA[-1]]
+    keys = numpy.union1d(keysA, keysB)
+
+    jcoA = keys % n
+    begA = _row_pointers(keys // n, n)
+    idxA = numpy.searchsorted(keys, keysA)
+    idxB = numpy.searchsorted(keys, keysB)
+
+    # Keep references to the patterns, so the ids can not be reused
+    _merge_maps[key] = (A.jcoA, A.begA, B.jcoA, B.begA, jcoA, begA, idxA, idxB)
+    if len(_merge_maps) > _merge_maps_size:
+        _merge_maps.popitem(last=False)
+
+    return jcoA, begA, idxA, idxB
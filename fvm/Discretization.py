@@ -1,9 +1,16 @@
 import numpy
 import copy
 
+from scipy.sparse import linalg
+
 from fvm import utils
 from fvm import BoundaryConditions
+from fvm import GridMetrics
 from fvm import CrsMatrix
+from fvm import Atom
+from fvm import StateLayout
+from fvm import Stats
+from fvm import kernels
 
 class Discretization:
     '''Finite volume discretization of the incompressible Navier-Stokes
@@ -87,18 +94,80 @@ class Discretization:
             self.z = utils.create_uniform_coordinate_vector(
                 self.parameters.get('zmin', 0.0), self.parameters.get('zmax', 1.0), self.nz) if z is None else z
 
+        self.metrics = GridMetrics(self.nx, self.ny, self.nz, self.x, self.y, self.z)
+        self.layout = StateLayout(self.nx, self.ny, self.nz, self.dof, self.dim)
+
+        # Timers and counters that are collected in case 'Collect
+        # Statistics' is enabled
+        self.stats = Stats(self.parameters.get('Collect Statistics', False))
+
+        # Implementation of the inner loops of the assembly, see kernels
+        self.kernels = kernels.get_kernels(self.parameters.get('Kernel Backend', 'numpy'))
+
         self.frc = None
         self.atom = None
         self.recompute_linear_part = True
+        self.recompute_forcing = True
+
+        # Forcing without the lid velocity and for a unit lid velocity
+        self._frc = None
+        self._lid_frc = None
+
+        self._mass_matrix = None
+
+        # Boundary-processed unit operators of the linear part
+        self._linear_operators = None
+
+        self._jacobian_pattern = None
+
+        # Buffers that are reused by assemble_rhs for every dtype and
+        # batch shape
+        self._rhs_workspaces = {}
+
+        # Arrays that are reused by convection_2D and convection_3D
+        self._convection_workspace = None
+
+    # Parts of the discretization that depend on a parameter, where
+    # 'operators' means the boundary-processed operators of the linear
+    # part, 'weights' the weights of these operators, 'forcing' only
+    # the boundary forcing and 'mass' only the mass matrix. Parameters
+    # that are not listed here, such as solver parameters, do not
+    # affect the discretization. The nonlinear part is recomputed in
+    # every call, so it does not need to be tracked.
+    parameter_dependencies = {
+        'Problem Type': 'operators',
+        'Biot Number': 'operators',
+        'Reynolds Number': 'weights',
+        'Rayleigh Number': 'weights',
+        'Lid Velocity': 'forcing',
+        'Prandtl Number': 'mass',
+    }
 
     def set_parameter(self, name, value):
         '''Set a parameter in self.parameters that has to be called to make
-        sure we recompute the linear part of the equation. Changing
-        the value in self.parameters from outside this class will
-        likely result in wrong answers.'''
+        sure we recompute the parts of the equation that depend on it
+        (see parameter_dependencies). Changing the value in
+        self.parameters from outside this class will likely result in
+        wrong answers.'''
 
         self.parameters[name] = value
-        self.recompute_linear_part = True
+
+        dependency = self.parameter_dependencies.get(name)
+        if dependency == 'operators':
+            self._linear_operators = None
+            self.recompute_linear_part = True
+        elif dependency == 'weights':
+            self.recompute_linear_part = True
+        elif dependency == 'forcing':
+            self.recompute_forcing = True
+        elif dependency == 'mass':
+            self._mass_matrix = None
+
+        if name == 'Collect Statistics':
+            self.stats.enabled = value
+        elif name == 'Kernel Backend':
+            self.kernels = kernels.get_kernels(value)
+            self._jacobian_pattern = None
 
     def get_parameter(self, name, default=0):
         '''Get a parameter from self.parameters.'''
@@ -108,13 +177,27 @@ class Discretization:
     def linear_part(self):
         '''Compute the linear part of the equation.'''
 
+        operators = self.linear_operators()
+        weights = self.linear_weights()
+
+        atom = operators.pop('constant')
+        for name, operator in operators.items():
+            atom += weights[name] * operator
+
+        return atom
+
+    def linear_operators(self):
+        '''Unit operators of the linear part of the equation, which is
+        the sum of these operators multiplied by the weights returned
+        by linear_weights().'''
+
         if self.dim == 2:
-            return self._linear_part_2D()
-        return self._linear_part_3D()
+            return self._linear_operators_2D()
+        return self._linear_operators_3D()
 
-    def _linear_part_2D(self):
-        '''Compute the linear part of the equation in case the domain is 2D.
-        In case Re = 0 we instead compute the linear part for the Stokes
+    def linear_weights(self):
+        '''Weights of the operators returned by linear_operators(). In
+        case Re = 0 we instead compute the linear part for the Stokes
         problem.'''
 
         Re = self.get_parameter('Reynolds Number')
@@ -123,86 +206,240 @@ class Discretization:
         if Re == 0:
             Re = 1
 
-        atom = 1 / Re * (self.u_xx() + self.u_yy()
-                         + self.v_xx() + self.v_yy()) \
-            - (self.p_x() + self.p_y()) \
-            + self.div()
+        return {'constant': 1, 'viscous': 1 / Re, 'buoyancy': Ra}
 
-        if self.dof > 3:
-            atom += self.T_xx() + self.T_yy()
-            atom += Ra * self.forward_average_T_y()
+    def _linear_operators_2D(self):
+        '''Compute the unit operators of the linear part of the equation
+        in case the domain is 2D.'''
 
-        return atom
+        operators = {}
+        operators['viscous'] = self.u_xx() + self.u_yy() + self.v_xx() + self.v_yy()
+        operators['constant'] = self.div() - (self.p_x() + self.p_y())
 
-    def _linear_part_3D(self):
-        '''Compute the linear part of the equation in case the domain is 3D.
-        In case Re = 0 we instead compute the linear part for the Stokes
-        problem.'''
+        if self.dof > 3:
+            operators['constant'] += self.T_xx() + self.T_yy()
+            operators['buoyancy'] = self.forward_average_T_y()
 
-        Re = self.get_parameter('Reynolds Number')
-        Ra = self.get_parameter('Rayleigh Number')
+        return operators
 
-        if Re == 0:
-            Re = 1
+    def _linear_operators_3D(self):
+        '''Compute the unit operators of the linear part of the equation
+        in case the domain is 3D.'''
 
-        atom = 1 / Re * (self.u_xx() + self.u_yy() + self.u_zz()
-                         + self.v_xx() + self.v_yy() + self.v_zz()
-                         + self.w_xx() + self.w_yy() + self.w_zz()) \
-            - (self.p_x() + self.p_y() + self.p_z()) \
-            + self.div()
+        operators = {}
+        operators['viscous'] = self.u_xx() + self.u_yy() + self.u_zz() \
+            + self.v_xx() + self.v_yy() + self.v_zz() \
+            + self.w_xx() + self.w_yy() + self.w_zz()
+        operators['constant'] = self.div() - (self.p_x() + self.p_y() + self.p_z())
 
         if self.dof > 4:
-            atom += self.T_xx() + self.T_yy() + self.T_zz()
+            operators['constant'] += self.T_xx() + self.T_yy() + self.T_zz()
             if self.nz > 1:
-                atom += Ra * self.forward_average_T_z()
+                operators['buoyancy'] = self.forward_average_T_z()
             else:
-                atom += Ra * self.forward_average_T_y()
+                operators['buoyancy'] = self.forward_average_T_y()
+
+        return operators
+
+    def _boundary_operators(self):
+        '''Unit operators of the linear part and their forcing after
+        applying the boundary conditions. These are computed only once
+        per grid and set of boundary conditions. The boundary conditions
+        are affine rather than linear in the atom: besides combining and
+        removing stencil entries, the no-slip conditions set the diagonal
+        of the normal velocity at the boundary to -1, whatever the atom
+        contains. Applied to an empty atom they therefore give these
+        diagonal entries. So the boundary-processed linear part is the
+        weighted sum of the boundary-processed unit operators only if we
+        subtract the boundary conditions applied to an empty atom from
+        all but the constant operator, which keeps them once.'''
+
+        if self._linear_operators is not None:
+            return self._linear_operators
+
+        self.stats.count('linear operators')
+
+        # The fixed entries that the boundary conditions set in any atom
+        zero = Atom(self.nx, self.ny, self.nz, self.dof)
+        zero_frc, zero_lid_frc = self._boundaries(zero)
+
+        self._linear_operators = {}
+        for name, atom in self.linear_operators().items():
+            frc, lid_frc = self._boundaries(atom)
+            if name != 'constant':
+                atom -= zero
+                frc -= zero_frc
+                lid_frc -= zero_lid_frc
+            self._linear_operators[name] = (atom, frc, lid_frc)
+
+        return self._linear_operators
+
+    def _compute_linear_part(self):
+        '''Compute the linear part and the forcing with boundary conditions
+        applied as the weighted sum of the cached operators. The sum is
+        accumulated in place in self.atom and self.frc. In case only
+        the lid velocity changed, only the forcing is updated.'''
 
-        return atom
+        if self.recompute_linear_part:
+            with self.stats.timer('linear part'):
+                operators = self._boundary_operators()
+                weights = self.linear_weights()
+
+                atom, frc, lid_frc = operators['constant']
+                if self.atom is None:
+                    self.atom = atom.copy()
+                    self._frc = frc.copy()
+                    self._lid_frc = lid_frc.copy()
+                else:
+                    self.atom.assign(atom)
+                    self._frc[:] = frc
+                    self._lid_frc[:] = lid_frc
+
+                for name, (atom, frc, lid_frc) in operators.items():
+                    if name != 'constant':
+                        self.atom.add_scaled(weights[name], atom)
+                        self._frc += weights[name] * frc
+                        self._lid_frc += weights[name] * lid_frc
+
+            self.recompute_linear_part = False
+            self.recompute_forcing = True
+
+        if self.recompute_forcing:
+            self.frc = self._frc + self.get_parameter('Lid Velocity', 1) * self._lid_frc
+            self.recompute_forcing = False
 
     def nonlinear_part(self, state):
         '''Compute the nonlinear part of the equation. In case Re = 0 this
-        does nothing.'''
+        does nothing. The returned atoms are part of a workspace that is
+        reused in the next call, so they should be copied if they are
+        needed after that.'''
 
-        state_mtx = utils.create_state_mtx(state, self.nx, self.ny, self.nz, self.dof)
+        state_mtx = self.layout.mtx(state)
 
         Re = self.get_parameter('Reynolds Number')
         if Re == 0:
-            state_mtx[:, :, :, :] = 0
+            state_mtx = numpy.zeros(state_mtx.shape)
 
-        if self.dim == 2:
-            return self.convection_2D(state_mtx)
-        return self.convection_3D(state_mtx)
+        with self.stats.timer('nonlinear part'):
+            if self.dim == 2:
+                return self.convection_2D(state_mtx)
+            return self.convection_3D(state_mtx)
 
-    def rhs(self, state):
-        '''Right-hand side in M * du / dt = F(u).'''
+    def rhs(self, state, parameters=None):
+        '''Right-hand side in M * du / dt = F(u). The state may also be an
+        [n, batch] array of states, in which case an [n, batch] array of
+        right-hand sides is returned. Optionally, parameters is a list
+        with a dict of parameters for every state that override the
+        parameters of the discretization for that state only.'''
 
-        if self.recompute_linear_part:
-            self.atom = self.linear_part()
-            self.frc = self.boundaries(self.atom)
-            self.recompute_linear_part = False
+        if state.ndim == 1 and parameters is None:
+            return self.evaluate(state, want_jac=False)[0]
 
-        atomJ, atomF = self.nonlinear_part(state)
-        atomF += self.atom
+        return self._batch_rhs(state, parameters)
+
+    def _batch_rhs(self, states, parameters=None):
+        '''Right-hand sides of a batch of states. The linear part is
+        applied to all states at once. In case parameters are given,
+        this is done for every unit operator separately, after which
+        the weights of every parameter set are applied. Parameters that
+        change the operators themselves can not differ within a batch.'''
+
+        if states.ndim == 1:
+            states = numpy.repeat(states[:, None], len(parameters), axis=1)
+
+        batch = states.shape[1]
+        if parameters is None:
+            parameters = [{}] * batch
+
+        if len(parameters) != batch:
+            raise ValueError('Expected %d parameter sets but got %d' % (batch, len(parameters)))
 
-        return self.assemble_rhs(state, atomF) + self.frc
+        for params in parameters:
+            for name, value in params.items():
+                if self.parameter_dependencies.get(name) == 'operators' and value != self.get_parameter(name):
+                    raise ValueError('%s can not be changed within a batch' % name)
+
+        self._compute_linear_part()
+
+        if not any(parameters):
+            out = self.assemble_rhs(states, self.atom) + self.frc[:, None]
+            contributions = []
+        else:
+            # Contract every unit operator with all states at once
+            out = numpy.zeros(states.shape, dtype=numpy.result_type(states.dtype, numpy.float64))
+            contributions = [(name, self.assemble_rhs(states, atom), frc, lid_frc)
+                             for name, (atom, frc, lid_frc) in self._boundary_operators().items()]
+
+        base_parameters = self.parameters
+        try:
+            for i, params in enumerate(parameters):
+                self.parameters = dict(base_parameters, **params)
+
+                weights = self.linear_weights()
+                lid_velocity = self.get_parameter('Lid Velocity', 1)
+                for name, rhs, frc, lid_frc in contributions:
+                    out[:, i] += weights[name] * (rhs[:, i] + frc + lid_velocity * lid_frc)
+
+                atomJ, atomF = self.nonlinear_part(states[:, i])
+                out[:, i] += self.assemble_rhs(states[:, i], atomF)
+        finally:
+            self.parameters = base_parameters
+
+        return out
 
     def jacobian(self, state):
         '''Jacobian J of F in M * du / dt = F(u).'''
 
-        if self.recompute_linear_part:
-            self.atom = self.linear_part()
-            self.frc = self.boundaries(self.atom)
-            self.recompute_linear_part = False
+        return self.evaluate(state, want_rhs=False)[1]
+
+    def evaluate(self, state, want_rhs=True, want_jac=True):
+        '''Right-hand side F and Jacobian J of F in M * du / dt = F(u)
+        computed from a single evaluation of the nonlinear part. Returns
+        the tuple (rhs, jac), where the parts that were not requested
+        are None.'''
+
+        self._compute_linear_part()
+
+        atomJ, atomF = self.nonlinear_part(state)
+
+        rhs = None
+        if want_rhs:
+            with self.stats.timer('rhs assembly'):
+                atomF += self.atom
+                rhs = self.assemble_rhs(state, atomF) + self.frc
+
+        jac = None
+        if want_jac:
+            with self.stats.timer('jacobian assembly'):
+                atomJ += self.atom
+                jac = self._fill_jacobian(atomJ)
+
+        return rhs, jac
+
+    def jacobian_operator(self, state):
+        '''Matrix-free Jacobian J of F in M * du / dt = F(u). The returned
+        LinearOperator applies the atom of the Jacobian as a stencil in
+        the same way as assemble_rhs, so the matrix is never assembled.'''
+
+        self._compute_linear_part()
 
         atomJ, atomF = self.nonlinear_part(state)
-        atomJ += self.atom
+        atomJ = atomJ + self.atom
 
-        return self.assemble_jacobian(atomJ)
+        n = self.nx * self.ny * self.nz * self.dof
+        return linalg.LinearOperator((n, n), matvec=lambda x: self.assemble_rhs(x.reshape(-1), atomJ),
+                                     dtype=numpy.float64)
 
     def mass_matrix(self):
-        '''Mass matrix M in M * du / dt = F(u).'''
+        '''Mass matrix M in M * du / dt = F(u). The matrix is cached until
+        the Prandtl number changes, so it should not be modified.'''
+
+        if self._mass_matrix is None:
+            with self.stats.timer('mass matrix assembly'):
+                self._mass_matrix = self._compute_mass_matrix()
+        return self._mass_matrix
 
+    def _compute_mass_matrix(self):
         atom = self.mass_x() + self.mass_y()
         if self.dim == 3:
             atom += self.mass_z()
@@ -229,33 +466,60 @@ class Discretization:
                         row += 1
         '''
 
+        dtype = numpy.result_type(state.dtype, numpy.float64)
+        batch = state.shape[1:]
+        state_mtx, out_mtx, tmp, channels = self._rhs_workspace(dtype, batch, atom.keys())
+
         # Put the state in shifted matrix form
-        state_mtx = numpy.zeros([self.nx+2, self.ny+2, self.nz+2, self.dof])
-        state_mtx[1:self.nx+1, 1:self.ny+1, 1:self.nz+1, :] = utils.create_state_mtx(
-            state, self.nx, self.ny, self.nz, self.dof)
+        axes = tuple(range(4, 4 + len(batch)))
+        state_mtx[:, 1:self.nx+1, 1:self.ny+1, 1:self.nz+1] = self.layout.mtx(state).transpose((3, 0, 1, 2) + axes)
 
         # Add extra borders for periodic boundary conditions
-        state_mtx[0, 1:self.ny+1, 1:self.nz+1, :] = state_mtx[self.nx, 1:self.ny+1, 1:self.nz+1, :]
-        state_mtx[self.nx+1, 1:self.ny+1, 1:self.nz+1, :] = state_mtx[1, 1:self.ny+1, 1:self.nz+1, :]
-        state_mtx[1:self.nx+1, 0, 1:self.nz+1, :] = state_mtx[1:self.nx+1, self.ny, 1:self.nz+1, :]
-        state_mtx[1:self.nx+1, self.ny+1, 1:self.nz+1, :] = state_mtx[1:self.nx+1, 1, 1:self.nz+1, :]
-        state_mtx[1:self.nx+1, 1:self.ny+1, 0, :] = state_mtx[1:self.nx+1, 1:self.ny+1, self.nz, :]
-        state_mtx[1:self.nx+1, 1:self.ny+1, self.nz+1, :] = state_mtx[1:self.nx+1, 1:self.ny+1, 1, :]
-
-        # Add up all contributions without iterating over the domain
-        out_mtx = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        for k in range(3):
-            for j in range(3):
-                for i in range(3):
-                    for d1 in range(self.dof):
-                        for d2 in range(self.dof):
-                            out_mtx[:, :, :, d1] += atom[:, :, :, d1, d2, i, j, k] \
-                                * state_mtx[i:(i+self.nx), j:(j+self.ny), k:(k+self.nz), d2]
-
-        return utils.create_state_vec(out_mtx, self.nx, self.ny, self.nz, self.dof)
+        state_mtx[:, 0, 1:self.ny+1, 1:self.nz+1] = state_mtx[:, self.nx, 1:self.ny+1, 1:self.nz+1]
+        state_mtx[:, self.nx+1, 1:self.ny+1, 1:self.nz+1] = state_mtx[:, 1, 1:self.ny+1, 1:self.nz+1]
+        state_mtx[:, 1:self.nx+1, 0, 1:self.nz+1] = state_mtx[:, 1:self.nx+1, self.ny, 1:self.nz+1]
+        state_mtx[:, 1:self.nx+1, self.ny+1, 1:self.nz+1] = state_mtx[:, 1:self.nx+1, 1, 1:self.nz+1]
+        state_mtx[:, 1:self.nx+1, 1:self.ny+1, 0] = state_mtx[:, 1:self.nx+1, 1:self.ny+1, self.nz]
+        state_mtx[:, 1:self.nx+1, 1:self.ny+1, self.nz+1] = state_mtx[:, 1:self.nx+1, 1:self.ny+1, 1]
+
+        # Add up all contributions of the active channels without
+        # iterating over the domain. In case of a batch of states, the
+        # planes are broadcast over the batch.
+        out_mtx[...] = 0
+        for key, d1, shifted_state in channels:
+            plane = atom.planes[key].reshape((self.nx, self.ny, self.nz) + (1,) * len(batch))
+            numpy.multiply(plane, shifted_state, out=tmp)
+            out_mtx[d1] += tmp
+
+        out = numpy.empty(state.shape, dtype=dtype)
+        self.layout.mtx(out)[...] = out_mtx.transpose((1, 2, 3, 0) + axes)
+        return out
+
+    def _rhs_workspace(self, dtype, batch, keys):
+        '''Buffers that are used by assemble_rhs, which are allocated once
+        per dtype and batch shape. The padded state and the result are
+        stored with the degrees of freedom first, so every channel works
+        on contiguous planes. The shifted views of the padded state are
+        only recomputed when the active channels of the atom change.'''
+
+        workspace = self._rhs_workspaces.get((dtype, batch))
+        if workspace is None:
+            state_mtx = numpy.zeros((self.dof, self.nx+2, self.ny+2, self.nz+2) + batch, dtype=dtype)
+            out_mtx = numpy.zeros((self.dof, self.nx, self.ny, self.nz) + batch, dtype=dtype)
+            tmp = numpy.zeros((self.nx, self.ny, self.nz) + batch, dtype=dtype)
+            workspace = [state_mtx, out_mtx, tmp, None, None]
+            self._rhs_workspaces[(dtype, batch)] = workspace
+
+        state_mtx = workspace[0]
+        if workspace[3] != keys:
+            workspace[3] = keys
+            workspace[4] = [((d1, d2, i, j, k), d1, state_mtx[d2, i:(i+self.nx), j:(j+self.ny), k:(k+self.nz)])
+                            for d1, d2, i, j, k in keys]
+
+        return workspace[0], workspace[1], workspace[2], workspace[4]
 
     def assemble_jacobian(self, atom):
-        '''Assemble the Jacobian. Optimized version of
+        '''Assemble the Jacobian. Vectorized version of
 
         for k in range(nz):
             for j in range(ny):
@@ -271,39 +535,150 @@ class Discretization:
                                            idx += 1
                         row += 1
                         begA[row] = idx
+
+        where the column indices are taken modulo the grid size for
+        periodic boundary conditions, and duplicate entries are merged
+        so the returned matrix is already compressed.
         '''
 
-        row = 0
-        idx = 0
+        keys = atom.keys()
+        values = atom.stack(keys)
+
+        entries, slots, jcoA, begA = self.assemble_jacobian_pattern(keys, abs(values) > 1e-14)
+        coA = numpy.bincount(slots, weights=values.reshape(-1)[entries], minlength=len(jcoA))
+
+        # Remove entries that cancelled out
+        mask = abs(coA) > 1e-14
+        if not numpy.all(mask):
+            n = len(begA) - 1
+            rows = numpy.repeat(numpy.arange(n), numpy.diff(begA))
+
+            coA = coA[mask]
+            jcoA = jcoA[mask]
+            begA = numpy.zeros(n+1, dtype=int)
+            numpy.cumsum(numpy.bincount(rows[mask], minlength=n), out=begA[1:])
+
+        return CrsMatrix(coA, jcoA, begA, False)
+
+    def assemble_jacobian_pattern(self, keys, mask):
+        '''Symbolic phase of the assembly of the Jacobian. keys contains
+        the channels (d1, d2, x, y, z) of an atom as returned by
+        Atom.keys() and mask is a [len(keys), nx * ny * nz] array that is
+        True where the values of these channels, as returned by
+        Atom.stack(keys), are nonzero. For every position where mask is
+        True, compute the index in the flattened values (entries) and
+        the position in the coA array of the CRS matrix that it
+        contributes to (slots), such that the values of the matrix can
+        be computed as
+
+        coA = numpy.bincount(slots, weights=atom.stack(keys).reshape(-1)[entries])
+
+        The entries are ordered as in assemble_jacobian so duplicate
+        entries are summed in the same order. Returns the tuple
+        (entries, slots, jcoA, begA).'''
+
         n = self.nx * self.ny * self.nz * self.dof
-        coA = numpy.zeros(27*n)
-        jcoA = numpy.zeros(27*n, dtype=int)
+        keys = numpy.array(keys, dtype=int).reshape(-1, 5)
+
+        channel, cell = numpy.nonzero(mask)
+        d1, d2, x, y, z = keys[channel].T
+
+        # The planes of the atom are stored in (i, j, k) order
+        i = cell // (self.ny * self.nz)
+        j = cell // self.nz % self.ny
+        k = cell % self.nz
+
+        # Row and column indices, including periodic neighbours
+        rows = (i + (j + k * self.ny) * self.nx) * self.dof + d1
+        columns = ((i + x - 1) % self.nx + ((j + y - 1) % self.ny + (k + z - 1) % self.nz * self.ny)
+                   * self.nx) * self.dof + d2
+
+        # Index of the entries in the flattened values
+        entries = channel * mask.shape[1] + cell
+
+        # Sort the columns within every row while keeping the order of
+        # duplicate entries, which may occur in the case of periodic
+        # boundary conditions, and merge the duplicates. Since the keys
+        # are sorted by d1 and then by (z, y, x, d2), this is the same
+        # order as in the loop in assemble_jacobian.
+        keys = rows * n + columns
+        idx = numpy.argsort(keys, kind='stable')
+
+        start = numpy.ones(len(idx), dtype=bool)
+        start[1:] = keys[idx[1:]] != keys[idx[:-1]]
+
+        slots = numpy.empty(len(idx), dtype=int)
+        slots[idx] = numpy.cumsum(start) - 1
+
+        jcoA = columns[idx[start]]
         begA = numpy.zeros(n+1, dtype=int)
+        numpy.cumsum(numpy.bincount(rows[idx[start]], minlength=n), out=begA[1:])
+
+        return entries, slots, jcoA, begA
+
+    def _fill_jacobian(self, atom):
+        '''Numeric phase of the assembly of the Jacobian. The sparsity
+        pattern is computed once and only recomputed in case the atom
+        contains nonzeros outside of the stored pattern. Entries that
+        happen to be zero are kept in the matrix so all Jacobians share
+        the same pattern.'''
+
+        if self._jacobian_pattern is not None:
+            keys, entries, slots, jcoA, begA, nslots = self._jacobian_pattern
+            values = atom.stack(keys).reshape(-1)
+            coA = self.kernels.gather_sum(values, entries, slots, nslots)
+
+            # Check that there are no values outside of the pattern
+            if self.kernels.count_nonzero(values, 1e-14) != self.kernels.count_nonzero(values, 1e-14, entries) or \
+               numpy.any(abs(coA[len(jcoA):]) > 1e-14) or \
+               any(numpy.any(abs(atom.planes[key]) > 1e-14) for key in set(atom.planes) - set(keys)):
+                # Keep the old pattern as part of the new one
+                old_keys = keys
+                keys = Atom.sorted_keys(set(keys) | set(atom.planes))
+                values = atom.stack(keys)
+                mask = abs(values) > 1e-14
+
+                ncells = values.shape[1]
+                positions = numpy.array([keys.index(key) for key in old_keys], dtype=int)
+                mask[positions[entries // ncells], entries % ncells] = True
+
+                self._jacobian_pattern = None
+        else:
+            keys = atom.keys()
+            values = atom.stack(keys)
+            mask = abs(values) > 1e-14
 
-        # Check where values are nonzero in the atoms
-        configs = []
-        for z in range(3):
-            for y in range(3):
-                for x in range(3):
-                    for d2 in range(self.dof):
-                        if numpy.any(atom[:, :, :, :, d2, x, y, z]):
-                            configs.append([d2, x, y, z])
+        if self._jacobian_pattern is None:
+            self.stats.count('jacobian pattern')
 
-        # Iterate only over configurations with values in there
-        for k in range(self.nz):
-            for j in range(self.ny):
-                for i in range(self.nx):
-                    for d1 in range(self.dof):
-                        for config in configs:
-                            if abs(atom[i, j, k, d1, config[0], config[1], config[2], config[3]]) > 1e-14:
-                                jcoA[idx] = ((i + config[1] - 1) % self.nx) * self.dof \
-                                    + ((j + config[2] - 1) % self.ny) * self.nx * self.dof + \
-                                    + ((k + config[3] - 1) % self.nz) * self.nx * self.ny * self.dof + config[0]
-                                coA[idx] = atom[i, j, k, d1, config[0], config[1], config[2], config[3]]
-                                idx += 1
-                        row += 1
-                        begA[row] = idx
-        return CrsMatrix(coA, jcoA, begA)
+            entries, slots, jcoA, begA = self.assemble_jacobian_pattern(keys, mask)
+            values = values.reshape(-1)
+            coA = numpy.bincount(slots, weights=values[entries], minlength=len(jcoA))
+
+            # Leave out positions where the contributions cancel out,
+            # which happens in the case of periodic boundary
+            # conditions. We put them at the end so we can check that
+            # this is still the case in subsequent calls.
+            keep = abs(coA) > 1e-14
+            nnz = numpy.count_nonzero(keep)
+
+            new_slots = numpy.empty(len(jcoA), dtype=int)
+            new_slots[keep] = numpy.arange(nnz)
+            new_slots[~keep] = numpy.arange(nnz, len(jcoA))
+
+            n = len(begA) - 1
+            rows = numpy.repeat(numpy.arange(n), numpy.diff(begA))
+
+            begA = numpy.zeros(n+1, dtype=int)
+            numpy.cumsum(numpy.bincount(rows[keep], minlength=n), out=begA[1:])
+
+            slots = new_slots[slots]
+            jcoA = jcoA[keep]
+            coA = coA[keep]
+
+            self._jacobian_pattern = (keys, entries, slots, jcoA, begA, len(new_slots))
+
+        return CrsMatrix(coA[:len(jcoA)], jcoA, begA, False)
 
     def assemble_mass_matrix(self, atom):
         '''Assemble the mass matrix.'''
@@ -334,27 +709,35 @@ class Discretization:
     def boundaries(self, atom):
         '''Compute boundary conditions for the currently defined problem type.'''
 
+        frc, lid_frc = self._boundaries(atom)
+        return frc + self.get_parameter('Lid Velocity', 1) * lid_frc
+
+    def _boundaries(self, atom):
+        '''Apply the boundary conditions to the atom and return the forcing
+        that does not depend on the parameters and the forcing for a unit
+        lid velocity separately.'''
+
         # TODO: Make it possible to interface this from the outside.
 
         boundary_conditions = BoundaryConditions(self.nx, self.ny, self.nz, self.dim, self.dof, self.x, self.y, self.z)
         problem_type = self.get_parameter('Problem Type', 'Lid-driven cavity')
 
         frc = numpy.zeros(self.nx * self.ny * self.nz * self.dof)
+        lid_frc = numpy.zeros(self.nx * self.ny * self.nz * self.dof)
 
         if Discretization._problem_type_equals(problem_type, 'Lid-driven cavity'):
-            v = self.get_parameter('Lid Velocity', 1)
             boundary_conditions.no_slip_east(atom)
             boundary_conditions.no_slip_west(atom)
 
             boundary_conditions.no_slip_south(atom)
             if self.dim == 2 or self.nz <= 1:
-                frc += boundary_conditions.moving_lid_north(atom, v)
-                return frc
+                lid_frc += boundary_conditions.moving_lid_north(atom, 1)
+                return frc, lid_frc
 
             boundary_conditions.no_slip_north(atom)
 
             boundary_conditions.no_slip_bottom(atom)
-            frc += boundary_conditions.moving_lid_top(atom, v)
+            lid_frc += boundary_conditions.moving_lid_top(atom, 1)
         elif Discretization._problem_type_equals(problem_type, 'Rayleigh-Benard'):
             frc += boundary_conditions.heatflux_east(atom, 0)
             frc += boundary_conditions.heatflux_west(atom, 0)
@@ -367,7 +750,7 @@ class Discretization:
                 frc += boundary_conditions.temperature_south(atom, 1)
                 boundary_conditions.free_slip_north(atom)
                 boundary_conditions.no_slip_south(atom)
-                return frc
+                return frc, lid_frc
 
             frc += boundary_conditions.heatflux_north(atom, 0)
             frc += boundary_conditions.heatflux_south(atom, 0)
@@ -397,264 +780,143 @@ class Discretization:
         else:
             raise Exception('Invalid problem type %s' % problem_type)
 
-        return frc
+        return frc, lid_frc
 
     # Below are all of the discretizations of separate parts of
     # equations that we can solve using FVM. This takes into account
     # non-uniform grids. New discretizations such as derivatives have
-    # to be implemented in a similar way.
+    # to be implemented in a similar way. The grid spacings are taken
+    # from self.metrics and are broadcast over the whole grid. The
+    # static methods are written for the x-direction and return the
+    # stencil at the offsets (0, 1, 2), where None means that there is
+    # no contribution. They are reused for the other directions by
+    # passing the spacings in a different order.
+
+    def _stencil(self, d1, d2, axis, values):
+        '''Atom that contains the stencil values in the direction axis
+        for the contribution of variable d2 to equation d1.'''
+
+        atom = Atom(self.nx, self.ny, self.nz, self.dof)
+        for offset, value in enumerate(values):
+            if value is None:
+                continue
+
+            idx = [1, 1, 1]
+            idx[axis] = offset
+            atom.channel(d1, d2, *idx)[:, :, :] = value
+        return atom
 
     @staticmethod
-    def _u_xx(atom, i, j, k, x, y, z):
-        # distance between u[i] and u[i-1]
-        dx = x[i] - x[i-1]
-        # distance between u[i+1] and u[i]
-        dxp1 = x[i+1] - x[i]
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
+    def _u_xx(dx, dxp1, dy, dz):
+        # dx: distance between u[i] and u[i-1]
+        # dxp1: distance between u[i+1] and u[i]
+        # dy: volume size in the y direction
+        # dz: volume size in the z direction
 
         # second order finite difference
-        atom[0] = 1 / dx * dy * dz
-        atom[2] = 1 / dxp1 * dy * dz
-        atom[1] = -atom[0] - atom[2]
+        west = 1 / dx * dy * dz
+        east = 1 / dxp1 * dy * dz
+        return (west, -west - east, east)
 
     def u_xx(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_xx(atom[i, j, k, 0, 0, :, 1, 1], i, j, k, self.x, self.y, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(0, 0, 0, Discretization._u_xx(g.dx, g.dxp1, g.dy, g.dz))
 
     def v_yy(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_xx(atom[i, j, k, 1, 1, 1, :, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(1, 1, 1, Discretization._u_xx(g.dy, g.dyp1, g.dx, g.dz))
 
     def w_zz(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_xx(atom[i, j, k, 2, 2, 1, 1, :], k, j, i, self.z, self.y, self.x)
-        return atom
+        g = self.metrics
+        return self._stencil(2, 2, 2, Discretization._u_xx(g.dz, g.dzp1, g.dy, g.dx))
 
     @staticmethod
-    def _u_yy(atom, i, j, k, x, y, z):
-        # distance between u[j] and u[j-1]
-        dy = (y[j] - y[j-2]) / 2
-        # distance between u[j+1] and u[j]
-        dyp1 = (y[j+1] - y[j-1]) / 2
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
+    def _u_yy(dx, dy, dyp1, dz):
+        # dx: volume size in the x direction
+        # dy: distance between u[j] and u[j-1]
+        # dyp1: distance between u[j+1] and u[j]
+        # dz: volume size in the z direction
 
         # second order finite difference
-        atom[0] = 1 / dy * dx * dz
-        atom[2] = 1 / dyp1 * dx * dz
-        atom[1] = -atom[0] - atom[2]
+        south = 1 / dy * dx * dz
+        north = 1 / dyp1 * dx * dz
+        return (south, -south - north, north)
 
     def u_yy(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_yy(atom[i, j, k, 0, 0, 1, :, 1], i, j, k, self.x, self.y, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(0, 0, 1, Discretization._u_yy(g.hx, g.hym1, g.hy, g.dz))
 
     def v_xx(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_yy(atom[i, j, k, 1, 1, :, 1, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(1, 1, 0, Discretization._u_yy(g.hy, g.hxm1, g.hx, g.dz))
 
     def w_yy(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_yy(atom[i, j, k, 2, 2, 1, :, 1], k, j, i, self.z, self.y, self.x)
-        return atom
+        g = self.metrics
+        return self._stencil(2, 2, 1, Discretization._u_yy(g.hz, g.hym1, g.hy, g.dx))
 
     @staticmethod
-    def _u_zz(atom, i, j, k, x, y, z):
-        # distance between u[k] and u[k-1]
-        dz = (z[k] - z[k-2]) / 2
-        # distance between u[k+1] and u[k]
-        dzp1 = (z[k+1] - z[k-1]) / 2
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
+    def _u_zz(dx, dy, dz, dzp1):
+        # dx: volume size in the x direction
+        # dy: volume size in the y direction
+        # dz: distance between u[k] and u[k-1]
+        # dzp1: distance between u[k+1] and u[k]
 
         # second order finite difference
-        atom[0] = 1 / dz * dx * dy
-        atom[2] = 1 / dzp1 * dx * dy
-        atom[1] = -atom[0] - atom[2]
+        bottom = 1 / dz * dx * dy
+        top = 1 / dzp1 * dx * dy
+        return (bottom, -bottom - top, top)
 
     def u_zz(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_zz(atom[i, j, k, 0, 0, 1, 1, :], i, j, k, self.x, self.y, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(0, 0, 2, Discretization._u_zz(g.hx, g.dy, g.hzm1, g.hz))
 
     def v_zz(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_zz(atom[i, j, k, 1, 1, 1, 1, :], j, i, k, self.y, self.x, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(1, 1, 2, Discretization._u_zz(g.hy, g.dx, g.hzm1, g.hz))
 
     def w_xx(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._u_zz(atom[i, j, k, 2, 2, :, 1, 1], k, j, i, self.z, self.y, self.x)
-        return atom
-
-    @staticmethod
-    def _T_xx(atom, i, j, k, x, y, z):
-        # distance between T[i] and T[i-1]
-        dx = (x[i] - x[i-2]) / 2
-        # distance between T[i+1] and T[i]
-        dxp1 = (x[i+1] - x[i-1]) / 2
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
-
-        # second order finite difference
-        atom[0] = 1 / dx * dy * dz
-        atom[2] = 1 / dxp1 * dy * dz
-        atom[1] = -atom[0] - atom[2]
+        g = self.metrics
+        return self._stencil(2, 2, 0, Discretization._u_zz(g.hz, g.dy, g.hxm1, g.hx))
 
     def T_xx(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._T_xx(atom[i, j, k, self.dim+1, self.dim+1, :, 1, 1], i, j, k, self.x, self.y, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(self.dim+1, self.dim+1, 0, Discretization._u_xx(g.hxm1, g.hx, g.dy, g.dz))
 
     def T_yy(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._T_xx(atom[i, j, k, self.dim+1, self.dim+1, 1, :, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(self.dim+1, self.dim+1, 1, Discretization._u_xx(g.hym1, g.hy, g.dx, g.dz))
 
     def T_zz(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._T_xx(atom[i, j, k, self.dim+1, self.dim+1, 1, 1, :], k, j, i, self.z, self.y, self.x)
-        return atom
+        g = self.metrics
+        return self._stencil(self.dim+1, self.dim+1, 2, Discretization._u_xx(g.hzm1, g.hz, g.dy, g.dx))
 
     @staticmethod
-    def _forward_u_x(atom, i, j, k, x, y, z):
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
-
+    def _forward_u_x(area):
         # forward difference
-        atom[2] = dy * dz
-        atom[1] = -atom[2]
+        return (None, -area, area)
 
     def p_x(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_u_x(atom[i, j, k, 0, self.dim, :, 1, 1], i, j, k, self.x, self.y, self.z)
-        return atom
+        return self._stencil(0, self.dim, 0, Discretization._forward_u_x(self.metrics.area_x))
 
     def p_y(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_u_x(atom[i, j, k, 1, self.dim, 1, :, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        return self._stencil(1, self.dim, 1, Discretization._forward_u_x(self.metrics.area_y))
 
     def p_z(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_u_x(atom[i, j, k, 2, self.dim, 1, 1, :], k, j, i, self.z, self.y, self.x)
-        return atom
+        return self._stencil(2, self.dim, 2, Discretization._forward_u_x(self.metrics.area_z))
 
     @staticmethod
-    def _backward_u_x(atom, i, j, k, x, y, z):
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
-
+    def _backward_u_x(area):
         # backward difference
-        atom[1] = dy * dz
-        atom[0] = -atom[1]
+        return (-area, area, None)
 
     def u_x(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_x(atom[i, j, k, self.dim, 0, :, 1, 1], i, j, k, self.x, self.y, self.z)
-        return atom
+        return self._stencil(self.dim, 0, 0, Discretization._backward_u_x(self.metrics.area_x))
 
     def v_y(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_x(atom[i, j, k, self.dim, 1, 1, :, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        return self._stencil(self.dim, 1, 1, Discretization._backward_u_x(self.metrics.area_y))
 
     def w_z(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_x(atom[i, j, k, self.dim, 2, 1, 1, :], k, j, i, self.z, self.y, self.x)
-        return atom
-
-    @staticmethod
-    def _backward_u_y(atom, i, j, k, x, y, z):
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
-
-        # backward difference
-        atom[1] = dx * dz
-        atom[0] = -atom[1]
-
-    @staticmethod
-    def _backward_u_z(atom, i, j, k, x, y, z):
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-
-        # backward difference
-        atom[1] = dx * dy
-        atom[0] = -atom[1]
+        return self._stencil(self.dim, 2, 2, Discretization._backward_u_x(self.metrics.area_z))
 
     def div(self):
         if self.dim == 2:
@@ -662,115 +924,63 @@ class Discretization:
         return self.u_x() + self.v_y() + self.w_z()
 
     @staticmethod
-    def _forward_average_x(atom, i, j, k, x, y, z):
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
+    def _forward_average_x(dx, dy, dz):
+        # dx: volume size in the x direction
+        # dy: volume size in the y direction
+        # dz: volume size in the z direction
 
         # forward average
-        atom[1] = dx * dy * dz / 2
-        atom[2] = atom[1]
+        value = dx * dy * dz / 2
+        return (None, value, value)
 
     def forward_average_T_y(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_average_x(atom[i, j, k, 1, self.dim+1, 1, :, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(1, self.dim+1, 1, Discretization._forward_average_x(g.hy, g.dx, g.dz))
 
     def forward_average_T_z(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_average_x(atom[i, j, k, 2, self.dim+1, 1, 1, :], k, j, i, self.z, self.y, self.x)
-        return atom
+        g = self.metrics
+        return self._stencil(2, self.dim+1, 2, Discretization._forward_average_x(g.hz, g.dy, g.dx))
 
     @staticmethod
-    def _backward_average_x(atom, i, j, k, x, y, z):
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
+    def _backward_average_x(dx, dy, dz):
+        # dx: volume size in the x direction
+        # dy: volume size in the y direction
+        # dz: volume size in the z direction
 
-        # forward average
-        atom[0] = dx * dy * dz / 2
-        atom[1] = atom[0]
+        # backward average
+        value = dx * dy * dz / 2
+        return (value, value, None)
 
     def backward_average_v_y(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_average_x(atom[i, j, k, self.dim+1, 1, 1, :, 1], j, i, k, self.y, self.x, self.z)
-        return atom
+        g = self.metrics
+        return self._stencil(self.dim+1, 1, 1, Discretization._backward_average_x(g.hy, g.dx, g.dz))
 
     def backward_average_w_z(self):
-        atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_average_x(atom[i, j, k, self.dim+1, 2, 1, 1, :], k, j, i, self.z, self.y, self.x)
-        return atom
-
-    @staticmethod
-    def _mass_x(atom, i, j, k, x, y, z):
-        # volume size in the x direction
-        dx = (x[i+1] - x[i-1]) / 2
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
-
-        atom[0] = dx * dy * dz
+        g = self.metrics
+        return self._stencil(self.dim+1, 2, 2, Discretization._backward_average_x(g.hz, g.dy, g.dx))
 
     def mass_x(self):
+        g = self.metrics
         atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._mass_x(atom[i, j, k, 0:1], i, j, k, self.x, self.y, self.z)
+        atom[:, :, :, 0] = g.hx * g.dy * g.dz
         return atom
 
     def mass_y(self):
+        g = self.metrics
         atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._mass_x(atom[i, j, k, 1:2], j, i, k, self.y, self.x, self.z)
+        atom[:, :, :, 1] = g.hy * g.dx * g.dz
         return atom
 
     def mass_z(self):
+        g = self.metrics
         atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._mass_x(atom[i, j, k, 2:3], k, j, i, self.z, self.y, self.x)
+        atom[:, :, :, 2] = g.hz * g.dy * g.dx
         return atom
 
-    @staticmethod
-    def _mass_T(atom, i, j, k, x, y, z):
-        # volume size in the x direction
-        dx = x[i] - x[i-1]
-        # volume size in the y direction
-        dy = y[j] - y[j-1]
-        # volume size in the z direction
-        dz = z[k] - z[k-1]
-
-        atom[0] = dx * dy * dz
-
     def mass_T(self):
+        g = self.metrics
         atom = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._mass_T(atom[i, j, k, self.dim+1:self.dim+2], i, j, k, self.x, self.y, self.z)
+        atom[:, :, :, self.dim+1] = g.dx * g.dy * g.dz
         return atom
 
     @staticmethod
@@ -806,140 +1016,116 @@ class Discretization:
                         atomJ[idx[0], idx[1], idx[2]] -= coef1 * coef2
 
     @staticmethod
-    def _convection_u_v(atomJ, atomF, averages, weighted_averages, bil, varU, varV, dim, nx, i):
-        for d1 in range(3):
-            i2 = i + d1 - 1
-
-            v_x = bil[i, :, :, 2, varU, varV, d1]
-            if not numpy.any(v_x):
-                continue
-
-            coef1 = weighted_averages[i2, :, :, varU, varV] * v_x
-            for d2 in range(3):
-                coef2 = bil[i2, :, :, 0, varV, varU, d2]
-                if numpy.any(coef2):
-                    idx = [1, 1, 1]
-                    idx[varU] += d1 - 1
-                    idx[varU] += d2 - 1
-                    atomF[i, :, :, varV, varV, idx[0], idx[1], idx[2]] -= coef1 * coef2
-
-            coef1 = averages[i2, :, :, varV, varU] * v_x
-            for d2 in range(3):
-                coef2 = bil[i2, :, :, 1, varU, varV, d2]
-                if numpy.any(coef2):
-                    idx = [1, 1, 1]
-                    idx[varU] += d1 - 1
-                    idx[varV if varV < dim else varU] += d2 - 1
-                    atomJ[i, :, :, varV, varU, idx[0], idx[1], idx[2]] -= coef1 * coef2
-
-    @staticmethod
-    def _convection_v_u(atomJ, atomF, averages, weighted_averages, bil, varV, varU, dim, ny, j):
-        for d1 in range(3):
-            j2 = j + d1 - 1
-
-            u_y = bil[:, j, :, 2, varV, varU, d1]
-            if not numpy.any(u_y):
-                continue
-
-            coef1 = weighted_averages[:, j2, :, varV, varU] * u_y
-            for d2 in range(3):
-                coef2 = bil[:, j2, :, 0, varU, varV, d2]
-                if numpy.any(coef2):
-                    idx = [1, 1, 1]
-                    idx[varV] += d1 - 1
-                    idx[varV] += d2 - 1
-                    atomF[:, j, :, varU, varU, idx[0], idx[1], idx[2]] -= coef1 * coef2
-
-            coef1 = averages[:, j2, :, varU, varV] * u_y
-            for d2 in range(3):
-                coef2 = bil[:, j2, :, 1, varV, varU, d2]
-                if numpy.any(coef2):
-                    idx = [1, 1, 1]
-                    idx[varV] += d1 - 1
-                    idx[varU if varU < dim else varV] += d2 - 1
-                    atomJ[:, j, :, varU, varV, idx[0], idx[1], idx[2]] -= coef1 * coef2
-
-    @staticmethod
-    def _convection_w_u(atomJ, atomF, averages, weighted_averages, bil, varW, varU, dim, nz, k):
+    def _convection(atomJ, atomF, averages, weighted_averages, bil, axis, var, dim, kernels):
+        '''Convection of var in the direction of axis on the whole grid.
+        The neighbours i + d1 - 1 of the grid points i at the boundary
+        that lie outside of the grid do not contribute, since these
+        contributions are removed in ConvectiveTerm.boundary_*, so we
+        can use shifted slices of the grid. The inner loops are done by
+        kernels (see the kernels module).'''
+
+        n = bil.shape[axis]
         for d1 in range(3):
-            k2 = k + d1 - 1
-
-            u_z = bil[:, :, k, 2, varW, varU, d1]
-            if not numpy.any(u_z):
+            sl = [slice(None)] * 3
+            sl2 = [slice(None)] * 3
+            sl[axis] = slice(max(1 - d1, 0), min(n + 1 - d1, n))
+            sl2[axis] = slice(sl[axis].start + d1 - 1, sl[axis].stop + d1 - 1)
+            sl = tuple(sl)
+            sl2 = tuple(sl2)
+
+            v_x = bil[sl + (2, axis, var, d1)]
+            if not kernels.any_nonzero(v_x):
                 continue
 
-            coef1 = weighted_averages[:, :, k2, varW, varU] * u_z
+            coef1 = weighted_averages[sl2 + (axis, var)] * v_x
             for d2 in range(3):
-                coef2 = bil[:, :, k2, 0, varU, varW, d2]
-                if numpy.any(coef2):
+                coef2 = bil[sl2 + (0, var, axis, d2)]
+                if kernels.any_nonzero(coef2):
                     idx = [1, 1, 1]
-                    idx[varW] += d1 - 1
-                    idx[varW] += d2 - 1
-                    atomF[:, :, k, varU, varU, idx[0], idx[1], idx[2]] -= coef1 * coef2
+                    idx[axis] += d1 - 1
+                    idx[axis] += d2 - 1
+                    kernels.subtract_product(atomF.channel(var, var, *idx)[sl], coef1, coef2)
 
-            coef1 = averages[:, :, k2, varU, varW] * u_z
+            coef1 = averages[sl2 + (var, axis)] * v_x
             for d2 in range(3):
-                coef2 = bil[:, :, k2, 1, varW, varU, d2]
-                if numpy.any(coef2):
+                coef2 = bil[sl2 + (1, axis, var, d2)]
+                if kernels.any_nonzero(coef2):
                     idx = [1, 1, 1]
-                    idx[varW] += d1 - 1
-                    idx[varU if varU < dim else varW] += d2 - 1
-                    atomJ[:, :, k, varU, varW, idx[0], idx[1], idx[2]] -= coef1 * coef2
+                    idx[axis] += d1 - 1
+                    idx[var if var < dim else axis] += d2 - 1
+                    kernels.subtract_product(atomJ.channel(var, axis, *idx)[sl], coef1, coef2)
 
     def convection_u_u(self, atomJ, atomF, averages, weighted_averages, bil):
-        for i in range(self.nx):
-            Discretization._convection_u_v(atomJ, atomF, averages, weighted_averages, bil, 0, 0, self.dim, self.nx, i)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 0, 0, self.dim, self.kernels)
 
     def convection_v_u(self, atomJ, atomF, averages, weighted_averages, bil):
-        for j in range(self.ny):
-            Discretization._convection_v_u(atomJ, atomF, averages, weighted_averages, bil, 1, 0, self.dim, self.ny, j)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 1, 0, self.dim, self.kernels)
 
     def convection_w_u(self, atomJ, atomF, averages, weighted_averages, bil):
-        for k in range(self.nz):
-            Discretization._convection_w_u(atomJ, atomF, averages, weighted_averages, bil, 2, 0, self.dim, self.nz, k)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 2, 0, self.dim, self.kernels)
 
     def convection_u_v(self, atomJ, atomF, averages, weighted_averages, bil):
-        for i in range(self.nx):
-            Discretization._convection_u_v(atomJ, atomF, averages, weighted_averages, bil, 0, 1, self.dim, self.nx, i)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 0, 1, self.dim, self.kernels)
 
     def convection_v_v(self, atomJ, atomF, averages, weighted_averages, bil):
-        for j in range(self.ny):
-            Discretization._convection_v_u(atomJ, atomF, averages, weighted_averages, bil, 1, 1, self.dim, self.ny, j)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 1, 1, self.dim, self.kernels)
 
     def convection_w_v(self, atomJ, atomF, averages, weighted_averages, bil):
-        for k in range(self.nz):
-            Discretization._convection_w_u(atomJ, atomF, averages, weighted_averages, bil, 2, 1, self.dim, self.nz, k)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 2, 1, self.dim, self.kernels)
 
     def convection_u_w(self, atomJ, atomF, averages, weighted_averages, bil):
-        for i in range(self.nx):
-            Discretization._convection_u_v(atomJ, atomF, averages, weighted_averages, bil, 0, 2, self.dim, self.nx, i)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 0, 2, self.dim, self.kernels)
 
     def convection_v_w(self, atomJ, atomF, averages, weighted_averages, bil):
-        for j in range(self.ny):
-            Discretization._convection_v_u(atomJ, atomF, averages, weighted_averages, bil, 1, 2, self.dim, self.ny, j)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 1, 2, self.dim, self.kernels)
 
     def convection_w_w(self, atomJ, atomF, averages, weighted_averages, bil):
-        for k in range(self.nz):
-            Discretization._convection_w_u(atomJ, atomF, averages, weighted_averages, bil, 2, 2, self.dim, self.nz, k)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 2, 2, self.dim, self.kernels)
 
     def convection_T_u(self, atomJ, atomF, averages, weighted_averages, bil):
-        for i in range(self.nx):
-            Discretization._convection_u_v(atomJ, atomF, averages, weighted_averages, bil, 0, self.dim+1, self.dim, self.nx, i)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 0, self.dim+1, self.dim, self.kernels)
 
     def convection_T_v(self, atomJ, atomF, averages, weighted_averages, bil):
-        for j in range(self.ny):
-            Discretization._convection_v_u(atomJ, atomF, averages, weighted_averages, bil, 1, self.dim+1, self.dim, self.ny, j)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 1, self.dim+1, self.dim, self.kernels)
 
     def convection_T_w(self, atomJ, atomF, averages, weighted_averages, bil):
-        for k in range(self.nz):
-            Discretization._convection_w_u(atomJ, atomF, averages, weighted_averages, bil, 2, self.dim+1, self.dim, self.nz, k)
+        Discretization._convection(atomJ, atomF, averages, weighted_averages, bil, 2, self.dim+1, self.dim, self.kernels)
 
-    def convection_2D(self, state):
-        bil = numpy.zeros([self.nx, self.ny, self.nz, 3, self.dof, self.dof, 3])
-        averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
-        weighted_averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
+    def convection_workspace(self):
+        '''Arrays and atoms that are used by convection_2D and
+        convection_3D. These are allocated in the first call and reused
+        afterwards, in which case only the parts that are written by
+        ConvectiveTerm and the stored channels of the atoms are reset.'''
+
+        if self._convection_workspace is None:
+            bil = numpy.zeros([self.nx, self.ny, self.nz, 3, self.dof, self.dof, 3])
+            averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
+            weighted_averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
+
+            convective_term = ConvectiveTerm(self.nx, self.ny, self.nz, self.dim, self.x, self.y, self.z, self.metrics)
+
+            atomJ = Atom(self.nx, self.ny, self.nz, self.dof)
+            atomF = Atom(self.nx, self.ny, self.nz, self.dof)
+
+            self._convection_workspace = (convective_term, bil, averages, weighted_averages, atomJ, atomF)
+            return self._convection_workspace
+
+        convective_term, bil, averages, weighted_averages, atomJ, atomF = self._convection_workspace
 
-        convective_term = ConvectiveTerm(self.nx, self.ny, self.nz, self.dim, self.x, self.y, self.z)
+        # Only the velocities and the temperature are used in the
+        # convective terms
+        n = self.dim + 2 if self.dof > self.dim + 1 else self.dim
+        bil[:, :, :, :, 0:n, 0:n, :] = 0
+        averages[:, :, :, 0:n, 0:n] = 0
+        weighted_averages[:, :, :, 0:n, 0:n] = 0
+
+        atomJ.zero()
+        atomF.zero()
+
+        return self._convection_workspace
+
+    def convection_2D(self, state):
+        convective_term, bil, averages, weighted_averages, atomJ, atomF = self.convection_workspace()
 
         convective_term.backward_average_x(bil[:, :, :, :, 0, :, :], averages[:, :, :, 0, :],
                                            weighted_averages[:, :, :, 0, :], state[:, :, :, 0]) # tMxU
@@ -974,9 +1160,6 @@ class Discretization:
         convective_term.boundary_north(bil)
         convective_term.boundary_south(bil)
 
-        atomJ = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        atomF = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-
         self.convection_u_u(atomJ, atomF, averages, weighted_averages, bil)
         self.convection_u_v(atomJ, atomF, averages, weighted_averages, bil)
         self.convection_v_u(atomJ, atomF, averages, weighted_averages, bil)
@@ -995,11 +1178,7 @@ class Discretization:
         return (atomJ, atomF)
 
     def convection_3D(self, state):
-        bil = numpy.zeros([self.nx, self.ny, self.nz, 3, self.dof, self.dof, 3])
-        averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
-        weighted_averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
-
-        convective_term = ConvectiveTerm(self.nx, self.ny, self.nz, self.dim, self.x, self.y, self.z)
+        convective_term, bil, averages, weighted_averages, atomJ, atomF = self.convection_workspace()
 
         convective_term.backward_average_x(bil[:, :, :, :, 0, :, :], averages[:, :, :, 0, :],
                                            weighted_averages[:, :, :, 0, :], state[:, :, :, 0]) # tMxU
@@ -1056,9 +1235,6 @@ class Discretization:
         convective_term.boundary_top(bil)
         convective_term.boundary_bottom(bil)
 
-        atomJ = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        atomF = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-
         self.convection_u_u(atomJ, atomF, averages, weighted_averages, bil)
         self.convection_u_v(atomJ, atomF, averages, weighted_averages, bil)
         self.convection_u_w(atomJ, atomF, averages, weighted_averages, bil)
@@ -1085,7 +1261,7 @@ class Discretization:
 
 class ConvectiveTerm:
 
-    def __init__(self, nx, ny, nz, dim, x, y, z):
+    def __init__(self, nx, ny, nz, dim, x, y, z, metrics=None):
         self.nx = nx
         self.ny = ny
         self.nz = nz
@@ -1096,6 +1272,10 @@ class ConvectiveTerm:
         self.y = y
         self.z = z
 
+        if metrics is None:
+            metrics = GridMetrics(nx, ny, nz, x, y, z)
+        self.metrics = metrics
+
     def backward_average_x(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 0, 0:2] = 1/2
         bil[:, :, :, 1, 0, 0:2] = 1/2
@@ -1105,28 +1285,25 @@ class ConvectiveTerm:
 
         weighted_averages[:, :, :, 0] = averages[:, :, :, 0]
 
-    def _forward_average_x(self, bil, averages, state, i):
-        # distance between u[i] and u[i-1]
-        dxmh = self.x[i] - self.x[i-1]
-        # distance between u[i+1] and u[i]
-        dxph = self.x[i+1] - self.x[i]
-        # distance between v[i+1] and v[i]
-        dx = (self.x[i+1] - self.x[i-1]) / 2
-
-        bil[i, :, :, 1, 0, 1] += 1/2 * dxmh / dx
-        bil[i, :, :, 1, 0, 2] += 1/2 * dxph / dx
-
-        averages[i, :, :, 0] += 1/2 * state[i, :, :] * dxmh / dx
-        averages[i, :, :, 0] += 1/2 * state[i+1, :, :] * dxph / dx
-
     def forward_average_x(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 0, 1:3] = 1/2
 
         averages[0:self.nx-1, :, :, 0] += 1/2 * state[0:self.nx-1, :, :]
         averages[0:self.nx-1, :, :, 0] += 1/2 * state[1:self.nx, :, :]
 
-        for i in range(self.nx-1):
-            self._forward_average_x(bil, weighted_averages, state, i)
+        g = self.metrics
+        # distance between u[i] and u[i-1]
+        dxmh = g.dx[0:self.nx-1, :, :]
+        # distance between u[i+1] and u[i]
+        dxph = g.dxp1[0:self.nx-1, :, :]
+        # distance between v[i+1] and v[i]
+        dx = g.hx[0:self.nx-1, :, :]
+
+        bil[0:self.nx-1, :, :, 1, 0, 1] += 1/2 * dxmh / dx
+        bil[0:self.nx-1, :, :, 1, 0, 2] += 1/2 * dxph / dx
+
+        weighted_averages[0:self.nx-1, :, :, 0] += 1/2 * state[0:self.nx-1, :, :] * dxmh / dx
+        weighted_averages[0:self.nx-1, :, :, 0] += 1/2 * state[1:self.nx, :, :] * dxph / dx
 
     def backward_average_y(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 1, 0:2] = 1/2
@@ -1137,28 +1314,25 @@ class ConvectiveTerm:
 
         weighted_averages[:, :, :, 1] = averages[:, :, :, 1]
 
-    def _forward_average_y(self, bil, averages, state, j):
-        # distance between v[j] and v[j-1]
-        dymh = self.y[j] - self.y[j-1]
-        # distance between v[j+1] and v[j]
-        dyph = self.y[j+1] - self.y[j]
-        # distance between u[j+1] and u[j]
-        dy = (self.y[j+1] - self.y[j-1]) / 2
-
-        bil[:, j, :, 1, 1, 1] += 1/2 * dymh / dy
-        bil[:, j, :, 1, 1, 2] += 1/2 * dyph / dy
-
-        averages[:, j, :, 1] += 1/2 * state[:, j, :] * dymh / dy
-        averages[:, j, :, 1] += 1/2 * state[:, j+1, :] * dyph / dy
-
     def forward_average_y(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 1, 1:3] = 1/2
 
         averages[:, 0:self.ny-1, :, 1] += 1/2 * state[:, 0:self.ny-1, :]
         averages[:, 0:self.ny-1, :, 1] += 1/2 * state[:, 1:self.ny, :]
 
-        for j in range(self.ny-1):
-            self._forward_average_y(bil, weighted_averages, state, j)
+        g = self.metrics
+        # distance between v[j] and v[j-1]
+        dymh = g.dy[:, 0:self.ny-1, :]
+        # distance between v[j+1] and v[j]
+        dyph = g.dyp1[:, 0:self.ny-1, :]
+        # distance between u[j+1] and u[j]
+        dy = g.hy[:, 0:self.ny-1, :]
+
+        bil[:, 0:self.ny-1, :, 1, 1, 1] += 1/2 * dymh / dy
+        bil[:, 0:self.ny-1, :, 1, 1, 2] += 1/2 * dyph / dy
+
+        weighted_averages[:, 0:self.ny-1, :, 1] += 1/2 * state[:, 0:self.ny-1, :] * dymh / dy
+        weighted_averages[:, 0:self.ny-1, :, 1] += 1/2 * state[:, 1:self.ny, :] * dyph / dy
 
     def backward_average_z(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 2, 0:2] = 1/2
@@ -1169,28 +1343,25 @@ class ConvectiveTerm:
 
         weighted_averages[:, :, :, 2] = averages[:, :, :, 2]
 
-    def _forward_average_z(self, bil, averages, state, k):
-        # distance between w[k] and w[k-1]
-        dzmh = self.z[k] - self.z[k-1]
-        # distance between w[k+1] and w[k]
-        dzph = self.z[k+1] - self.z[k]
-        # distance between u[k+1] and u[k]
-        dz = (self.z[k+1] - self.z[k-1]) / 2
-
-        bil[:, :, k, 1, 2, 1] += 1/2 * dzmh / dz
-        bil[:, :, k, 1, 2, 2] += 1/2 * dzph / dz
-
-        averages[:, :, k, 2] += 1/2 * state[:, :, k] * dzmh / dz
-        averages[:, :, k, 2] += 1/2 * state[:, :, k+1] * dzph / dz
-
     def forward_average_z(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 2, 1:3] = 1/2
 
         averages[:, :, 0:self.nz-1, 2] += 1/2 * state[:, :, 0:self.nz-1]
         averages[:, :, 0:self.nz-1, 2] += 1/2 * state[:, :, 1:self.nz]
 
-        for k in range(self.nz-1):
-            self._forward_average_z(bil, weighted_averages, state, k)
+        g = self.metrics
+        # distance between w[k] and w[k-1]
+        dzmh = g.dz[:, :, 0:self.nz-1]
+        # distance between w[k+1] and w[k]
+        dzph = g.dzp1[:, :, 0:self.nz-1]
+        # distance between u[k+1] and u[k]
+        dz = g.hz[:, :, 0:self.nz-1]
+
+        bil[:, :, 0:self.nz-1, 1, 2, 1] += 1/2 * dzmh / dz
+        bil[:, :, 0:self.nz-1, 1, 2, 2] += 1/2 * dzph / dz
+
+        weighted_averages[:, :, 0:self.nz-1, 2] += 1/2 * state[:, :, 0:self.nz-1] * dzmh / dz
+        weighted_averages[:, :, 0:self.nz-1, 2] += 1/2 * state[:, :, 1:self.nz] * dzph / dz
 
     def value_u(self, bil, averages, weighted_averages, state):
         bil[:, :, :, 0, 0, 1] = 1
@@ -1210,77 +1381,59 @@ class ConvectiveTerm:
         averages[:, :, 0:self.nz-1, 2] = state[:, :, 0:self.nz-1, 2]
         weighted_averages[:, :, :, 2] = averages[:, :, :, 2]
 
+    @staticmethod
+    def _set_stencil(bil, values):
+        for offset, value in enumerate(values):
+            if value is not None:
+                bil[:, :, :, offset] = value
+
     def u_x(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_u_x(bil[i, j, k, 2, 0, 0, :], i, j, k, self.x, self.y, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 0, 0, :], Discretization._forward_u_x(g.area_x))
 
     def v_y(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_u_x(bil[i, j, k, 2, 1, 1, :], j, i, k, self.y, self.x, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 1, 1, :], Discretization._forward_u_x(g.area_y))
 
     def w_z(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._forward_u_x(bil[i, j, k, 2, 2, 2, :], k, j, i, self.z, self.y, self.x)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 2, 2, :], Discretization._forward_u_x(g.area_z))
 
     def u_y(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_y(bil[i, j, k, 2, 1, 0, :], i, j, k, self.x, self.y, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 1, 0, :], Discretization._backward_u_x(g.hx * g.dz))
 
     def v_x(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_y(bil[i, j, k, 2, 0, 1, :], j, i, k, self.y, self.x, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 0, 1, :], Discretization._backward_u_x(g.hy * g.dz))
 
     def w_y(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_y(bil[i, j, k, 2, 1, 2, :], k, j, i, self.z, self.y, self.x)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 1, 2, :], Discretization._backward_u_x(g.hz * g.dx))
 
     def u_z(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_z(bil[i, j, k, 2, 2, 0, :], i, j, k, self.x, self.y, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 2, 0, :], Discretization._backward_u_x(g.hx * g.dy))
 
     def v_z(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_z(bil[i, j, k, 2, 2, 1, :], j, i, k, self.y, self.x, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 2, 1, :], Discretization._backward_u_x(g.hy * g.dx))
 
     def w_x(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_z(bil[i, j, k, 2, 0, 2, :], k, j, i, self.z, self.y, self.x)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 0, 2, :], Discretization._backward_u_x(g.hz * g.dy))
 
     def T_x(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_x(bil[i, j, k, 2, 0, self.dim+1, :], i, j, k, self.x, self.y, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 0, self.dim+1, :], Discretization._backward_u_x(g.area_x))
 
     def T_y(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_x(bil[i, j, k, 2, 1, self.dim+1, :], j, i, k, self.y, self.x, self.z)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 1, self.dim+1, :], Discretization._backward_u_x(g.area_y))
 
     def T_z(self, bil):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                for k in range(self.nz):
-                    Discretization._backward_u_x(bil[i, j, k, 2, 2, self.dim+1, :], k, j, i, self.z, self.y, self.x)
+        g = self.metrics
+        ConvectiveTerm._set_stencil(bil[:, :, :, 2, 2, self.dim+1, :], Discretization._backward_u_x(g.area_z))
 
     def boundary_east(self, bil):
         tmp = numpy.copy(bil[self.nx-1, :, :, 0, 0, 0, 0])
@@ -0,0 +1,108 @@
+import sys
+
+class Events:
+    '''Observers of the progress of a continuation or time integration.
+    Callbacks are subscribed to an event by name and are called with
+    the payload of the event as keyword arguments, e.g.
+
+    def callback(parameter_name, mu, **kwargs):
+        ...
+
+    events.subscribe('step_accepted', callback)
+
+    The events that are emitted are
+
+    newton_iteration: name, iteration, fnorm, dxnorm
+    newton_converged: name, iterations, fnorm or dxnorm
+    step_accepted: parameter_name, mu, ds, x, iterations
+    step_rejected: parameter_name, mu, ds
+    target_reached: parameter_name, mu, x
+    bifurcation_found: parameter_name, mu, x, eigenvalue
+    time_step: t, dt, x
+
+    Events without subscribers are not emitted, and quantities that are
+    only needed for an event, like the norms in newton_iteration, are
+    not computed if nobody subscribed to it.'''
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def subscribe(self, event, callback):
+        self.callbacks.setdefault(event, []).append(callback)
+
+    def unsubscribe(self, event, callback):
+        self.callbacks[event].remove(callback)
+        if not self.callbacks[event]:
+            del self.callbacks[event]
+
+    def subscribed(self, event):
+        return event in self.callbacks
+
+    def emit(self, event, **payload):
+        callbacks = self.callbacks.get(event)
+        if not callbacks:
+            return
+
+        for callback in callbacks:
+            callback(**payload)
+
+class Logger:
+    '''Default observer that writes the progress to stdout. The output
+    is not flushed after every message unless flush is set, so it does
+    not force synchronization of the output in parallel runs. The status
+    of every Newton iteration is only written if verbose is set.'''
+
+    def __init__(self, verbose=False, stream=None, flush=False):
+        self.verbose = verbose
+        self.stream = stream
+        self.flush = flush
+
+    def attach(self, events):
+        if self.verbose:
+            events.subscribe('newton_iteration', self.newton_iteration)
+        events.subscribe('newton_converged', self.newton_converged)
+        events.subscribe('step_accepted', self.step_accepted)
+        events.subscribe('step_rejected', self.step_rejected)
+        events.subscribe('target_reached', self.target_reached)
+        events.subscribe('bifurcation_found', self.bifurcation_found)
+        events.subscribe('time_step', self.time_step)
+
+    def write(self, message):
+        stream = self.stream or sys.stdout
+        stream.write(message + '\n')
+        if self.flush:
+            stream.flush()
+
+    def newton_iteration(self, name, iteration, fnorm, dxnorm, **kwargs):
+        self.write('%s status at iteration %d: ||F||=%e, ||dx||=%e' % (name, iteration, fnorm, dxnorm))
+
+    def newton_converged(self, name, iterations, fnorm=None, dxnorm=None, **kwargs):
+        if fnorm is not None:
+            self.write('%s converged in %d iterations with ||F||=%e' % (name, iterations, fnorm))
+        else:
+            self.write('%s converged in %d iterations with ||dx||=%e' % (name, iterations, dxnorm))
+
+    def step_accepted(self, parameter_name, mu, **kwargs):
+        self.write('%s: %f' % (parameter_name, mu))
+
+    def step_rejected(self, **kwargs):
+        self.write('Newton did not converge. Adjusting step size and trying again')
+
+    def target_reached(self, parameter_name, mu, **kwargs):
+        self.write('Convergence achieved onto target %s = %f' % (parameter_name, mu))
+
+    def bifurcation_found(self, parameter_name, mu, eigenvalue, **kwargs):
+        self.write('Bifurcation found at %s = %f with eigenvalue %e + %ei' % (
+            parameter_name, mu, eigenvalue.real, eigenvalue.imag))
+
+    def time_step(self, t, **kwargs):
+        self.write('t = %f' % t)
+
+def create_events(parameters):
+    '''Events with the default Logger attached, unless the 'Silent'
+    parameter is set.'''
+
+    events = Events()
+    if not parameters.get('Silent', False):
+        Logger(parameters.get('Verbose', False)).attach(events)
+    return events
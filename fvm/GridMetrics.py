@@ -0,0 +1,41 @@
+import numpy
+
+class GridMetrics:
+    '''Grid spacings of a (possibly non-uniform) Arakawa C-grid defined
+    by the coordinate vectors x, y and z, which contain the positions of
+    the right/north/top faces of the grid cells, followed by three
+    points outside of the domain (see utils.create_uniform_coordinate_vector).
+
+    All quantities are stored as arrays that can be broadcast to the
+    shape [nx, ny, nz] of the grid, so stencils can be computed for the
+    whole grid at once, e.g. dy * dz / dx for u_xx.'''
+
+    def __init__(self, nx, ny, nz, x, y, z):
+        self.nx = nx
+        self.ny = ny
+        self.nz = nz
+
+        # width of the cells x[i] - x[i-1], width of the next cells
+        # x[i+1] - x[i], distance between the cell centers
+        # (x[i+1] - x[i-1]) / 2 and distance to the previous cell
+        # center (x[i] - x[i-2]) / 2
+        self.dx, self.dxp1, self.hx, self.hxm1 = GridMetrics._spacings(x, nx, (nx, 1, 1))
+        self.dy, self.dyp1, self.hy, self.hym1 = GridMetrics._spacings(y, ny, (1, ny, 1))
+        self.dz, self.dzp1, self.hz, self.hzm1 = GridMetrics._spacings(z, nz, (1, 1, nz))
+
+        # areas of the faces of the grid cells
+        self.area_x = self.dy * self.dz
+        self.area_y = self.dx * self.dz
+        self.area_z = self.dx * self.dy
+
+    @staticmethod
+    def _spacings(x, n, shape):
+        x = numpy.asarray(x)
+        i = numpy.arange(n)
+
+        d = x[i] - x[i-1]
+        dp1 = x[i+1] - x[i]
+        h = (x[i+1] - x[i-1]) / 2
+        hm1 = (x[i] - x[i-2]) / 2
+
+        return d.reshape(shape), dp1.reshape(shape), h.reshape(shape), hm1.reshape(shape)
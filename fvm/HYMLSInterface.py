@@ -53,6 +53,9 @@ class Interface(fvm.Interface):
     with the C-grid discretization. The subdomains will be distributed
     over multiple processors if MPI is used to run the application.'''
 
+    # The right-hand sides of solve are single Epetra vectors
+    block_solve = False
+
     def __init__(self, comm, parameters, nx, ny, nz, dim, dof, x=None, y=None, z=None):
         fvm.Interface.__init__(self, parameters, nx, ny, nz, dim, dof)
 
@@ -136,6 +139,7 @@ class Interface(fvm.Interface):
         self.nz = self.nz_local
         self.discretization = fvm.Discretization(self.parameters, self.nx_local, self.ny_local, self.nz_local,
                                                  self.dim, self.dof, x, y, z)
+        self.stats = self.discretization.stats
 
         self.jac = None
         self.mass = None
@@ -283,24 +287,42 @@ class Interface(fvm.Interface):
         '''Right-hand side in M * du / dt = F(u) defined on the
         non-overlapping discretization domain map.'''
 
-        state_ass = Vector(self.assembly_map)
-        state_ass.Import(state, self.assembly_importer, Epetra.Insert)
-
-        rhs = fvm.Interface.rhs(self, state_ass)
-        rhs_ass = Vector(Epetra.Copy, self.assembly_map, rhs)
-        rhs = Vector(self.map)
-        rhs.Export(rhs_ass, self.assembly_importer, Epetra.Zero)
-        return rhs
+        return self.evaluate(state, want_jac=False)[0]
 
     def jacobian(self, state):
         '''Jacobian J of F in M * du / dt = F(u) defined on the
         domain map used by HYMLS.'''
 
+        return self.evaluate(state, want_rhs=False)[1]
+
+    def evaluate(self, state, want_rhs=True, want_jac=True):
+        '''Right-hand side F and Jacobian J of F in M * du / dt = F(u)
+        computed at the same time, so the state has to be imported only
+        once. Returns the tuple (rhs, jac), where the parts that were
+        not requested are None.'''
+
         state_ass = Vector(self.assembly_map)
         state_ass.Import(state, self.assembly_importer, Epetra.Insert)
 
-        local_jac = fvm.Interface.jacobian(self, state_ass)
+        local_rhs, local_jac = fvm.Interface.evaluate(self, state_ass, want_rhs, want_jac)
+
+        rhs = None
+        if want_rhs:
+            rhs = self._export_rhs(local_rhs)
+
+        jac = None
+        if want_jac:
+            jac = self._export_jacobian(local_jac)
+
+        return rhs, jac
+
+    def _export_rhs(self, local_rhs):
+        rhs_ass = Vector(Epetra.Copy, self.assembly_map, local_rhs)
+        rhs = Vector(self.map)
+        rhs.Export(rhs_ass, self.assembly_importer, Epetra.Zero)
+        return rhs
 
+    def _export_jacobian(self, local_jac):
         if self.jac is None:
             self.jac = Epetra.FECrsMatrix(Epetra.Copy, self.solve_map, 27)
         else:
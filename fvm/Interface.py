@@ -4,6 +4,8 @@ from scipy import sparse
 from scipy.sparse import linalg
 
 from fvm import Discretization
+from fvm import CrsMatrix
+from fvm.LinearSolvers import create_linear_solver
 
 class Interface:
     '''This class defines an interface to the NumPy backend for the
@@ -12,6 +14,9 @@ class Interface:
     about the underlying methods such as the solvers that are present
     in the backend we are interfacing with.'''
 
+    # Whether solve accepts [n, k] blocks of right-hand sides
+    block_solve = True
+
     def __init__(self, parameters, nx, ny, nz, dim, dof, x=None, y=None, z=None):
         self.nx = nx
         self.ny = ny
@@ -22,10 +27,20 @@ class Interface:
 
         self.parameters = parameters
 
+        # Timers and counters that are shared with the discretization
+        self.stats = self.discretization.stats
+
         # Solver caching
         self._lu = None
         self._prec = None
 
+        # Solver that is selected by the 'Linear Solver' parameter
+        # sublist, which is created on first use
+        self.linear_solver = None
+
+        # Pattern of the matrix that is passed to the linear solver
+        self._factorization_pattern = None
+
         # Eigenvalue solver caching
         self._subspaces = None
 
@@ -39,20 +54,68 @@ class Interface:
         '''Get a parameter from self.parameters through the discretization.'''
         return self.discretization.get_parameter(name)
 
-    def rhs(self, state):
-        '''Right-hand side in M * du / dt = F(u).'''
-        return self.discretization.rhs(state)
+    def rhs(self, state, parameters=None):
+        '''Right-hand side in M * du / dt = F(u). The state may also be an
+        [n, batch] array of states with optionally a list of parameter
+        sets, one for every state (see Discretization.rhs).'''
+        with self.stats.timer('rhs'):
+            return self.discretization.rhs(state, parameters)
 
     def jacobian(self, state):
         '''Jacobian J of F in M * du / dt = F(u).'''
-        return self.discretization.jacobian(state)
+        with self.stats.timer('jacobian'):
+            return self.discretization.jacobian(state)
+
+    def evaluate(self, state, want_rhs=True, want_jac=True):
+        '''Right-hand side F and Jacobian J of F in M * du / dt = F(u)
+        computed at the same time. Returns the tuple (rhs, jac), where
+        the parts that were not requested are None.'''
+        with self.stats.timer('evaluate'):
+            return self.discretization.evaluate(state, want_rhs, want_jac)
+
+    def jacobian_operator(self, state):
+        '''Matrix-free Jacobian J of F in M * du / dt = F(u) as a LinearOperator.'''
+        return self.discretization.jacobian_operator(state)
 
     def mass_matrix(self):
         '''Mass matrix M in M * du / dt = F(u).'''
-        return self.discretization.mass_matrix()
+        with self.stats.timer('mass matrix'):
+            return self.discretization.mass_matrix()
+
+    def solve(self, jac, x, x2=None, V=None, W=None, C=None):
+        '''Solve J y = x for y with the possibility of solving a bordered
+        system
+
+        [J   V] [y ]   [x ]
+        [W^T C] [y2] = [x2]
+
+        for scalar x2 and C, in which case the tuple (y, y2) is returned.'''
+        with self.stats.timer('solve'):
+            if x2 is None:
+                return self._solve(jac, x)
+
+            return self._solve_bordered(jac, x, x2, V, W, C)
+
+    def _solve_bordered(self, jac, x, x2, V, W, C):
+        '''Solve the bordered system by block elimination, which requires
+        one factorization of J and one solve with J for the two right-hand
+        sides x and V.'''
+
+        z = self._solve(jac, numpy.column_stack((x, V)))
+
+        y2 = (x2 - W.dot(z[:, 0])) / (C - W.dot(z[:, 1]))
+        y = z[:, 0] - y2 * z[:, 1]
+
+        return y, y2
+
+    def _solve(self, jac, x):
+        if len(x.shape) > 1 and self.parameters.get('Use Iterative Solver', False):
+            # The iterative solver handles one right-hand side at a time
+            out = numpy.empty(x.shape, dtype=numpy.result_type(jac.dtype, x.dtype))
+            for i in range(x.shape[1]):
+                out[:, i] = self._solve(jac, x[:, i])
+            return out
 
-    def solve(self, jac, x):
-        '''Solve J y = x for y.'''
         rhs = x.copy()
 
         # Fix one pressure node
@@ -66,47 +129,81 @@ class Interface:
         # direct solver as preconditioner
         if self._prec and jac.dtype == rhs.dtype and jac.dtype == self._prec.dtype and \
            self.parameters.get('Use Iterative Solver', False):
-            out, info = linalg.gmres(jac, rhs, restart=5, maxiter=1, tol=1e-8, atol=0, M=self._prec)
+            callback = None
+            if self.stats.enabled:
+                callback = lambda residual: self.stats.count('gmres iterations')
+
+            with self.stats.timer('gmres'):
+                out, info = linalg.gmres(jac, rhs, restart=5, maxiter=1, tol=1e-8, atol=0, M=self._prec,
+                                         callback=callback, callback_type='pr_norm')
             if info == 0:
                 return out
 
+            self.stats.count('gmres failures')
+
         # Use a direct solver instead
+        if self.linear_solver is None:
+            self.linear_solver = create_linear_solver(self.parameters.get('Linear Solver', {}), self.stats,
+                                                      (self.nx, self.ny, self.nz, self.dim, self.dof))
+
         if not jac.lu:
-            coA = jac.coA
-            jcoA = jac.jcoA
-            begA = jac.begA
-
-            # Fix one pressure node
-            if self.dof > self.dim:
-                coA = numpy.zeros(jac.begA[-1], dtype=jac.coA.dtype)
-                jcoA = numpy.zeros(jac.begA[-1], dtype=int)
-                begA = numpy.zeros(len(jac.begA), dtype=int)
-
-                idx = 0
-                for i in range(len(jac.begA)-1):
-                    if i == self.dim:
-                        coA[idx] = -1.0
-                        jcoA[idx] = i
-                        idx += 1
-                        begA[i+1] = idx
-                        continue
-                    for j in range(jac.begA[i], jac.begA[i+1]):
-                        if jac.jcoA[j] != self.dim:
-                            coA[idx] = jac.coA[j]
-                            jcoA[idx] = jac.jcoA[j]
-                            idx += 1
-                    begA[i+1] = idx
-
-            # Convert the matrix to CSC format since splu expects that
-            A = sparse.csr_matrix((coA, jcoA, begA)).tocsc()
-
-            jac.lu = linalg.splu(A)
+            jac.lu = self.linear_solver.setup(self._factorization_matrix(jac))
 
             # Cache the factorization for use in the iterative solver
             self._lu = jac.lu
             self._prec = linalg.LinearOperator((jac.n, jac.n), matvec=self._lu.solve, dtype=jac.dtype)
 
-        return jac.solve(rhs)
+        with self.stats.timer(self.linear_solver.solve_timer):
+            return jac.solve(rhs)
+
+    def _factorization_matrix(self, jac):
+        '''The matrix that is passed to the linear solver in CSC format, in
+        which one pressure node is fixed by replacing its row by -1 on the
+        diagonal and removing its column, since the pressure is only
+        determined up to a constant.
+
+        The pattern of this matrix, and the positions of the entries of
+        jac in it, are computed only once for Jacobians that share the same
+        pattern, after which only the values have to be gathered.'''
+
+        pattern = self._factorization_pattern
+        if pattern is None or not jac.same_pattern(pattern[0]):
+            pattern = self._factorization_pattern = (CrsMatrix(None, jac.jcoA, jac.begA, False), ) + \
+                self._compute_factorization_pattern(jac)
+
+        entries, indices, indptr = pattern[1:]
+
+        nnz = jac.begA[-1]
+        values = numpy.empty(nnz + 1, dtype=jac.coA.dtype)
+        values[:nnz] = jac.coA[:nnz]
+        values[nnz] = -1
+
+        return sparse.csc_matrix((values[entries], indices, indptr), shape=jac.shape)
+
+    def _compute_factorization_pattern(self, jac):
+        '''Symbolic phase of _factorization_matrix. Returns the positions of
+        the entries of the CSC matrix in jac.coA, where position nnz is
+        used for the fixed pressure node, and the indices and indptr of
+        the CSC matrix.'''
+
+        n = jac.n
+        nnz = jac.begA[-1]
+        rows = numpy.repeat(numpy.arange(n), numpy.diff(jac.begA))
+        columns = jac.jcoA[:nnz]
+        entries = numpy.arange(nnz)
+
+        # Fix one pressure node
+        if self.dof > self.dim:
+            keep = (rows != self.dim) & (columns != self.dim)
+            entries = numpy.append(entries[keep], nnz)
+            rows = numpy.append(rows[keep], self.dim)
+            columns = numpy.append(columns[keep], self.dim)
+
+        idx = numpy.lexsort((rows, columns))
+        indptr = numpy.zeros(n+1, dtype=numpy.int32)
+        numpy.cumsum(numpy.bincount(columns, minlength=n), out=indptr[1:])
+
+        return entries[idx], rows[idx].astype(numpy.int32), indptr
 
     def eigs(self, state, return_eigenvectors=False):
         '''Compute the generalized eigenvalues of beta * J(x) * v = alpha * M * v.'''
@@ -125,10 +222,11 @@ class Interface:
         tol = parameters.get('Tolerance', 1e-7)
         num = parameters.get('Number of Eigenvalues', 5)
 
-        result = jdqz.jdqz(jac_op, mass_op, num, tol=tol, subspace_dimensions=subspace_dimensions, target=target,
-                           interface=jada_interface, arithmetic='complex', prec=jada_interface.shifted_prec,
-                           return_eigenvectors=return_eigenvectors, return_subspaces=True,
-                           initial_subspaces=self._subspaces)
+        with self.stats.timer('eigs'):
+            result = jdqz.jdqz(jac_op, mass_op, num, tol=tol, subspace_dimensions=subspace_dimensions, target=target,
+                               interface=jada_interface, arithmetic='complex', prec=jada_interface.shifted_prec,
+                               return_eigenvectors=return_eigenvectors, return_subspaces=True,
+                               initial_subspaces=self._subspaces)
 
         if return_eigenvectors:
             alpha, beta, v, q, z = result
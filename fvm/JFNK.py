@@ -0,0 +1,184 @@
+import numpy
+
+from math import sqrt
+
+from scipy.sparse import linalg
+
+from fvm.LinearSolvers import krylov_tolerance
+
+def norm(x):
+    return sqrt(x.dot(x))
+
+class JFNK:
+    '''Linear solves of the Jacobian-free Newton-Krylov method, which is
+    selected with the 'Nonlinear Solver' parameter of the continuation
+    and time integration. The Newton systems are solved with GMRES using
+    only the action of the Jacobian, preconditioned by a solve with a
+    previously computed Jacobian, which is lagged by the JacobianReuse
+    policy. The preconditioner uses the 'Linear Solver' of the interface,
+    so a lagged factorization by default, or the SIMPLE block
+    preconditioner if its 'Type' is 'SIMPLE' or 'SIMPLEC'. Parameters
+    from the 'JFNK' parameter sublist:
+
+    'Jacobian Action': 'Analytic' (default), which applies the Jacobian
+    as a stencil (see Interface.jacobian_operator), or 'Finite
+    Difference', which uses finite differences of the right-hand side.
+    'Forcing Term': relative tolerance of GMRES, which is either a
+    number, or 'Eisenstat-Walker' (default) for the forcing terms of
+    Eisenstat and Walker (choice 2) with 'Initial Forcing Term' (default
+    0.1) and 'Maximum Forcing Term' (default 0.9).
+    'Maximum Iterations': maximum number of restarts of GMRES (default 10).
+    'Restart': number of iterations after which GMRES is restarted
+    (default 30).
+
+    The bordered system of the continuation can not be solved with JFNK,
+    so it can not be combined with the 'Bordered Solver' parameter.'''
+
+    def __init__(self, interface, parameters):
+        self.interface = interface
+        self.parameters = parameters
+        self.stats = interface.stats
+
+        self.jacobian_action = parameters.get('Jacobian Action', 'Analytic').lower()
+        if self.jacobian_action not in ('analytic', 'finite difference'):
+            raise ValueError('Unknown Jacobian action ' + parameters.get('Jacobian Action'))
+
+        # Number of GMRES iterations of the last solve
+        self.iterations = 0
+
+        self.reset()
+
+    def reset(self):
+        '''Start a new Newton iteration for the forcing terms.'''
+
+        self.eta = None
+        self.fnorm = None
+
+    def forcing_term(self, fnorm, tol=0):
+        '''Relative tolerance of the linear solves in a Newton iteration
+        with residual norm fnorm. It is bounded from below by 0.5 tol / fnorm,
+        so the linear systems are not solved more accurately than needed
+        to reach the Newton tolerance tol.'''
+
+        forcing_term = self.parameters.get('Forcing Term', 'Eisenstat-Walker')
+        if not isinstance(forcing_term, str):
+            return forcing_term
+
+        eta_max = self.parameters.get('Maximum Forcing Term', 0.9)
+        gamma = 0.9
+
+        if self.eta is None:
+            eta = self.parameters.get('Initial Forcing Term', 0.1)
+        else:
+            eta = gamma * (fnorm / self.fnorm) ** 2
+
+            # Safeguard against a sudden decrease of the forcing term
+            if gamma * self.eta ** 2 > 0.1:
+                eta = max(eta, gamma * self.eta ** 2)
+
+        eta = min(eta, eta_max)
+        if fnorm > 0:
+            eta = max(eta, min(0.5 * tol / fnorm, eta_max))
+
+        self.eta = eta
+        self.fnorm = fnorm
+        return eta
+
+    def operator(self, state, fval=None, mass=None, shift=0):
+        '''The Jacobian J - shift * M at state as a LinearOperator, with one
+        pressure node fixed in the same way as in Interface.solve. The
+        right-hand side fval at state is needed for finite differences.'''
+
+        interface = self.interface
+        n = len(state)
+
+        if self.jacobian_action == 'analytic':
+            jac_op = interface.jacobian_operator(state)
+            matvec = jac_op.matvec
+        else:
+            if fval is None:
+                fval = interface.rhs(state)
+
+            state_norm = norm(state)
+
+            def matvec(v):
+                v = v.reshape(-1)
+                vnorm = norm(v)
+                if vnorm == 0:
+                    return numpy.zeros(n)
+
+                eps = sqrt(numpy.finfo(float).eps) * (1 + state_norm) / vnorm
+                return (interface.rhs(state + eps * v) - fval) / eps
+
+        pressure = interface.dim if interface.dof > interface.dim else None
+
+        def pinned_matvec(v):
+            v = v.reshape(-1)
+            if pressure is not None:
+                w = v.copy()
+                w[pressure] = 0
+            else:
+                w = v
+
+            y = matvec(w)
+            if shift:
+                y = y - shift * (mass @ w)
+
+            if pressure is not None:
+                y[pressure] = -v[pressure]
+            return y
+
+        return linalg.LinearOperator((n, n), matvec=pinned_matvec, dtype=numpy.float64)
+
+    def solve(self, op, jac, rhs, eta):
+        '''Solve op y = rhs with GMRES with relative tolerance eta,
+        preconditioned by a solve with jac, where rhs may be a vector or
+        an [n, k] block of right-hand sides.'''
+
+        if len(rhs.shape) > 1:
+            y = numpy.empty(rhs.shape)
+            iterations = 0
+            for i in range(rhs.shape[1]):
+                y[:, i] = self.solve(op, jac, rhs[:, i], eta)
+                iterations = max(iterations, self.iterations)
+            self.iterations = iterations
+            return y
+
+        rhs = rhs.copy()
+        if self.interface.dof > self.interface.dim:
+            rhs[self.interface.dim] = 0
+
+        prec = linalg.LinearOperator(op.shape, matvec=lambda v: self.interface.solve(jac, v.reshape(-1)),
+                                     dtype=numpy.float64)
+
+        self.iterations = 0
+
+        def callback(residual):
+            self.iterations += 1
+
+        kwargs = dict(krylov_tolerance(eta), atol=0, restart=self.parameters.get('Restart', 30),
+                      maxiter=self.parameters.get('Maximum Iterations', 10), M=prec,
+                      callback=callback, callback_type='pr_norm')
+
+        with self.stats.timer('jfnk'):
+            y, info = linalg.gmres(op, rhs, **kwargs)
+
+        self.stats.count('jfnk iterations', self.iterations)
+        if info != 0:
+            self.stats.count('jfnk failures')
+
+        return y
+
+def create_nonlinear_solver(interface, parameters):
+    '''The JFNK solver if the 'Nonlinear Solver' parameter is 'JFNK', or
+    None for the default 'Newton', in which case the Newton systems are
+    solved with the Jacobian matrix.'''
+
+    name = parameters.get('Nonlinear Solver', 'Newton')
+    if name.lower() == 'newton':
+        return None
+
+    if name.lower() == 'jfnk':
+        return JFNK(interface, parameters.get('JFNK', {}))
+
+    raise ValueError('Unknown nonlinear solver ' + name)
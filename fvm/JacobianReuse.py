@@ -0,0 +1,109 @@
+class JacobianReuse:
+    '''Policy for reusing the Jacobian, and with it its factorization,
+    over multiple Newton iterations and continuation or time steps
+    (chord or Shamanskii method). It is enabled with the 'Jacobian
+    Reuse' parameter. A new Jacobian is computed after it has been used
+    'Maximum Jacobian Age' times (default 10), or after an iteration in
+    which the residual norm did not decrease by at least a factor
+    'Contraction Threshold' (default 0.5). Since the convergence is only
+    linear, 'Maximum Newton Iterations' of the continuation may have to
+    be increased.
+
+    The policy is enabled by default for the JFNK nonlinear solver, where
+    the stored Jacobian is only used as preconditioner. In that case, a
+    new Jacobian is also computed after a linear solve that needed more
+    than 'Maximum Linear Iterations' (default 20) iterations.
+
+    Usage in a Newton iteration:
+
+    reuse.start()
+    for k in range(maxit):
+        jac = reuse.jacobian(key)
+        if jac is None:
+            fval, jac = interface.evaluate(x)
+            reuse.store(jac, key)
+        else:
+            fval = interface.rhs(x)
+        fnorm = norm(fval)
+        ...
+        if not reuse.contracting(fnorm):
+            jac = interface.jacobian(x)
+            reuse.store(jac, key)
+
+    where the optional key makes sure that a Jacobian is only reused for
+    the same system, e.g. with the same time step. The factorization is
+    reused as well, since it is stored with the Jacobian by the solve of
+    the interface.'''
+
+    def __init__(self, parameters):
+        jfnk = parameters.get('Nonlinear Solver', 'Newton').lower() == 'jfnk'
+        self.enabled = parameters.get('Jacobian Reuse', jfnk)
+        self.max_age = parameters.get('Maximum Jacobian Age', 10)
+        self.threshold = parameters.get('Contraction Threshold', 0.5)
+        self.max_iterations = parameters.get('Maximum Linear Iterations', 20)
+
+        self.reset()
+
+    def reset(self):
+        '''Make sure that a new Jacobian is computed in the next iteration.'''
+
+        self.jac = None
+        self.key = None
+        self.age = 0
+        self.fresh = False
+        self.fnorm = None
+
+    def start(self):
+        '''Start a new nonlinear solve. The stored Jacobian is kept, but
+        the contraction is only measured within a solve, since the first
+        residual of a new step is not comparable to the converged residual
+        of the previous one.'''
+
+        self.fnorm = None
+
+    def jacobian(self, key=None):
+        '''The stored Jacobian if it may be reused, None otherwise.'''
+
+        if not self.enabled or self.jac is None or self.key != key or self.age >= self.max_age:
+            return None
+
+        self.age += 1
+        self.fresh = False
+        return self.jac
+
+    def store(self, jac, key=None):
+        '''Store a newly computed Jacobian.'''
+
+        if not self.enabled:
+            return
+
+        self.jac = jac
+        self.key = key
+        self.age = 1
+        self.fresh = True
+
+    def contracting(self, fnorm):
+        '''Whether the Jacobian of the current iteration may still be used,
+        given the residual norm fnorm at the current iterate. This is not
+        the case if it is a reused Jacobian and the residual norm did not
+        decrease enough with respect to the previous iteration, in which
+        case the Jacobian is discarded and a new one should be stored.'''
+
+        if not self.enabled:
+            return True
+
+        previous = self.fnorm
+        self.fnorm = fnorm
+
+        if self.fresh or previous is None or fnorm <= self.threshold * previous:
+            return True
+
+        self.jac = None
+        return False
+
+    def update_iterations(self, iterations):
+        '''Discard the Jacobian if the last linear solve with it as
+        preconditioner needed too many iterations.'''
+
+        if iterations > self.max_iterations:
+            self.jac = None
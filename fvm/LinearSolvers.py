@@ -0,0 +1,424 @@
+import inspect
+import numpy
+
+from math import log2
+
+from scipy import sparse
+from scipy.sparse import linalg
+
+def krylov_tolerance(tol):
+    '''Keyword arguments of the SciPy Krylov methods for relative tolerance
+    tol. Older versions of SciPy use tol instead of rtol.'''
+
+    if 'rtol' in inspect.signature(linalg.gmres).parameters:
+        return {'rtol': tol}
+    return {'tol': tol}
+
+class LinearSolver:
+    '''Base class of the linear solvers of the Interface, which are
+    selected with the 'Type' in the 'Linear Solver' parameter sublist
+    (see create_linear_solver). A solver is set up once for every matrix
+    with setup(A), where A is a SciPy CSC matrix, which returns an object
+    with a solve(rhs) method, where rhs is a vector or an [n, k] block
+    of right-hand sides. The Interface stores this object in the
+    CrsMatrix, so it is reused for all solves with the same matrix.
+
+    Solvers record their statistics in stats, where setup_timer is the
+    name of the timer of the setup and solve_timer the name of the timer
+    that the Interface uses for the solves.'''
+
+    setup_timer = 'linear solver setup'
+    solve_timer = 'linear solver solve'
+
+    def __init__(self, parameters, stats, grid=None):
+        self.parameters = parameters
+        self.stats = stats
+
+        # Grid size (nx, ny, nz, dim, dof) of the problem, if known
+        self.grid = grid
+
+    def setup(self, A):
+        raise NotImplementedError()
+
+class _ColumnPermutedLU:
+    '''Factorization of A Pc^T, where Pc is the column permutation in which
+    column i is moved to position perm_c[i], that behaves like the
+    factorization of A.'''
+
+    def __init__(self, lu, perm_c):
+        self.lu = lu
+        self.perm_c = perm_c
+        self.shape = lu.shape
+        self.nnz = lu.nnz
+
+    L = property(lambda self: self.lu.L)
+    U = property(lambda self: self.lu.U)
+
+    def solve(self, rhs):
+        return self.lu.solve(rhs)[self.perm_c]
+
+class SuperLU(LinearSolver):
+    '''Direct solver using the sparse LU factorization of SuperLU.
+    Parameters:
+
+    'Ordering': column ordering, which is one of 'COLAMD' (default),
+    'MMD_AT_PLUS_A', 'MMD_ATA' or 'NATURAL'.
+    'Reuse Ordering': reuse the column ordering of the first
+    factorization for matrices with the same pattern, so the ordering
+    is not recomputed for every factorization (default True).
+    'Diagonal Pivot Threshold': threshold for partial pivoting, where 0
+    means no pivoting and 1 means always pivoting (default 1).'''
+
+    setup_timer = 'factorization'
+    solve_timer = 'triangular solve'
+
+    def __init__(self, parameters, stats, grid=None):
+        LinearSolver.__init__(self, parameters, stats, grid)
+
+        # Pattern of the last matrix that was factorized with the
+        # ordering of the first factorization applied to it
+        self._pattern = None
+        self._perm_c = None
+
+    def setup(self, A):
+        with self.stats.timer(self.setup_timer):
+            lu = self._factorize(A)
+
+        if self.stats.enabled:
+            # Number of nonzeros in L + U and the fill-in relative to
+            # A. Getting L and U creates a copy, so we only do this if
+            # we need it.
+            nnz = lu.L.nnz + lu.U.nnz
+            self.stats.set('factorization nnz', nnz)
+            self.stats.set('factorization fill', nnz / A.nnz)
+
+        return lu
+
+    def _splu(self, A, ordering):
+        return linalg.splu(A, permc_spec=ordering,
+                           diag_pivot_thresh=self.parameters.get('Diagonal Pivot Threshold', 1.0))
+
+    def _factorize(self, A):
+        ordering = self.parameters.get('Ordering', 'COLAMD')
+        if not self.parameters.get('Reuse Ordering', True):
+            return self._splu(A, ordering)
+
+        if self._pattern is None or not numpy.array_equal(self._pattern[0], A.indptr) or \
+           not numpy.array_equal(self._pattern[1], A.indices):
+            lu = self._splu(A, ordering)
+
+            self._perm_c = lu.perm_c
+            self._pattern = (A.indptr.copy(), A.indices.copy()) + _permute_columns(A, self._perm_c)
+            return lu
+
+        entries, indices, indptr = self._pattern[2:]
+        B = sparse.csc_matrix((A.data[entries], indices, indptr), shape=A.shape)
+        return _ColumnPermutedLU(self._splu(B, 'NATURAL'), self._perm_c)
+
+def _permute_columns(A, perm_c):
+    '''Pattern of the CSC matrix A with column i moved to position
+    perm_c[i]. Returns the positions of the entries in A.data and the
+    indices and indptr of the permuted matrix.'''
+
+    n = A.shape[1]
+    columns = perm_c[numpy.repeat(numpy.arange(n), numpy.diff(A.indptr))]
+
+    # Stable, so the rows stay sorted within every column
+    entries = numpy.argsort(columns, kind='stable')
+
+    indptr = numpy.zeros(n+1, dtype=A.indptr.dtype)
+    numpy.cumsum(numpy.bincount(columns, minlength=n), out=indptr[1:])
+
+    return entries, A.indices[entries], indptr
+
+class UMFPACK(LinearSolver):
+    '''Direct solver using UMFPACK, which requires scikit-umfpack.'''
+
+    setup_timer = 'factorization'
+    solve_timer = 'triangular solve'
+
+    def setup(self, A):
+        from scikits import umfpack
+
+        with self.stats.timer(self.setup_timer):
+            lu = umfpack.splu(A)
+
+        if self.stats.enabled:
+            nnz = lu.L.nnz + lu.U.nnz
+            self.stats.set('factorization nnz', nnz)
+            self.stats.set('factorization fill', nnz / A.nnz)
+
+        return lu
+
+class _KrylovSolve:
+    '''Solve with a Krylov method and a fixed preconditioner.'''
+
+    def __init__(self, solver, A, M):
+        self.solver = solver
+        self.A = A
+        self.M = M
+        self.shape = A.shape
+
+    def solve(self, rhs):
+        if len(rhs.shape) > 1:
+            x = numpy.empty(rhs.shape, dtype=numpy.result_type(rhs.dtype, self.A.dtype))
+            for i in range(rhs.shape[1]):
+                x[:, i] = self.solve(rhs[:, i])
+            return x
+
+        solver = self.solver
+        method = solver.method
+        stats = solver.stats
+
+        kwargs = dict(krylov_tolerance(solver.parameters.get('Tolerance', 1e-8)), atol=0,
+                      maxiter=solver.parameters.get('Maximum Iterations', 1000), M=self.M)
+
+        restart = solver.parameters.get('Restart', 30)
+        if method == 'gmres':
+            kwargs['restart'] = restart
+            kwargs['callback_type'] = 'pr_norm'
+        elif method == 'lgmres':
+            kwargs['inner_m'] = restart
+
+        if stats.enabled:
+            kwargs['callback'] = lambda x: stats.count(method + ' iterations')
+
+        x, info = solver.methods[method](self.A, rhs, **kwargs)
+        if info != 0:
+            stats.count(method + ' failures')
+
+        return x
+
+class Krylov(LinearSolver):
+    '''Preconditioned Krylov method, where the method is given by the
+    'Type', which is one of 'GMRES', 'BiCGStab' or 'LGMRES'. Parameters:
+
+    'Tolerance': relative tolerance (default 1e-8).
+    'Maximum Iterations': maximum number of iterations, which is the
+    number of restarts for (L)GMRES (default 1000).
+    'Restart': number of iterations after which (L)GMRES is restarted
+    (default 30).
+    'Preconditioner': 'ILU' (default), 'AMG', which requires pyamg,
+    'SIMPLE' or 'SIMPLEC' for the block preconditioners of _SIMPLE, or
+    'None'.
+    'Drop Tolerance', 'Fill Factor', 'Drop Rule': parameters of the
+    incomplete LU factorization of SuperLU (default 1e-4, 10 and
+    'basic'). The default drop rule of SuperLU often leads to a
+    singular factorization for the saddle point problems that we
+    solve here.'''
+
+    methods = {
+        'gmres': linalg.gmres,
+        'bicgstab': linalg.bicgstab,
+        'lgmres': linalg.lgmres,
+    }
+
+    def __init__(self, parameters, stats, grid=None):
+        LinearSolver.__init__(self, parameters, stats, grid)
+
+        self.method = parameters.get('Type', 'GMRES').lower()
+        if self.method not in self.methods:
+            raise ValueError('Unknown Krylov method ' + parameters.get('Type'))
+
+        self.setup_timer = 'preconditioner setup'
+        self.solve_timer = self.method
+
+    def setup(self, A):
+        with self.stats.timer(self.setup_timer):
+            M = self._preconditioner(A)
+
+        return _KrylovSolve(self, A, M)
+
+    def _preconditioner(self, A):
+        preconditioner = self.parameters.get('Preconditioner', 'ILU').lower()
+        if preconditioner == 'none':
+            return None
+
+        if preconditioner in ('simple', 'simplec'):
+            if self.grid is None:
+                raise ValueError('The %s preconditioner requires the grid size' % self.parameters.get('Preconditioner'))
+
+            prec = _SIMPLE(A, self.grid[3], self.grid[4], preconditioner, self.parameters, self.stats)
+            return linalg.LinearOperator(A.shape, matvec=prec.solve, dtype=A.dtype)
+
+        return linalg.LinearOperator(A.shape, matvec=_inverse(A, preconditioner, self.parameters, self.stats),
+                                     dtype=A.dtype)
+
+def _inverse(A, method, parameters, stats, name='preconditioner'):
+    '''Function that applies an exact ('LU') or approximate ('ILU' or
+    'AMG') inverse of A.'''
+
+    if method == 'lu':
+        lu = linalg.splu(A.tocsc())
+        return lu.solve
+
+    if method == 'ilu':
+        ilu = linalg.spilu(A.tocsc(), drop_tol=parameters.get('Drop Tolerance', 1e-4),
+                           fill_factor=parameters.get('Fill Factor', 10),
+                           drop_rule=parameters.get('Drop Rule', 'basic'))
+        stats.set(name + ' fill', ilu.nnz / A.nnz)
+        return ilu.solve
+
+    if method == 'amg':
+        import pyamg
+
+        ml = pyamg.smoothed_aggregation_solver(A.tocsr())
+        stats.set(name + ' amg levels', len(ml.levels))
+        return ml.aspreconditioner().matvec
+
+    raise ValueError('Unknown preconditioner ' + method)
+
+class _SIMPLE:
+    '''SIMPLE preconditioner for the saddle point matrix
+
+    [F G] [u]   [f]
+    [D C] [p] = [g]
+
+    where u contains all unknowns except for the pressure p, so G is the
+    gradient, D the divergence and C is zero except for the pressure
+    node that is fixed by Interface.solve. The blocks are extracted from
+    A by the index of the unknowns in every grid cell. With the diagonal
+    approximation H of F, which is diag(F) for SIMPLE and the absolute
+    row sums of F with the sign of the diagonal for SIMPLEC, a solve
+    consists of
+
+    u* = F^-1 f
+    p = S^-1 (g - D u*), S = C - D H^-1 G
+    u = u* - H^-1 G p
+
+    The fixed pressure node remains fixed in S, which is therefore
+    nonsingular. F is solved with the 'Velocity Solver' ('ILU' (default),
+    'LU' or 'AMG') and S, which is a Poisson-like matrix, with the
+    'Pressure Solver' ('LU' (default), 'ILU' or 'AMG').'''
+
+    def __init__(self, A, dim, dof, variant, parameters, stats):
+        n = A.shape[0]
+        var = numpy.arange(n) % dof
+        self.velocity = numpy.flatnonzero(var != dim)
+        self.pressure = numpy.flatnonzero(var == dim)
+
+        A = A.tocsr()
+        rows = A[self.velocity]
+        F = rows[:, self.velocity]
+        self.G = rows[:, self.pressure]
+
+        rows = A[self.pressure]
+        self.D = rows[:, self.velocity]
+        C = rows[:, self.pressure]
+
+        diagonal = F.diagonal()
+        if variant == 'simplec':
+            diagonal = numpy.where(diagonal < 0, -1, 1) * numpy.asarray(abs(F).sum(axis=1)).ravel()
+        diagonal[diagonal == 0] = 1
+        self.inverse_diagonal = 1 / diagonal
+
+        S = (C - self.D @ sparse.diags(self.inverse_diagonal) @ self.G).tocsc()
+
+        self.F_solve = _inverse(F, parameters.get('Velocity Solver', 'ILU').lower(), parameters, stats,
+                                'velocity solver')
+        self.S_solve = _inverse(S, parameters.get('Pressure Solver', 'LU').lower(), parameters, stats,
+                                'pressure solver')
+
+    def solve(self, rhs):
+        if len(rhs.shape) > 1:
+            x = numpy.empty(rhs.shape, dtype=numpy.result_type(rhs.dtype, self.G.dtype))
+            for i in range(rhs.shape[1]):
+                x[:, i] = self.solve(rhs[:, i])
+            return x
+
+        u = self.F_solve(rhs[self.velocity])
+        p = self.S_solve(rhs[self.pressure] - self.D @ u)
+        u -= self.inverse_diagonal * (self.G @ p)
+
+        x = numpy.empty(rhs.shape, dtype=u.dtype)
+        x[self.velocity] = u
+        x[self.pressure] = p
+        return x
+
+class SIMPLE(LinearSolver):
+    '''A single application of the SIMPLE or SIMPLEC block preconditioner
+    (see _SIMPLE), depending on the 'Type'. This is not an accurate
+    solver, so it is only useful as the preconditioner of the lagged
+    Jacobian in the JFNK nonlinear solver. The parameters are the same
+    as for _SIMPLE.'''
+
+    setup_timer = 'preconditioner setup'
+    solve_timer = 'preconditioner'
+
+    def setup(self, A):
+        if self.grid is None:
+            raise ValueError('The %s preconditioner requires the grid size' % self.parameters.get('Type'))
+
+        with self.stats.timer(self.setup_timer):
+            return _SIMPLE(A, self.grid[3], self.grid[4], self.parameters.get('Type').lower(), self.parameters,
+                           self.stats)
+
+class Auto(LinearSolver):
+    '''Use SuperLU, unless the predicted number of nonzeros in the LU
+    factorization exceeds 'Maximum Factor Nonzeros' (default 1e8), in
+    which case GMRES with an ILU preconditioner is used. The prediction
+    is based on the nested dissection estimates of the fill for 2D and
+    3D grids, with constants that were fitted to the factorizations of
+    the problems in this package. If a factorization turns out to be
+    larger than predicted, subsequent matrices are solved iteratively.
+    The parameters are passed on to the solver that is used.'''
+
+    def __init__(self, parameters, stats, grid=None):
+        LinearSolver.__init__(self, parameters, stats, grid)
+
+        self.direct = SuperLU(parameters, stats, grid)
+        self.iterative = Krylov(dict(parameters, Type='GMRES'), stats, grid)
+        self.solver = None
+
+    def _get_solve_timer(self):
+        return (self.solver or self.direct).solve_timer
+
+    solve_timer = property(_get_solve_timer)
+
+    def predicted_nnz(self, A):
+        n = A.shape[0]
+        if self.grid is not None and self.grid[2] > 1:
+            return 50 * n ** (4 / 3)
+        return 15 * n * log2(max(n, 2))
+
+    def setup(self, A):
+        max_nnz = self.parameters.get('Maximum Factor Nonzeros', 1e8)
+        if self.solver is None:
+            self.solver = self.direct if self.predicted_nnz(A) <= max_nnz else self.iterative
+
+        lu = self.solver.setup(A)
+
+        if self.solver is self.direct and lu.nnz > max_nnz:
+            self.solver = self.iterative
+
+        return lu
+
+
+# Available linear solvers by lower case name
+LINEAR_SOLVERS = {
+    'superlu': SuperLU,
+    'umfpack': UMFPACK,
+    'gmres': Krylov,
+    'bicgstab': Krylov,
+    'lgmres': Krylov,
+    'simple': SIMPLE,
+    'simplec': SIMPLE,
+    'auto': Auto,
+}
+
+def register_linear_solver(name, solver_class):
+    '''Make a LinearSolver subclass available under the given 'Type'.'''
+
+    LINEAR_SOLVERS[name.lower()] = solver_class
+
+def create_linear_solver(parameters, stats, grid=None):
+    '''Create the linear solver for the 'Linear Solver' parameter sublist,
+    where the 'Type' is one of the keys of LINEAR_SOLVERS (default
+    'SuperLU').'''
+
+    name = parameters.get('Type', 'SuperLU')
+    solver_class = LINEAR_SOLVERS.get(name.lower())
+    if solver_class is None:
+        raise ValueError('Unknown linear solver ' + name)
+
+    return solver_class(parameters, stats, grid)
@@ -0,0 +1,77 @@
+import numpy
+
+class StateLayout:
+    '''Layout of a state vector, in which the degrees of freedom are
+    stored fastest, then x, then y, then z, so
+
+    state[d + i * dof + j * dof * nx + k * dof * nx * ny] = state_mtx[i, j, k, d]
+
+    Because of this ordering, converting between the vector and the
+    [nx, ny, nz, dof] matrix form is a reshape and a transpose, so no
+    data has to be copied. The named accessors u, v, w, p and T return
+    [nx, ny, nz] views of the corresponding field, where w, p and T
+    require dim to be set.'''
+
+    def __init__(self, nx, ny, nz, dof, dim=None):
+        self.nx = nx
+        self.ny = ny
+        self.nz = nz
+        self.dof = dof
+        self.dim = dim
+
+    def mtx(self, state):
+        '''[nx, ny, nz, dof] view of the state vector. In case state is an
+        [n, batch] array of states, this is an [nx, ny, nz, dof, batch]
+        view.'''
+
+        state = numpy.asarray(state)
+        batch = state.shape[1:]
+        axes = tuple(range(4, 4 + len(batch)))
+        return state.reshape((self.nz, self.ny, self.nx, self.dof) + batch).transpose((2, 1, 0, 3) + axes)
+
+    def vec(self, state_mtx):
+        '''State vector of an [nx, ny, nz, dof] matrix, or [n, batch]
+        array of an [nx, ny, nz, dof, batch] matrix. This is a view if
+        state_mtx was created by mtx() or zeros() and a copy otherwise.'''
+
+        batch = state_mtx.shape[4:]
+        axes = tuple(range(4, 4 + len(batch)))
+        return state_mtx.transpose((2, 1, 0, 3) + axes).reshape((-1,) + batch)
+
+    def zeros(self, dtype=numpy.float64):
+        '''[nx, ny, nz, dof] matrix of zeros that can be converted to a
+        vector without copying.'''
+
+        return self.mtx(numpy.zeros(self.nx * self.ny * self.nz * self.dof, dtype=dtype))
+
+    def field(self, state, d):
+        '''[nx, ny, nz] view of degree of freedom d of the state vector.'''
+
+        return self.mtx(state)[:, :, :, d]
+
+    def _named_field(self, state, name, d):
+        if d >= self.dof:
+            raise ValueError('%s is not part of a state with %d degrees of freedom' % (name, self.dof))
+        return self.field(state, d)
+
+    def _dimension(self, name):
+        if self.dim is None:
+            raise ValueError('The dimension is required to access %s' % name)
+        return self.dim
+
+    def u(self, state):
+        return self._named_field(state, 'u', 0)
+
+    def v(self, state):
+        return self._named_field(state, 'v', 1)
+
+    def w(self, state):
+        if self._dimension('w') < 3:
+            raise ValueError('w is not part of a %dD state' % self.dim)
+        return self._named_field(state, 'w', 2)
+
+    def p(self, state):
+        return self._named_field(state, 'p', self._dimension('p'))
+
+    def T(self, state):
+        return self._named_field(state, 'T', self._dimension('T') + 1)
@@ -0,0 +1,96 @@
+import time
+
+class _Timer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_timer = _NullTimer()
+
+class Stats:
+    '''Timers, counters and values that are collected in the different
+    phases of a computation. Collecting statistics is disabled by
+    default, in which case all methods return immediately. It can be
+    enabled with the 'Collect Statistics' parameter, or by setting
+    enabled to True. Usage:
+
+    with stats.timer('rhs'):
+        rhs = ...
+    stats.count('newton iterations')
+    stats.set('factorization fill', fill)
+
+    A timer also counts the number of times it was used under the same
+    name. The statistics are available in times, counts and values, or
+    as a single dict from as_dict().'''
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        '''Remove all collected statistics.'''
+
+        self.times = {}
+        self.counts = {}
+        self.values = {}
+
+    def timer(self, name):
+        '''Context manager that adds the time spent in it to times[name].'''
+
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        if not self.enabled:
+            return
+
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        '''Add n to counts[name].'''
+
+        if not self.enabled:
+            return
+
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def set(self, name, value):
+        '''Set values[name], e.g. to the last value of some quantity.'''
+
+        if not self.enabled:
+            return
+
+        self.values[name] = value
+
+    def as_dict(self):
+        return {'times': dict(self.times), 'counts': dict(self.counts), 'values': dict(self.values)}
+
+    def __str__(self):
+        lines = []
+        for name in sorted(set(self.times) | set(self.counts) | set(self.values)):
+            line = '%-32s' % name
+            if name in self.times:
+                line += ' %12.6f s' % self.times[name]
+            if name in self.counts:
+                line += ' %10d' % self.counts[name]
+            if name in self.values:
+                line += ' %14g' % self.values[name]
+            lines.append(line)
+        return '\n'.join(lines)
@@ -1,8 +1,11 @@
-import sys
 import numpy
 
 from math import sqrt
 
+from fvm.Events import create_events
+from fvm.JacobianReuse import JacobianReuse
+from fvm.JFNK import create_nonlinear_solver
+
 def norm(x):
     return sqrt(x.dot(x))
 
@@ -16,45 +19,88 @@ class TimeIntegration:
         self.interface = interface
         self.parameters = parameters
 
+        # Timers and counters that are shared with the interface
+        self.stats = interface.stats
+
+        # Observers of the progress, see Events
+        self.events = create_events(parameters)
+
+        # Policy for reusing the Jacobian over multiple iterations and steps
+        self.jacobian_reuse = JacobianReuse(parameters)
+
+        # Jacobian-free Newton-Krylov solver if it is selected by the
+        # 'Nonlinear Solver' parameter, see JFNK
+        self.jfnk = create_nonlinear_solver(interface, parameters)
+
     def newton(self, x0, dt, tol=1.e-10, maxit=1000):
         residual_check = self.parameters.get('Residual Check', 'F')
-        verbose = self.parameters.get('Verbose', False)
+        report = self.events.subscribed('newton_iteration')
         theta = self.parameters.get('Theta', 1)
+        want_fnorm = residual_check == 'F' or report or self.jacobian_reuse.enabled or \
+            self.jfnk is not None
+
+        if self.jfnk:
+            self.jfnk.reset()
+        self.jacobian_reuse.start()
 
         x = x0
         b0 = self.interface.rhs(x0)
         mass = self.interface.mass_matrix()
 
+        fnorm = None
         for k in range(maxit):
             # M * u_n + dt * theta * F(u_(n+1)) + dt * (1 - theta) * F(u_n) - M * u_(n+1) = 0
-            fval = mass @ (x0 - x) + dt * theta * self.interface.rhs(x) + dt * (1 - theta) * b0
+            # The Jacobian is only reused for the same time step
+            jac = self.jacobian_reuse.jacobian((dt, theta))
+            if jac is not None:
+                rhs = self.interface.rhs(x)
+            else:
+                rhs, jac = self.interface.evaluate(x)
+
+                # J - 1 / (theta * dt) * M
+                jac = jac - mass / (theta * dt)
+                self.jacobian_reuse.store(jac, (dt, theta))
+
+            fval = mass @ (x0 - x) + dt * theta * rhs + dt * (1 - theta) * b0
             fval /= theta * dt
 
-            if residual_check == 'F' or verbose:
+            if want_fnorm:
                 fnorm = norm(fval)
 
             if residual_check == 'F' and fnorm < tol:
-                print('Newton converged in %d iterations with ||F||=%e' % (k, fnorm))
-                sys.stdout.flush()
+                self.events.emit('newton_converged', name='Newton', iterations=k, fnorm=fnorm)
                 break
 
-            # J - 1 / (theta * dt) * M
-            jac = self.interface.jacobian(x) - mass / (theta * dt)
-            dx = self.interface.solve(jac, -fval)
+            # Compute a new Jacobian if the reused one does not decrease
+            # the residual enough
+            if self.jacobian_reuse.contracting(fnorm):
+                if self.jacobian_reuse.enabled and not self.jacobian_reuse.fresh:
+                    self.stats.count('jacobian reuses')
+            else:
+                jac = self.interface.jacobian(x) - mass / (theta * dt)
+                self.jacobian_reuse.store(jac, (dt, theta))
+
+            if self.jfnk:
+                # The Jacobian is only used as preconditioner
+                op = self.jfnk.operator(x, rhs, mass, 1 / (theta * dt))
+                dx = self.jfnk.solve(op, jac, -fval, self.jfnk.forcing_term(fnorm, tol))
+                self.jacobian_reuse.update_iterations(self.jfnk.iterations)
+            else:
+                dx = self.interface.solve(jac, -fval)
 
             x = x + dx
 
-            if residual_check != 'F' or verbose:
+            self.stats.count('newton iterations')
+
+            if residual_check != 'F' or report:
                 dxnorm = norm(dx)
 
             if residual_check != 'F' and dxnorm < tol:
-                print('Newton converged in %d iterations with ||dx||=%e' % (k, dxnorm))
-                sys.stdout.flush()
+                self.events.emit('newton_converged', name='Newton', iterations=k, dxnorm=dxnorm)
                 break
 
-            if verbose:
-                print('Newton status at iteration %d: ||F||=%e, ||dx||=%e' % (k, fnorm, dxnorm))
-                sys.stdout.flush()
+            if report:
+                self.events.emit('newton_iteration', name='Newton', iteration=k, fnorm=fnorm, dxnorm=dxnorm)
 
         return x
 
@@ -73,12 +119,12 @@ class TimeIntegration:
         self.store_data(data, x, t)
 
         while t < tmax:
-            x = self.newton(x, dt)
+            with self.stats.timer('time step'):
+                x = self.newton(x, dt)
             t += dt
 
             self.store_data(data, x, t)
 
-            print("t = %f" % t)
-            sys.stdout.flush()
+            self.events.emit('time_step', t=t, dt=dt, x=x)
 
         return x, t, data
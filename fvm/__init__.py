@@ -1,8 +1,14 @@
 from .CrsMatrix import CrsMatrix
+from .StateLayout import StateLayout
+from .Stats import Stats
+from .Events import Events, Logger
+from .Atom import Atom
 from .BoundaryConditions import BoundaryConditions
+from .GridMetrics import GridMetrics
 from .Discretization import Discretization
 from .Interface import Interface
 from .Continuation import Continuation
 from .TimeIntegration import TimeIntegration
 
-__all__ = ['CrsMatrix', 'BoundaryConditions', 'Discretization', 'Interface', 'Continuation', 'TimeIntegration']
+__all__ = ['CrsMatrix', 'StateLayout', 'Stats', 'Events', 'Logger', 'Atom', 'BoundaryConditions', 'GridMetrics',
+           'Discretization', 'Interface', 'Continuation', 'TimeIntegration']
@@ -0,0 +1,17 @@
+'''Benchmarks of the main components of fvm for the problems in
+PROBLEMS on the grid sizes in GRID_SIZES. Run them with
+
+python -m fvm.bench --output results.json
+
+and compare them to earlier results with
+
+python -m fvm.bench --baseline results.json
+
+See python -m fvm.bench --help for all options.'''
+
+from .problems import PROBLEMS, GRID_SIZES, Case
+from .benchmarks import BENCHMARKS
+from .runner import run_benchmarks, measure, compare, save, load
+
+__all__ = ['PROBLEMS', 'GRID_SIZES', 'Case', 'BENCHMARKS',
+           'run_benchmarks', 'measure', 'compare', 'save', 'load']
@@ -0,0 +1,41 @@
+import sys
+import argparse
+
+from fvm.bench import PROBLEMS, BENCHMARKS, run_benchmarks, compare, save, load
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m fvm.bench', description='Run the fvm benchmarks.')
+    parser.add_argument('-p', '--problems', nargs='+', choices=list(PROBLEMS.keys()),
+                        help='problems to run (default: all)')
+    parser.add_argument('-d', '--dims', nargs='+', type=int, choices=[2, 3],
+                        help='dimensions to run (default: 2 and 3)')
+    parser.add_argument('-s', '--sizes', nargs='+', type=int,
+                        help='grid sizes to run (default: the ladder in GRID_SIZES)')
+    parser.add_argument('-b', '--benchmarks', nargs='+', choices=list(BENCHMARKS.keys()),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timed runs of every benchmark, of which the minimum is reported')
+    parser.add_argument('-o', '--output', help='file to write the results to as JSON')
+    parser.add_argument('--baseline', help='JSON file with results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative increase in time or memory that is reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.problems, args.dims, args.sizes, args.benchmarks, args.repeat)
+
+    if args.output:
+        save(results, args.output)
+
+    if not args.baseline:
+        return 0
+
+    regressions = compare(results, load(args.baseline), args.threshold)
+    for (problem, dim, size, name), quantity, old, new in regressions:
+        print('Regression in %s for %s%dd-%d: %s went from %g to %g' % (
+            name, problem, dim, size, quantity, old, new))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
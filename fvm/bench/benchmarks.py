@@ -0,0 +1,194 @@
+from math import sqrt
+
+from fvm import Continuation, TimeIntegration
+
+# Every benchmark takes a Case, does the setup that should not be
+# measured and returns a function without arguments that is timed.
+
+def linear_part(case):
+    interface = case.create_interface()
+    discretization = interface.discretization
+
+    def run():
+        discretization.linear_part()
+
+    return run
+
+def rhs(case):
+    interface = case.create_interface()
+    state = case.perturbed_state()
+
+    def run():
+        interface.rhs(state)
+
+    return run
+
+def jacobian(case):
+    interface = case.create_interface()
+    state = case.perturbed_state()
+
+    def run():
+        interface.jacobian(state)
+
+    return run
+
+def evaluate(case):
+    interface = case.create_interface()
+    state = case.perturbed_state()
+
+    def run():
+        interface.evaluate(state)
+
+    return run
+
+def assemble_jacobian(case):
+    interface = case.create_interface()
+    discretization = interface.discretization
+    state = case.perturbed_state()
+
+    # Make sure that the linear part is computed
+    interface.rhs(state)
+    atomJ, atomF = discretization.nonlinear_part(state)
+    atom = atomJ + discretization.atom
+
+    def run():
+        discretization.assemble_jacobian(atom)
+
+    return run
+
+def mass_matrix(case):
+    interface = case.create_interface()
+    discretization = interface.discretization
+
+    def run():
+        discretization._mass_matrix = None
+        discretization.mass_matrix()
+
+    return run
+
+def crs_matvec(case):
+    interface = case.create_interface()
+    state = case.perturbed_state()
+    jac = interface.jacobian(state)
+
+    def run():
+        jac @ state
+
+    return run
+
+def crs_merge(case):
+    interface = case.create_interface()
+    state = case.perturbed_state()
+    jac = interface.jacobian(state)
+    mass = interface.mass_matrix()
+
+    def run():
+        jac - mass / 0.1
+
+    return run
+
+def solve(case):
+    interface = case.create_interface()
+    state = case.perturbed_state()
+    jac = interface.jacobian(state)
+    rhs = interface.rhs(state)
+
+    def run():
+        # Make sure that the factorization is not reused
+        jac.lu = None
+        interface.solve(jac, -rhs)
+
+    return run
+
+def solve_iterative(case):
+    parameters = case.parameters()
+    parameters['Use Iterative Solver'] = True
+    interface = case.create_interface(parameters)
+
+    # Factorize the Jacobian at a nearby state, which is then used as
+    # a preconditioner
+    interface.solve(interface.jacobian(case.state()), interface.rhs(case.state()))
+
+    state = case.perturbed_state()
+    jac = interface.jacobian(state)
+    rhs = interface.rhs(state)
+
+    def run():
+        jac.lu = None
+        interface.solve(jac, -rhs)
+
+    return run
+
+def eigs(case):
+    # The eigenvalue solver is an optional dependency
+    import jadapy # noqa: F401
+
+    parameters = case.parameters()
+    parameters['Eigenvalue Solver'] = {'Number of Eigenvalues': 2, 'Target': 0.1}
+    interface = case.create_interface(parameters)
+    state = case.state()
+
+    def run():
+        interface.eigs(state)
+
+    return run
+
+def continuation_step(case):
+    parameters = case.parameters()
+    parameters['Newton Tolerance'] = 1e-8
+    interface = case.create_interface(parameters)
+    continuation = Continuation(interface, parameters)
+
+    x = case.state()
+    mu = interface.get_parameter(case.parameter_name)
+
+    # Initial tangent as in Continuation.continuation
+    continuation.delta = 1
+    continuation.zeta = 1 / len(x)
+
+    interface.set_parameter(case.parameter_name, mu + continuation.delta)
+    dflval = interface.rhs(x)
+    interface.set_parameter(case.parameter_name, mu)
+    dflval = (dflval - interface.rhs(x)) / continuation.delta
+
+    dx = interface.solve(interface.jacobian(x), -dflval)
+    dmu = 1
+    nrm = sqrt(continuation.zeta * dx.dot(dx) + dmu ** 2)
+    dx /= nrm
+    dmu /= nrm
+
+    ds = 0.1 * abs(mu) + 1
+
+    def run():
+        interface.set_parameter(case.parameter_name, mu)
+        continuation.step(case.parameter_name, x, mu, dx, dmu, ds)
+
+    return run
+
+def time_integration_newton(case):
+    parameters = case.parameters()
+    interface = case.create_interface(parameters)
+    time_integration = TimeIntegration(interface, parameters)
+    state = case.perturbed_state()
+
+    def run():
+        time_integration.newton(state, 0.01)
+
+    return run
+
+
+BENCHMARKS = {
+    'linear_part': linear_part,
+    'rhs': rhs,
+    'jacobian': jacobian,
+    'evaluate': evaluate,
+    'assemble_jacobian': assemble_jacobian,
+    'mass_matrix': mass_matrix,
+    'crs_matvec': crs_matvec,
+    'crs_merge': crs_merge,
+    'solve': solve,
+    'solve_iterative': solve_iterative,
+    'eigs': eigs,
+    'continuation_step': continuation_step,
+    'time_integration_newton': time_integration_newton,
+}
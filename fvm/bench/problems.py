@@ -0,0 +1,82 @@
+import numpy
+
+from fvm import Interface, Continuation
+
+# Problems that are benchmarked, with their parameters and the number
+# of degrees of freedom per grid cell for every dimension
+PROBLEMS = {
+    'ldc': {
+        'parameters': {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100},
+        'dof': {2: 3, 3: 4},
+    },
+    'rb': {
+        'parameters': {'Problem Type': 'Rayleigh-Benard', 'Reynolds Number': 1, 'Rayleigh Number': 1000,
+                       'Prandtl Number': 10, 'Biot Number': 1},
+        'dof': {2: 4, 3: 5},
+    },
+    'dhc': {
+        'parameters': {'Problem Type': 'Differentially heated cavity', 'Reynolds Number': 1,
+                       'Rayleigh Number': 1000, 'Prandtl Number': 10},
+        'dof': {2: 4, 3: 5},
+    },
+}
+
+# Ladder of grid sizes (the number of cells in every direction) for
+# every dimension
+GRID_SIZES = {
+    2: [8, 16, 32, 64],
+    3: [4, 8, 12, 16],
+}
+
+# The parameter that is used in the continuation benchmark
+CONTINUATION_PARAMETER = {
+    'ldc': 'Reynolds Number',
+    'rb': 'Rayleigh Number',
+    'dhc': 'Rayleigh Number',
+}
+
+class Case:
+    '''A problem on a grid of size n in every direction with a converged
+    steady state that is used as a starting point by the benchmarks.
+    Setting up the case is not part of the measurements.'''
+
+    def __init__(self, problem, dim, size):
+        self.problem = problem
+        self.dim = dim
+        self.size = size
+
+        self.nx = size
+        self.ny = size
+        self.nz = size if dim == 3 else 1
+        self.dof = PROBLEMS[problem]['dof'][dim]
+        self.n = self.nx * self.ny * self.nz * self.dof
+
+        self.parameter_name = CONTINUATION_PARAMETER[problem]
+
+        self._state = None
+
+    def name(self):
+        return '%s%dd-%d' % (self.problem, self.dim, self.size)
+
+    def parameters(self):
+        return dict(PROBLEMS[self.problem]['parameters'])
+
+    def create_interface(self, parameters=None):
+        if parameters is None:
+            parameters = self.parameters()
+        return Interface(parameters, self.nx, self.ny, self.nz, self.dim, self.dof)
+
+    def state(self):
+        '''Steady state of the problem, which is computed only once.'''
+
+        if self._state is None:
+            parameters = self.parameters()
+            interface = self.create_interface(parameters)
+            continuation = Continuation(interface, parameters)
+            self._state = continuation.newton(numpy.zeros(self.n))
+        return self._state
+
+    def perturbed_state(self, seed=0):
+        rng = numpy.random.default_rng(seed)
+        state = self.state()
+        return state + 1e-3 * (numpy.linalg.norm(state) / numpy.sqrt(self.n) + 1) * rng.random(self.n)
@@ -0,0 +1,157 @@
+import io
+import json
+import time
+import platform
+import tracemalloc
+import contextlib
+
+from collections import Counter
+
+import numpy
+import scipy
+
+from scipy.sparse import linalg
+
+from fvm import CrsMatrix, Discretization, Interface
+from fvm.bench.benchmarks import BENCHMARKS
+from fvm.bench.problems import PROBLEMS, GRID_SIZES, Case
+
+# Functions of which the number of calls is recorded
+COUNTED_METHODS = [
+    (Discretization, ['linear_part', '_compute_linear_part', 'nonlinear_part', 'rhs', 'jacobian', 'evaluate',
+                      'assemble_rhs', 'assemble_jacobian', '_fill_jacobian', 'mass_matrix']),
+    (Interface, ['solve', 'eigs']),
+    (CrsMatrix, ['solve', '__matmul__', '_merge']),
+    (linalg, ['splu', 'gmres']),
+]
+
+class CallCounter:
+    '''Context manager that counts the calls to COUNTED_METHODS by
+    temporarily replacing them with wrappers.'''
+
+    def __init__(self):
+        self.counts = Counter()
+        self._originals = []
+
+    def _wrap(self, name, func):
+        counts = self.counts
+
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def __enter__(self):
+        for owner, names in COUNTED_METHODS:
+            for name in names:
+                func = getattr(owner, name)
+                self._originals.append((owner, name, func))
+                setattr(owner, name, self._wrap('%s.%s' % (owner.__name__.split('.')[-1], name), func))
+        return self
+
+    def __exit__(self, *args):
+        for owner, name, func in reversed(self._originals):
+            setattr(owner, name, func)
+        self._originals = []
+
+def measure(run, repeat=3):
+    '''Wall time of every call of run, peak memory of a single call
+    in bytes and the number of calls to COUNTED_METHODS in a single
+    call. The first call is not measured, so caches that are computed
+    on first use do not skew the results. Output of the benchmarked
+    code is suppressed.'''
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            run()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        with CallCounter() as counter:
+            run()
+
+    return {'time': min(times), 'times': times, 'peak_memory': peak_memory, 'calls': dict(counter.counts)}
+
+def run_benchmarks(problems=None, dims=None, sizes=None, benchmarks=None, repeat=3, log=print):
+    '''Run the benchmarks for every problem, dimension and grid size. The
+    default sizes are the ones in GRID_SIZES. Returns a list of results,
+    where benchmarks with missing optional dependencies are marked as
+    skipped and benchmarks that raised an exception are marked with the
+    error.'''
+
+    problems = problems or list(PROBLEMS.keys())
+    dims = dims or [2, 3]
+    benchmarks = benchmarks or list(BENCHMARKS.keys())
+
+    results = []
+    for problem in problems:
+        for dim in dims:
+            for size in sizes or GRID_SIZES[dim]:
+                case = Case(problem, dim, size)
+                for name in benchmarks:
+                    result = {'problem': problem, 'dim': dim, 'size': size, 'benchmark': name}
+                    try:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            run = BENCHMARKS[name](case)
+                        result.update(measure(run, repeat))
+                        log('%-12s %-24s %10.4f s %10.2f MB' % (
+                            case.name(), name, result['time'], result['peak_memory'] / 2 ** 20))
+                    except ImportError as e:
+                        result['skipped'] = str(e)
+                        log('%-12s %-24s skipped: %s' % (case.name(), name, e))
+                    except Exception as e:
+                        result['error'] = '%s: %s' % (type(e).__name__, e)
+                        log('%-12s %-24s failed: %s' % (case.name(), name, result['error']))
+                    results.append(result)
+
+    return results
+
+def metadata():
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def save(results, file_name):
+    with open(file_name, 'w') as f:
+        json.dump({'metadata': metadata(), 'results': results}, f, indent=2)
+
+def load(file_name):
+    with open(file_name) as f:
+        return json.load(f)['results']
+
+def _key(result):
+    return (result['problem'], result['dim'], result['size'], result['benchmark'])
+
+def compare(results, baseline, threshold=0.25):
+    '''Compare the results to a baseline. Returns a list of regressions
+    (key, quantity, baseline value, new value) where the wall time or
+    peak memory increased by more than the relative threshold.'''
+
+    baseline = {_key(result): result for result in baseline}
+
+    regressions = []
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None or 'time' not in result or 'time' not in old:
+            continue
+
+        for quantity in ['time', 'peak_memory']:
+            if result[quantity] > old[quantity] * (1 + threshold):
+                regressions.append((_key(result), quantity, old[quantity], result[quantity]))
+
+    return regressions
@@ -0,0 +1,134 @@
+'''Kernels for the inner loops of the assembly that do not map well
+to NumPy. There is a NumPy implementation and, if numba is available,
+a compiled implementation that runs in parallel over the z-slabs of
+the grid. Both give identical results, since the compiled kernels
+perform the same floating point operations in the same order.
+
+The backend is selected by the 'Kernel Backend' parameter of the
+discretization, which can be 'numpy' (the default), 'numba' or 'auto',
+where 'auto' uses numba if it can be imported. NumPy is the default,
+since compiling the kernels takes longer than what they save in a short
+run: on a single core, an evaluation of a 32^3 lid-driven cavity takes
+0.11 s instead of 0.15 s with numba, but the first evaluation takes
+0.9 s (2.6 s without the compilation cache) instead of 0.7 s.'''
+
+import numpy
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+class NumpyKernels:
+    name = 'numpy'
+
+    @staticmethod
+    def any_nonzero(a):
+        '''Whether a contains a nonzero value.'''
+        return numpy.any(a)
+
+    @staticmethod
+    def subtract_product(out, a, b):
+        '''Compute out -= a * b for arrays of the same shape.'''
+        out -= a * b
+
+    @staticmethod
+    def count_nonzero(values, tol, indices=None):
+        '''Number of values[indices] with abs(values[indices]) > tol, where
+        all values are used if indices is None.'''
+        if indices is not None:
+            values = values[indices]
+        return numpy.count_nonzero(abs(values) > tol)
+
+    @staticmethod
+    def gather_sum(values, entries, slots, n):
+        '''Compute out[slots[i]] += values[entries[i]] for all i in order
+        for an array out of length n that is initialized with zeros.'''
+        return numpy.bincount(slots, weights=values[entries], minlength=n)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _any_nonzero(a):
+        for i in range(a.shape[0]):
+            for j in range(a.shape[1]):
+                for k in range(a.shape[2]):
+                    if a[i, j, k] != 0:
+                        return True
+        return False
+
+    @numba.njit(parallel=True, cache=True)
+    def _subtract_product(out, a, b):
+        # Every thread handles complete z-slabs
+        for k in numba.prange(out.shape[2]):
+            for i in range(out.shape[0]):
+                for j in range(out.shape[1]):
+                    out[i, j, k] -= a[i, j, k] * b[i, j, k]
+
+    @numba.njit(parallel=True, cache=True)
+    def _count_nonzero(values, tol):
+        count = 0
+        for i in numba.prange(len(values)):
+            if abs(values[i]) > tol:
+                count += 1
+        return count
+
+    @numba.njit(parallel=True, cache=True)
+    def _count_nonzero_at(values, tol, indices):
+        count = 0
+        for i in numba.prange(len(indices)):
+            if abs(values[indices[i]]) > tol:
+                count += 1
+        return count
+
+    @numba.njit(cache=True)
+    def _gather_sum(values, entries, slots, n):
+        out = numpy.zeros(n)
+        for i in range(len(entries)):
+            out[slots[i]] += values[entries[i]]
+        return out
+
+    class NumbaKernels:
+        name = 'numba'
+
+        @staticmethod
+        def any_nonzero(a):
+            if a.ndim != 3:
+                return numpy.any(a)
+            return _any_nonzero(a)
+
+        @staticmethod
+        def subtract_product(out, a, b):
+            if out.ndim != 3 or out.dtype != numpy.float64:
+                out -= a * b
+                return
+            _subtract_product(out, a, b)
+
+        @staticmethod
+        def count_nonzero(values, tol, indices=None):
+            if indices is None:
+                return _count_nonzero(values, tol)
+            return _count_nonzero_at(values, tol, indices)
+
+        @staticmethod
+        def gather_sum(values, entries, slots, n):
+            return _gather_sum(values, entries, slots, n)
+
+BACKENDS = {'numpy': NumpyKernels}
+if numba is not None:
+    BACKENDS['numba'] = NumbaKernels
+
+def get_kernels(name='numpy'):
+    '''Kernel backend with the given name, see the module documentation.'''
+
+    name = name.lower()
+    if name == 'auto':
+        return BACKENDS.get('numba', NumpyKernels)
+
+    if name == 'numba' and numba is None:
+        raise ImportError('The numba kernel backend requires numba to be installed')
+
+    if name not in BACKENDS:
+        raise ValueError('Unknown kernel backend %s' % name)
+
+    return BACKENDS[name]
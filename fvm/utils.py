@@ -2,26 +2,17 @@ import numpy
 
 from scipy import integrate
 
+from fvm.StateLayout import StateLayout
+
 def create_state_mtx(state, nx, ny, nz, dof):
-    state_mtx = numpy.zeros([nx, ny, nz, dof])
-    for k in range(nz):
-        for j in range(ny):
-            for i in range(nx):
-                for d in range(dof):
-                    state_mtx[i, j, k, d] = state[d + i * dof + j * dof * nx + k * dof * nx * ny]
-    return state_mtx
+    '''Copy of the state vector in [nx, ny, nz, dof] form. Use
+    StateLayout.mtx to obtain a view instead.'''
+    return StateLayout(nx, ny, nz, dof).mtx(state).copy()
 
 def create_state_vec(state_mtx, nx, ny, nz, dof):
-    state = numpy.zeros(nx * ny * nz * dof)
-
-    row = 0
-    for k in range(nz):
-        for j in range(ny):
-            for i in range(nx):
-                for d in range(dof):
-                    state[row] = state_mtx[i, j, k, d]
-                    row += 1
-    return state
+    '''Copy of an [nx, ny, nz, dof] matrix in vector form. Use
+    StateLayout.vec to avoid the copy.'''
+    return StateLayout(nx, ny, nz, dof).vec(numpy.asarray(state_mtx)).copy()
 
 def create_uniform_coordinate_vector(start, end, nx):
     dx = (end - start) / nx
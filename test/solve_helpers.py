@@ -0,0 +1,9 @@
+def pinned_matrix(jac, dim):
+    '''Dense version of the Jacobian jac with the first pressure node
+    pinned in the same way as in Interface.solve.'''
+
+    A = jac.to_scipy().toarray()
+    A[dim, :] = 0
+    A[:, dim] = 0
+    A[dim, dim] = -1
+    return A
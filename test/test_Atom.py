@@ -0,0 +1,76 @@
+import numpy
+
+from fvm import Atom
+
+def create_random_atom(nx, ny, nz, dof, nchannels, seed):
+    rng = numpy.random.default_rng(seed)
+
+    atom = Atom(nx, ny, nz, dof)
+    for i in range(nchannels):
+        key = (rng.integers(dof), rng.integers(dof), rng.integers(3), rng.integers(3), rng.integers(3))
+        atom.channel(*[int(j) for j in key])[:, :, :] = rng.random((nx, ny, nz))
+    return atom
+
+def test_channel():
+    atom = Atom(3, 4, 5, 2)
+    atom.channel(0, 1, 2, 1, 1)[1, 2, 3] = 4
+
+    assert atom[1, 2, 3, 0, 1, 2, 1, 1] == 4
+    assert atom[1, 2, 3, 1, 1, 2, 1, 1] == 0
+    assert len(atom.planes) == 1
+
+def test_getitem():
+    atom = create_random_atom(3, 4, 5, 2, 10, 1)
+    dense = atom.to_array()
+
+    assert numpy.array_equal(atom[2, :, :, :, :, 1, :, :], dense[2, :, :, :, :, 1, :, :])
+    assert numpy.array_equal(atom[:, -1, 1:3, 0, :, :, 2, :], dense[:, -1, 1:3, 0, :, :, 2, :])
+    assert numpy.array_equal(atom[:, :, :, 1, 0, 0, 1, 2], dense[:, :, :, 1, 0, 0, 1, 2])
+
+def test_setitem():
+    atom = create_random_atom(3, 4, 5, 2, 10, 1)
+    dense = atom.to_array()
+
+    atom[2, :, :, :, :, 1, :, :] -= atom[2, :, :, :, :, 2, :, :]
+    dense[2, :, :, :, :, 1, :, :] -= dense[2, :, :, :, :, 2, :, :]
+    assert numpy.array_equal(atom.to_array(), dense)
+
+    nchannels = len(atom.planes)
+    atom[:, 0, :, 0, :, :, :, :] = 0
+    dense[:, 0, :, 0, :, :, :, :] = 0
+    assert numpy.array_equal(atom.to_array(), dense)
+    assert len(atom.planes) == nchannels
+
+    atom[:, 0, :, 0, 0, 1, 1, 1] = -1
+    dense[:, 0, :, 0, 0, 1, 1, 1] = -1
+    assert numpy.array_equal(atom.to_array(), dense)
+
+def test_arithmetic():
+    a = create_random_atom(3, 4, 5, 2, 10, 1)
+    b = create_random_atom(3, 4, 5, 2, 10, 2)
+
+    assert numpy.array_equal((a + b).to_array(), a.to_array() + b.to_array())
+    assert numpy.array_equal((a - b).to_array(), a.to_array() - b.to_array())
+    assert numpy.array_equal((2 * a).to_array(), 2 * a.to_array())
+    assert numpy.array_equal((numpy.float64(2) * a).to_array(), 2 * a.to_array())
+    assert numpy.array_equal((a / 3).to_array(), a.to_array() / 3)
+    assert numpy.array_equal((-a).to_array(), -a.to_array())
+
+    c = a.copy()
+    c += b
+    c /= 3
+    assert numpy.array_equal(c.to_array(), (a.to_array() + b.to_array()) / 3)
+
+def test_from_array():
+    atom = create_random_atom(3, 4, 5, 2, 10, 1)
+    dense = atom.to_array()
+
+    assert numpy.array_equal(Atom.from_array(dense).to_array(), dense)
+
+def test_zero():
+    atom = create_random_atom(3, 4, 5, 2, 10, 1)
+    planes = dict(atom.planes)
+    atom.zero()
+
+    assert not numpy.any(atom.to_array())
+    assert all(atom.planes[key] is plane for key, plane in planes.items())
@@ -0,0 +1,78 @@
+import numpy
+import pytest
+
+from scipy import sparse
+
+from fvm import CrsMatrix
+
+def create_random_matrix(n, density, seed):
+    A = sparse.random(n, n, density, format='csr', random_state=seed)
+    A.sort_indices()
+    return CrsMatrix(A.data, A.indices, A.indptr)
+
+def to_dense(A):
+    out = numpy.zeros(A.shape, dtype=A.dtype)
+    for i in range(A.n):
+        for j in range(A.begA[i], A.begA[i+1]):
+            out[i, A.jcoA[j]] += A.coA[j]
+    return out
+
+def test_compress():
+    coA = numpy.array([1.0, 2.0, 3.0, -3.0, 4.0, 5.0])
+    jcoA = numpy.array([2, 0, 1, 1, 2, 2])
+    begA = numpy.array([0, 2, 4, 4, 6])
+
+    A = CrsMatrix(coA, jcoA, begA)
+
+    assert list(A.begA) == [0, 2, 2, 2, 3]
+    assert list(A.jcoA) == [0, 2, 2]
+    assert list(A.coA) == [2.0, 1.0, 9.0]
+
+def test_add():
+    A = create_random_matrix(20, 0.2, 1)
+    B = create_random_matrix(20, 0.2, 2)
+
+    assert numpy.allclose(to_dense(A + B), to_dense(A) + to_dense(B))
+    assert numpy.allclose(to_dense(A - B), to_dense(A) - to_dense(B))
+
+    # The second time the cached merge map is used
+    C = A - 2 * B
+    assert numpy.allclose(to_dense(C), to_dense(A) - 2 * to_dense(B))
+    assert (A - B).same_pattern(C)
+
+def test_mul():
+    A = create_random_matrix(20, 0.2, 1)
+    dense = to_dense(A)
+
+    assert numpy.allclose(to_dense(A * 3), 3 * dense)
+    assert numpy.allclose(to_dense(A / 2), dense / 2)
+    assert numpy.allclose(to_dense(-A), -dense)
+
+    A *= 3
+    assert numpy.allclose(to_dense(A), 3 * dense)
+
+def test_matvec():
+    A = create_random_matrix(20, 0.2, 1)
+    dense = to_dense(A)
+
+    x = numpy.random.random(20)
+    assert numpy.allclose(A @ x, dense @ x)
+    assert numpy.allclose(A @ (1j * x), dense @ (1j * x))
+
+    X = numpy.random.random((20, 3))
+    assert numpy.allclose(A.matmat(X), dense @ X)
+
+    # Changing the values should also change the product
+    A.update(A.coA * 2)
+    assert numpy.allclose(A @ x, 2 * dense @ x)
+
+def test_same_pattern():
+    A = create_random_matrix(20, 0.2, 1)
+    B = CrsMatrix(A.coA.copy(), A.jcoA.copy(), A.begA.copy(), False)
+    C = create_random_matrix(20, 0.2, 2)
+
+    assert A.same_pattern(B)
+    assert not A.same_pattern(C)
+
+    with pytest.raises(ValueError):
+        A.update(A.coA[:-1])
@@ -0,0 +1,51 @@
+import io
+
+from fvm import Events, Logger
+
+def test_subscribe():
+    events = Events()
+    received = []
+
+    def callback(**kwargs):
+        received.append(kwargs)
+
+    assert not events.subscribed('step_accepted')
+    events.emit('step_accepted', mu=1)
+
+    events.subscribe('step_accepted', callback)
+    assert events.subscribed('step_accepted')
+    events.emit('step_accepted', mu=2)
+    events.emit('time_step', t=1)
+
+    events.unsubscribe('step_accepted', callback)
+    assert not events.subscribed('step_accepted')
+    events.emit('step_accepted', mu=3)
+
+    assert received == [{'mu': 2}]
+
+def test_logger():
+    events = Events()
+    stream = io.StringIO()
+    Logger(stream=stream).attach(events)
+
+    assert not events.subscribed('newton_iteration')
+
+    events.emit('newton_converged', name='Newton', iterations=2, fnorm=1e-8)
+    events.emit('step_accepted', parameter_name='Reynolds Number', mu=10.0, ds=1, x=None, iterations=2)
+    events.emit('bifurcation_found', parameter_name='Reynolds Number', mu=10.0, x=None, eigenvalue=1e-9+2j)
+    events.emit('time_step', t=1.0, dt=1.0, x=None)
+
+    assert stream.getvalue().splitlines() == [
+        'Newton converged in 2 iterations with ||F||=1.000000e-08',
+        'Reynolds Number: 10.000000',
+        'Bifurcation found at Reynolds Number = 10.000000 with eigenvalue 1.000000e-09 + 2.000000e+00i',
+        't = 1.000000']
+
+def test_verbose_logger():
+    events = Events()
+    stream = io.StringIO()
+    Logger(verbose=True, stream=stream).attach(events)
+
+    events.emit('newton_iteration', name='Newton corrector', iteration=1, fnorm=1.0, dxnorm=0.5)
+
+    assert stream.getvalue() == 'Newton corrector status at iteration 1: ||F||=1.000000e+00, ||dx||=5.000000e-01\n'
@@ -60,6 +60,42 @@ def test_HYMLS(nx=4, interactive=False):
         x = plot_utils.create_velocity_magnitude_mtx(x, nx, ny, nz, dof)
         plot_utils.plot_velocity_magnitude(x[:, ny // 2, :, 0], x[:, ny // 2, :, 2], nx, nz)
 
+def test_HYMLS_unbordered(nx=4):
+    try:
+        from fvm import HYMLSInterface
+        from PyTrilinos import Epetra
+        from PyTrilinos import Teuchos
+    except ImportError:
+        pytest.skip("HYMLS not found")
+
+    dim = 3
+    dof = 4
+    ny = nx
+    nz = nx
+
+    # The corrector solves with the right-hand sides separately, since
+    # HYMLS does not solve blocks
+    parameters = Teuchos.ParameterList()
+    parameters.set('Reynolds Number', 0)
+    parameters.set('Bordered Solver', False)
+
+    comm = Epetra.PyComm()
+    interface = HYMLSInterface.Interface(comm, parameters, nx, ny, nz, dim, dof)
+    m = interface.map
+
+    continuation = Continuation(interface, parameters)
+
+    x0 = HYMLSInterface.Vector(m)
+    x0.PutScalar(0.0)
+    x0 = continuation.newton(x0)
+
+    start = 0
+    target = 100
+    ds = 100
+    x = continuation.continuation(x0, 'Reynolds Number', start, target, ds)[0]
+
+    assert x.Norm2() > 0
+
 def test_HYMLS_2D(nx=8, interactive=False):
     try:
         from fvm import HYMLSInterface
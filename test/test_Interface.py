@@ -0,0 +1,210 @@
+import numpy
+import pytest
+
+from scipy import sparse
+
+from fvm import CrsMatrix, Interface
+
+from test.solve_helpers import pinned_matrix
+
+def test_solve():
+    nx = 5
+    ny = 4
+    nz = 3
+    dim = 3
+    dof = 4
+    n = nx * ny * nz * dof
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+
+    for i in range(3):
+        state = numpy.random.random(n)
+        rhs = numpy.random.random(n)
+        jac = interface.jacobian(state)
+
+        x = interface.solve(jac, rhs)
+
+        rhs[dim] = 0
+        x2 = numpy.linalg.solve(pinned_matrix(jac, dim), rhs)
+        assert numpy.allclose(x, x2)
+
+        # The column ordering of the first factorization is reused
+        # for Jacobians with the same pattern
+        if i == 0:
+            perm_c = interface.linear_solver._perm_c
+        else:
+            assert interface.linear_solver._perm_c is perm_c
+
+    # Complex matrices with the same pattern
+    rhs = numpy.random.random(n) + 1j * numpy.random.random(n)
+    jac = interface.jacobian(state) * (1 + 2j)
+
+    x = interface.solve(jac, rhs)
+
+    rhs[dim] = 0
+    x2 = numpy.linalg.solve(pinned_matrix(jac, dim), rhs)
+    assert numpy.allclose(x, x2)
+
+def test_solve_pattern_change():
+    nx = 4
+    ny = 4
+    nz = 1
+    dim = 2
+    dof = 3
+    n = nx * ny * nz * dof
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+
+    state = numpy.random.random(n)
+    rhs = numpy.random.random(n)
+    jac = interface.jacobian(state)
+    interface.solve(jac, rhs)
+    interface.solve(interface.jacobian(state), rhs)
+    perm_c = interface.linear_solver._perm_c
+
+    # A matrix with a different pattern
+    A = (jac.to_scipy() + sparse.eye(n, k=n // 2) * 1e-3).tocsr()
+    jac = CrsMatrix(A.data, A.indices, A.indptr)
+    assert not jac.same_pattern(interface.jacobian(state))
+
+    x = interface.solve(jac, rhs)
+    assert interface.linear_solver._perm_c is not perm_c
+
+    rhs[dim] = 0
+    x2 = numpy.linalg.solve(pinned_matrix(jac, dim), rhs)
+    assert numpy.allclose(x, x2)
+
+@pytest.mark.parametrize('linear_solver', [{}, {'Type': 'GMRES'}])
+def test_solve_block(linear_solver):
+    nx = 4
+    ny = 4
+    nz = 1
+    dim = 2
+    dof = 3
+    n = nx * ny * nz * dof
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100,
+                  'Collect Statistics': True, 'Linear Solver': linear_solver}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+
+    state = numpy.random.random(n)
+    jac = interface.jacobian(state)
+
+    rhs = numpy.random.random((n, 3)) + 1j * numpy.random.random((n, 3))
+    x = interface.solve(jac, rhs)
+    assert x.shape == rhs.shape
+    assert x.dtype == rhs.dtype
+    assert interface.stats.counts[interface.linear_solver.solve_timer] == 1
+
+    rhs[dim, :] = 0
+    x2 = numpy.linalg.solve(pinned_matrix(jac, dim), rhs)
+    assert numpy.allclose(x, x2)
+
+    for i in range(rhs.shape[1]):
+        assert numpy.allclose(interface.solve(jac, rhs[:, i]), x[:, i])
+
+def test_solve_bordered():
+    nx = 4
+    ny = 4
+    nz = 1
+    dim = 2
+    dof = 3
+    n = nx * ny * nz * dof
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100, 'Collect Statistics': True}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+
+    state = numpy.random.random(n)
+    jac = interface.jacobian(state)
+
+    rhs = numpy.random.random(n)
+    V = numpy.random.random(n)
+    W = numpy.random.random(n)
+    rhs2 = 0.3
+    C = 2.5
+
+    x, x2 = interface.solve(jac, rhs, rhs2, V, W, C)
+    assert interface.stats.counts['factorization'] == 1
+
+    rhs[dim] = 0
+    V[dim] = 0
+    A = numpy.zeros((n + 1, n + 1))
+    A[:n, :n] = pinned_matrix(jac, dim)
+    A[:n, n] = V
+    A[n, :n] = W
+    A[n, n] = C
+    y = numpy.linalg.solve(A, numpy.append(rhs, rhs2))
+    assert numpy.allclose(x, y[:n])
+    assert numpy.isclose(x2, y[n])
+
+def check_linear_solver(parameters, nx=4, ny=4, nz=1, dim=2, dof=3):
+    n = nx * ny * nz * dof
+
+    problem_parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100,
+                          'Collect Statistics': True, 'Linear Solver': parameters}
+    interface = Interface(problem_parameters, nx, ny, nz, dim, dof)
+
+    state = numpy.random.random(n)
+    jac = interface.jacobian(state)
+
+    rhs = numpy.random.random(n) + 1j * numpy.random.random(n)
+    x = interface.solve(jac, rhs)
+
+    rhs[dim] = 0
+    x2 = numpy.linalg.solve(pinned_matrix(jac, dim), rhs)
+    assert numpy.allclose(x, x2)
+
+    return interface
+
+def test_superlu():
+    for ordering in ['COLAMD', 'MMD_AT_PLUS_A', 'MMD_ATA', 'NATURAL']:
+        check_linear_solver({'Ordering': ordering})
+
+    check_linear_solver({'Type': 'SuperLU', 'Reuse Ordering': False})
+
+def test_krylov():
+    for method in ['GMRES', 'BiCGStab', 'LGMRES']:
+        interface = check_linear_solver({'Type': method, 'Tolerance': 1e-12})
+
+        stats = interface.stats
+        assert stats.counts['preconditioner setup'] == 1
+        assert stats.counts[method.lower()] == 1
+        assert stats.counts.get(method.lower() + ' failures', 0) == 0
+
+        if method == 'GMRES':
+            assert stats.counts['gmres iterations'] > 0
+
+def test_simple():
+    for variant in ['SIMPLE', 'SIMPLEC']:
+        parameters = {'Type': 'GMRES', 'Preconditioner': variant, 'Tolerance': 1e-12, 'Restart': 100}
+        check_linear_solver(parameters)
+        check_linear_solver(parameters, 4, 4, 3, 3, 4)
+
+    parameters = {'Type': 'GMRES', 'Preconditioner': 'SIMPLE', 'Tolerance': 1e-12,
+                  'Velocity Solver': 'LU', 'Pressure Solver': 'ILU'}
+    interface = check_linear_solver(parameters)
+    assert 'pressure solver fill' in interface.stats.values
+
+def test_auto():
+    interface = check_linear_solver({'Type': 'Auto', 'Tolerance': 1e-12})
+    assert interface.linear_solver.solver is interface.linear_solver.direct
+
+    interface = check_linear_solver({'Type': 'Auto', 'Tolerance': 1e-12, 'Maximum Factor Nonzeros': 10})
+    assert interface.linear_solver.solver is interface.linear_solver.iterative
+
+def test_optional_linear_solvers():
+    try:
+        check_linear_solver({'Type': 'UMFPACK'})
+    except ImportError:
+        pass
+
+    try:
+        check_linear_solver({'Type': 'GMRES', 'Preconditioner': 'AMG', 'Tolerance': 1e-12})
+    except ImportError:
+        pass
+
+def test_unknown_linear_solver():
+    with pytest.raises(ValueError):
+        check_linear_solver({'Type': 'Cholesky'})
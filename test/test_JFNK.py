@@ -0,0 +1,72 @@
+import numpy
+import pytest
+
+from fvm import Interface
+from fvm.JFNK import JFNK, create_nonlinear_solver
+
+from test.solve_helpers import pinned_matrix
+
+@pytest.mark.parametrize('jacobian_action', ['Analytic', 'Finite Difference'])
+def test_operator(jacobian_action, nx=4, ny=4, nz=1, dim=2, dof=3):
+    n = nx * ny * nz * dof
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+    jfnk = JFNK(interface, {'Jacobian Action': jacobian_action})
+
+    state = numpy.random.random(n)
+    v = numpy.random.random(n)
+
+    A = pinned_matrix(interface.jacobian(state), dim)
+    assert numpy.allclose(jfnk.operator(state) @ v, A @ v, atol=1e-6)
+
+    mass = interface.mass_matrix()
+    A = pinned_matrix(interface.jacobian(state) - mass * 2, dim)
+    assert numpy.allclose(jfnk.operator(state, mass=mass, shift=2) @ v, A @ v, atol=1e-6)
+
+@pytest.mark.parametrize('linear_solver', [{}, {'Type': 'SIMPLE'}])
+def test_solve(linear_solver, nx=4, ny=4, nz=1, dim=2, dof=3):
+    n = nx * ny * nz * dof
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100,
+                  'Collect Statistics': True, 'Linear Solver': linear_solver}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+    jfnk = JFNK(interface, {})
+
+    state = numpy.random.random(n)
+    op = jfnk.operator(state)
+
+    # Precondition with the Jacobian at a different state
+    jac = interface.jacobian(state + 0.1 * numpy.random.random(n))
+
+    rhs = numpy.random.random((n, 2))
+    x = jfnk.solve(op, jac, rhs, 1e-10)
+    assert jfnk.iterations > 0
+    assert 'jfnk failures' not in interface.stats.counts
+
+    rhs[dim, :] = 0
+    A = pinned_matrix(interface.jacobian(state), dim)
+    assert numpy.allclose(A @ x, rhs)
+
+def test_forcing_term():
+    interface = Interface({}, 4, 4, 1, 2, 3)
+    jfnk = JFNK(interface, {'Initial Forcing Term': 0.5})
+
+    assert jfnk.forcing_term(1) == 0.5
+    assert jfnk.forcing_term(0.1) == 0.9 * 0.5 ** 2
+    assert jfnk.forcing_term(1e-3) == pytest.approx(0.9 * 0.01 ** 2)
+
+    # Do not solve more accurately than the Newton tolerance requires
+    assert jfnk.forcing_term(1e-4, 1e-5) == pytest.approx(0.05)
+
+    jfnk = JFNK(interface, {'Forcing Term': 1e-3})
+    assert jfnk.forcing_term(1) == 1e-3
+
+def test_create_nonlinear_solver():
+    interface = Interface({}, 4, 4, 1, 2, 3)
+
+    assert create_nonlinear_solver(interface, {}) is None
+    assert isinstance(create_nonlinear_solver(interface, {'Nonlinear Solver': 'JFNK'}), JFNK)
+
+    with pytest.raises(ValueError):
+        create_nonlinear_solver(interface, {'Nonlinear Solver': 'Picard'})
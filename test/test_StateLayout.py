@@ -0,0 +1,74 @@
+import numpy
+import pytest
+
+from fvm import StateLayout, utils
+
+def test_mtx():
+    nx = 4
+    ny = 3
+    nz = 2
+    dof = 5
+
+    layout = StateLayout(nx, ny, nz, dof, 3)
+    state = numpy.random.random(nx * ny * nz * dof)
+    state_mtx = layout.mtx(state)
+
+    assert state_mtx.shape == (nx, ny, nz, dof)
+    assert numpy.shares_memory(state_mtx, state)
+    for k in range(nz):
+        for j in range(ny):
+            for i in range(nx):
+                for d in range(dof):
+                    assert state_mtx[i, j, k, d] == state[d + i * dof + j * dof * nx + k * dof * nx * ny]
+
+    assert numpy.shares_memory(layout.vec(state_mtx), state)
+    assert numpy.array_equal(layout.vec(state_mtx), state)
+
+def test_zeros():
+    layout = StateLayout(4, 3, 2, 5)
+    state_mtx = layout.zeros(numpy.complex128)
+    state_mtx[1, 2, 1, 3] = 1j
+
+    state = layout.vec(state_mtx)
+    assert numpy.shares_memory(state, state_mtx)
+    assert state.dtype == numpy.complex128
+    assert state[3 + 1 * 5 + 2 * 5 * 4 + 1 * 5 * 4 * 3] == 1j
+
+def test_fields():
+    nx = 4
+    ny = 3
+    nz = 2
+
+    state = numpy.random.random(nx * ny * nz * 5)
+    state_mtx = utils.create_state_mtx(state, nx, ny, nz, 5)
+
+    layout = StateLayout(nx, ny, nz, 5, 3)
+    assert numpy.array_equal(layout.u(state), state_mtx[:, :, :, 0])
+    assert numpy.array_equal(layout.v(state), state_mtx[:, :, :, 1])
+    assert numpy.array_equal(layout.w(state), state_mtx[:, :, :, 2])
+    assert numpy.array_equal(layout.p(state), state_mtx[:, :, :, 3])
+    assert numpy.array_equal(layout.T(state), state_mtx[:, :, :, 4])
+
+    state = numpy.random.random(nx * ny * nz * 3)
+    layout = StateLayout(nx, ny, nz, 3, 2)
+    assert numpy.array_equal(layout.p(state), utils.create_state_mtx(state, nx, ny, nz, 3)[:, :, :, 2])
+
+    with pytest.raises(ValueError):
+        layout.w(state)
+
+    with pytest.raises(ValueError):
+        layout.T(state)
+
+def test_utils():
+    nx = 4
+    ny = 3
+    nz = 2
+    dof = 3
+
+    state = numpy.random.random(nx * ny * nz * dof)
+    state_mtx = utils.create_state_mtx(state, nx, ny, nz, dof)
+    assert not numpy.shares_memory(state_mtx, state)
+
+    state2 = utils.create_state_vec(state_mtx, nx, ny, nz, dof)
+    assert not numpy.shares_memory(state_mtx, state2)
+    assert numpy.array_equal(state, state2)
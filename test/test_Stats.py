@@ -0,0 +1,28 @@
+from fvm import Stats
+
+def test_disabled():
+    stats = Stats()
+
+    with stats.timer('rhs'):
+        pass
+    stats.count('newton iterations')
+    stats.set('factorization fill', 2)
+
+    assert stats.as_dict() == {'times': {}, 'counts': {}, 'values': {}}
+
+def test_enabled():
+    stats = Stats(True)
+
+    for i in range(2):
+        with stats.timer('rhs'):
+            pass
+    stats.count('newton iterations', 3)
+    stats.set('factorization fill', 2)
+
+    assert stats.times['rhs'] >= 0
+    assert stats.counts == {'rhs': 2, 'newton iterations': 3}
+    assert stats.values == {'factorization fill': 2}
+    assert 'newton iterations' in str(stats)
+
+    stats.reset()
+    assert stats.as_dict() == {'times': {}, 'counts': {}, 'values': {}}
@@ -0,0 +1,40 @@
+import json
+
+from fvm.bench import run_benchmarks, compare
+from fvm.bench.__main__ import main
+
+def test_run_benchmarks():
+    results = run_benchmarks(['ldc'], [2], [4], ['rhs', 'solve', 'continuation_step'], repeat=1, log=lambda *args: None)
+
+    assert len(results) == 3
+    for result in results:
+        assert result['problem'] == 'ldc'
+        assert result['time'] > 0
+        assert result['peak_memory'] > 0
+
+    assert results[0]['calls']['Discretization.assemble_rhs'] == 1
+    assert results[1]['calls']['linalg.splu'] == 1
+
+def test_compare():
+    results = [{'problem': 'ldc', 'dim': 2, 'size': 4, 'benchmark': 'rhs', 'time': 2.0, 'peak_memory': 100}]
+    baseline = [{'problem': 'ldc', 'dim': 2, 'size': 4, 'benchmark': 'rhs', 'time': 1.0, 'peak_memory': 100}]
+
+    regressions = compare(results, baseline)
+    assert len(regressions) == 1
+    assert regressions[0][1] == 'time'
+
+    assert not compare(results, baseline, threshold=2)
+    assert not compare(baseline, results)
+
+def test_main(tmp_path):
+    output = str(tmp_path / 'results.json')
+    assert main(['-p', 'rb', '-d', '2', '-s', '4', '-b', 'jacobian', '-r', '1', '-o', output]) == 0
+
+    with open(output) as f:
+        data = json.load(f)
+
+    assert 'numpy' in data['metadata']
+    assert data['results'][0]['benchmark'] == 'jacobian'
+
+    assert main(['-p', 'rb', '-d', '2', '-s', '4', '-b', 'jacobian', '-r', '1', '--baseline', output,
+                 '--threshold', '1000']) == 0
@@ -1,4 +1,5 @@
 import numpy
+import pytest
 
 from fvm import TimeIntegration
 from fvm import Continuation
@@ -184,6 +185,212 @@ def test_continuation_time_integration(nx=4, interactive=False):
     assert numpy.linalg.norm(x[0:len(x):dof] - x3[0:len(x):dof]) < 1e-4
     assert numpy.linalg.norm(x[1:len(x):dof] - x3[1:len(x):dof]) < 1e-4
 
+def test_continuation_stats(nx=4):
+    dim = 2
+    dof = 3
+    ny = nx
+    nz = 1
+
+    parameters = {'Collect Statistics': True}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+
+    continuation = Continuation(interface, parameters)
+    assert continuation.stats is interface.stats
+
+    x0 = numpy.zeros(dof * nx * ny * nz)
+    x0 = continuation.newton(x0)
+    x = continuation.continuation(x0, 'Reynolds Number', 0, 100, 50)[0]
+
+    stats = interface.stats
+    assert stats.counts['newton iterations'] > 0
+    assert stats.counts['continuation steps'] > 0
+    assert stats.counts['factorization'] > 0
+    assert stats.counts['linear operators'] == 1
+    assert stats.values['factorization fill'] > 1
+    assert stats.times['jacobian assembly'] > 0
+
+    stats.reset()
+    time_integration = TimeIntegration(interface, parameters)
+    time_integration.integration(x, 1, 1)
+
+    assert stats.counts['time step'] == 1
+    assert stats.counts['newton iterations'] > 0
+    assert 'continuation steps' not in stats.counts
+
+    interface.set_parameter('Collect Statistics', False)
+    stats.reset()
+    continuation.newton(x)
+    assert not stats.counts
+
+def test_continuation_events(capsys, nx=4):
+    dim = 2
+    dof = 3
+    ny = nx
+    nz = 1
+
+    parameters = {'Silent': True, 'Maximum Step Size': 50}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+
+    continuation = Continuation(interface, parameters)
+    assert not continuation.events.callbacks
+
+    events = {}
+
+    def observer(event):
+        return lambda **kwargs: events.setdefault(event, []).append(kwargs)
+
+    for event in ['newton_iteration', 'newton_converged', 'step_accepted', 'target_reached']:
+        continuation.events.subscribe(event, observer(event))
+
+    x0 = numpy.zeros(dof * nx * ny * nz)
+    x0 = continuation.newton(x0)
+    x, mu, data = continuation.continuation(x0, 'Reynolds Number', 0, 100, 20)
+
+    assert events['newton_converged'][0]['name'] == 'Newton'
+    assert events['newton_iteration'][0]['fnorm'] > 0
+    assert len(events['step_accepted']) >= 2
+    assert events['step_accepted'][0]['parameter_name'] == 'Reynolds Number'
+    assert events['target_reached'][-1]['mu'] == mu
+    assert events['target_reached'][-1]['x'] is x
+
+    assert capsys.readouterr().out == ''
+
+def test_time_integration_residual_check(nx=4):
+    dim = 2
+    dof = 3
+    ny = nx
+    nz = 1
+
+    parameters = {'Silent': True, 'Maximum Step Size': 50}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+    continuation = Continuation(interface, parameters)
+
+    x0 = numpy.zeros(dof * nx * ny * nz)
+    x0 = continuation.newton(x0)
+    x = continuation.continuation(x0, 'Reynolds Number', 0, 100, 20)[0]
+
+    time_integration = TimeIntegration(interface, parameters)
+    x2 = time_integration.integration(x, 1, 2)[0]
+
+    # Check for convergence on the update only, so the residual norm is
+    # never computed
+    parameters['Residual Check'] = 'U'
+    time_integration = TimeIntegration(interface, parameters)
+    x3 = time_integration.integration(x, 1, 2)[0]
+
+    assert numpy.linalg.norm(x3 - x2) < 1e-6
+
+def test_jacobian_reuse_across_steps(nx=4):
+    dim = 2
+    dof = 3
+    ny = nx
+    nz = 1
+
+    parameters = {'Silent': True, 'Collect Statistics': True, 'Jacobian Reuse': True,
+                  'Maximum Newton Iterations': 20, 'Maximum Jacobian Age': 100}
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+    continuation = Continuation(interface, parameters)
+
+    x0 = numpy.zeros(dof * nx * ny * nz)
+    x0 = continuation.newton(x0)
+    x, mu, data = continuation.continuation(x0, 'Reynolds Number', 0, 10, 5)
+
+    stats = interface.stats
+    assert stats.counts['factorization'] < stats.counts['continuation steps']
+
+    # The next step starts with the Jacobian and factorization of the previous one
+    jac = continuation.jacobian_reuse.jac
+    factorizations = stats.counts['factorization']
+    x, mu2, dx, dmu, ds = continuation.step('Reynolds Number', x, mu, numpy.zeros(len(x)), 1, 1)
+
+    assert mu2 > mu
+    assert continuation.jacobian_reuse.jac is jac
+    assert stats.counts['factorization'] == factorizations
+
+def run_continuation(parameters, nx=4, block_solve=True):
+    '''Continuation of a 2D lid-driven cavity to Re = 100, followed by a
+    time integration of three steps. Returns the state and Reynolds
+    number at the end of the continuation, the state at the end of the
+    time integration and the statistics.'''
+
+    dim = 2
+    dof = 3
+    ny = nx
+    nz = 1
+
+    parameters = dict({'Silent': True, 'Collect Statistics': True, 'Newton Tolerance': 1e-8,
+                       'Maximum Step Size': 50}, **parameters)
+    interface = Interface(parameters, nx, ny, nz, dim, dof)
+    interface.block_solve = block_solve
+    continuation = Continuation(interface, parameters)
+
+    x0 = numpy.zeros(dof * nx * ny * nz)
+    x0 = continuation.newton(x0)
+    x, mu, data = continuation.continuation(x0, 'Reynolds Number', 0, 100, 20)
+
+    time_integration = TimeIntegration(interface, parameters)
+    x2 = time_integration.integration(x, 1, 3)[0]
+
+    return x, mu, x2, interface.stats
+
+@pytest.fixture(scope='module')
+def baseline():
+    '''The result of run_continuation with the default solver options.'''
+
+    x, mu, x2, stats = run_continuation({})
+    assert 'jacobian reuses' not in stats.counts
+    return x, mu, x2, stats
+
+def test_jacobian_reuse(baseline):
+    x, mu, x2, stats = baseline
+    x_reuse, mu_reuse, x2_reuse, stats_reuse = run_continuation({'Jacobian Reuse': True,
+                                                                 'Maximum Newton Iterations': 20})
+
+    assert stats_reuse.counts['jacobian reuses'] > 0
+    assert stats_reuse.counts['factorization'] < stats.counts['factorization']
+    assert stats_reuse.counts['jacobian assembly'] < stats.counts['jacobian assembly']
+
+    assert abs(mu_reuse - mu) < 1e-6
+    assert numpy.linalg.norm(x_reuse - x) < 1e-6
+    assert numpy.linalg.norm(x2_reuse - x2) < 1e-6
+
+def test_continuation_bordered_solver(baseline):
+    x, mu, x2, stats = baseline
+    x_bord, mu_bord, x2_bord, stats_bord = run_continuation({'Bordered Solver': True})
+
+    assert stats_bord.counts['solve'] == stats.counts['solve']
+    assert abs(mu_bord - mu) < 1e-8
+    assert numpy.linalg.norm(x_bord - x) < 1e-8
+    assert numpy.linalg.norm(x2_bord - x2) < 1e-8
+
+@pytest.mark.parametrize('jacobian_action', ['Analytic', 'Finite Difference'])
+def test_jfnk(baseline, jacobian_action):
+    x, mu, x2, stats = baseline
+    x_jfnk, mu_jfnk, x2_jfnk, stats_jfnk = run_continuation({'Nonlinear Solver': 'JFNK',
+                                                             'JFNK': {'Jacobian Action': jacobian_action}})
+
+    assert stats_jfnk.counts['jfnk iterations'] > 0
+    assert 'jfnk failures' not in stats_jfnk.counts
+    assert stats_jfnk.counts['factorization'] < stats.counts['factorization']
+
+    assert abs(mu_jfnk - mu) < 1e-6
+    assert numpy.linalg.norm(x_jfnk - x) < 1e-6
+    assert numpy.linalg.norm(x2_jfnk - x2) < 1e-6
+
+def test_jfnk_bordered_solver():
+    with pytest.raises(ValueError):
+        run_continuation({'Nonlinear Solver': 'JFNK', 'Bordered Solver': True})
+
+def test_continuation_iterative_solver():
+    # Solving the corrector systems as a block uses the previous
+    # factorization as often as solving them separately
+    x, mu, x2, stats = run_continuation({'Use Iterative Solver': True}, nx=8)
+    x_sep, mu_sep, x2_sep, stats_sep = run_continuation({'Use Iterative Solver': True}, nx=8, block_solve=False)
+
+    assert stats.counts['gmres'] == stats_sep.counts['gmres']
+    assert stats.counts['factorization'] == stats_sep.counts['factorization']
+    assert numpy.allclose(x, x_sep)
+
 
 if __name__ == '__main__':
     # test_continuation(8, False)
@@ -3,8 +3,11 @@ import numpy
 import pytest
 
 from fvm import utils
+from fvm import Atom
 from fvm import CrsMatrix
 from fvm import Discretization
+from fvm import GridMetrics
+from fvm import kernels
 
 def create_coordinate_vector(nx):
     dx = 1 / (nx + 1)
@@ -58,6 +61,26 @@ def test_stretched_grid():
     assert x[0] > 0
     assert x[nx-1] == pytest.approx(1)
 
+def test_grid_metrics():
+    parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
+
+    metrics = GridMetrics(nx, ny, nz, x, y, z)
+
+    assert metrics.dx.shape == (nx, 1, 1)
+    assert metrics.dy.shape == (1, ny, 1)
+    assert metrics.dz.shape == (1, 1, nz)
+    assert metrics.area_x.shape == (1, ny, nz)
+
+    for i in range(nx):
+        assert metrics.dx[i, 0, 0] == pytest.approx(x[i] - x[i-1])
+        assert metrics.dxp1[i, 0, 0] == pytest.approx(x[i+1] - x[i])
+        assert metrics.hx[i, 0, 0] == pytest.approx((x[i+1] - x[i-1]) / 2)
+        assert metrics.hxm1[i, 0, 0] == pytest.approx((x[i] - x[i-2]) / 2)
+
+    for j in range(ny):
+        for k in range(nz):
+            assert metrics.area_x[0, j, k] == pytest.approx((y[j] - y[j-1]) * (z[k] - z[k-1]))
+
 def test_u_xx():
     parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
 
@@ -521,6 +544,263 @@ def test_jac_consistency_stretched():
         rhs2 = discretization.rhs(state + eps * pert)
         assert numpy.linalg.norm((rhs2 - rhs) / eps - A @ pert) < eps2
 
+def test_jac_pattern_reuse():
+    parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
+
+    n = dof * nx * ny * nz
+    state = numpy.random.random(n)
+    pert = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+    A0 = discretization.jacobian(numpy.zeros(n))
+    A1 = discretization.jacobian(state)
+    A2 = discretization.jacobian(state + pert)
+
+    assert not A0.same_pattern(A1)
+    assert A1.same_pattern(A2)
+    assert A1.jcoA is A2.jcoA
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+    B = discretization.jacobian(state + pert)
+
+    assert numpy.linalg.norm(A2 @ pert - B @ pert) < 1e-10
+
+def test_evaluate():
+    parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
+
+    n = dof * nx * ny * nz
+    state = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+    rhs, A = discretization.evaluate(state)
+
+    assert numpy.allclose(rhs, discretization.rhs(state))
+    assert numpy.allclose(A @ state, discretization.jacobian(state) @ state)
+
+    rhs, A = discretization.evaluate(state, want_jac=False)
+    assert A is None
+
+def test_jacobian_operator():
+    parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
+
+    n = dof * nx * ny * nz
+    state = numpy.random.random(n)
+    v = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+    A = discretization.jacobian(state)
+    op = discretization.jacobian_operator(state)
+
+    assert op.shape == (n, n)
+    assert numpy.allclose(op @ v, A @ v)
+    assert numpy.allclose(op @ (v * 1j), A @ (v * 1j))
+
+def test_convection_workspace():
+    nx = 5
+    ny = 4
+    nz = 3
+    dim = 3
+    dof = 5
+    n = dof * nx * ny * nz
+
+    parameters = {'Problem Type': 'Rayleigh-Benard', 'Reynolds Number': 1, 'Rayleigh Number': 10}
+    state = numpy.random.random(n)
+    state2 = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    discretization.rhs(state)
+    workspace = discretization.convection_workspace()
+    A = discretization.jacobian(state2)
+    rhs = discretization.rhs(state2)
+
+    # The workspace is reused
+    assert all(a is b for a, b in zip(workspace, discretization.convection_workspace()))
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    B = discretization.jacobian(state2)
+
+    assert numpy.array_equal(rhs, discretization.rhs(state2))
+    assert numpy.array_equal(A @ state, B @ state)
+
+def test_rhs_workspace():
+    parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
+
+    n = dof * nx * ny * nz
+    state = numpy.random.random(n)
+    v = numpy.random.random(n) + 1j * numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+    atomJ, atomF = discretization.nonlinear_part(state)
+    atomJ = atomJ.copy()
+    atomF = atomF.copy()
+
+    A = discretization.assemble_jacobian(atomJ)
+    B = discretization.assemble_jacobian(atomF)
+
+    # Alternate between atoms with different channels and dtypes
+    for i in range(2):
+        assert numpy.allclose(discretization.assemble_rhs(state, atomJ), A @ state)
+        assert numpy.allclose(discretization.assemble_rhs(state, atomF), B @ state)
+        assert numpy.allclose(discretization.assemble_rhs(v, atomJ), A @ v)
+
+def test_batch_rhs():
+    parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
+
+    n = dof * nx * ny * nz
+    states = numpy.random.random((n, 3))
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+    rhs = discretization.rhs(states)
+
+    assert rhs.shape == (n, 3)
+    for i in range(3):
+        assert numpy.allclose(rhs[:, i], discretization.rhs(states[:, i]))
+
+def test_batch_rhs_parameters():
+    nx = 5
+    ny = 4
+    nz = 3
+    dim = 3
+    dof = 5
+    n = dof * nx * ny * nz
+
+    parameters = {'Problem Type': 'Rayleigh-Benard', 'Reynolds Number': 1, 'Rayleigh Number': 10}
+    states = numpy.random.random((n, 3))
+    parameter_sets = [{}, {'Rayleigh Number': 20, 'Prandtl Number': 3}, {'Reynolds Number': 0}]
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    rhs = discretization.rhs(states, parameter_sets)
+
+    for i in range(3):
+        discretization = Discretization(dict(parameters, **parameter_sets[i]), nx, ny, nz, dim, dof)
+        assert numpy.allclose(rhs[:, i], discretization.rhs(states[:, i]))
+
+    with pytest.raises(ValueError):
+        discretization.rhs(states, [{'Biot Number': 1}] * 3)
+
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100}
+    discretization = Discretization(parameters, nx, ny, nz, dim, 4)
+    state = numpy.random.random(nx * ny * nz * 4)
+    rhs = discretization.rhs(state, [{'Lid Velocity': 0.5}, {'Reynolds Number': 10}])
+
+    discretization.set_parameter('Lid Velocity', 0.5)
+    assert numpy.allclose(rhs[:, 0], discretization.rhs(state))
+
+    discretization.set_parameter('Lid Velocity', 1)
+    discretization.set_parameter('Reynolds Number', 10)
+    assert numpy.allclose(rhs[:, 1], discretization.rhs(state))
+
+def test_kernel_backends():
+    try:
+        import numba # noqa: F401
+    except ImportError:
+        pytest.skip('numba not found')
+
+    nx = 5
+    ny = 4
+    nz = 3
+    dim = 3
+    dof = 5
+    n = dof * nx * ny * nz
+
+    parameters = {'Problem Type': 'Rayleigh-Benard', 'Reynolds Number': 1, 'Rayleigh Number': 10,
+                  'Kernel Backend': 'numpy'}
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    assert discretization.kernels is kernels.NumpyKernels
+
+    parameters['Kernel Backend'] = 'numba'
+    discretization2 = Discretization(parameters, nx, ny, nz, dim, dof)
+    assert discretization2.kernels is kernels.NumbaKernels
+
+    # The second call uses the stored pattern of the Jacobian
+    for i in range(2):
+        state = numpy.random.random(n)
+        rhs, jac = discretization.evaluate(state)
+        rhs2, jac2 = discretization2.evaluate(state)
+
+        assert numpy.array_equal(rhs, rhs2)
+        assert numpy.array_equal(jac.begA, jac2.begA)
+        assert numpy.array_equal(jac.jcoA, jac2.jcoA)
+        assert numpy.array_equal(jac.coA, jac2.coA)
+
+    discretization2.set_parameter('Kernel Backend', 'numpy')
+    assert discretization2.kernels is kernels.NumpyKernels
+    assert numpy.array_equal(discretization2.jacobian(state).coA, jac.coA)
+
+    # NumPy is the default, numba has to be requested
+    assert Discretization({}, nx, ny, nz, dim, dof).kernels is kernels.NumpyKernels
+    assert kernels.get_kernels('auto') is kernels.NumbaKernels
+
+    with pytest.raises(ValueError):
+        kernels.get_kernels('fortran')
+
+def test_linear_part_cache():
+    nx = 5
+    ny = 4
+    nz = 3
+    dim = 3
+    dof = 5
+    n = dof * nx * ny * nz
+
+    parameters = {'Problem Type': 'Rayleigh-Benard', 'Reynolds Number': 1, 'Rayleigh Number': 10}
+    state = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    discretization.jacobian(state)
+    discretization.set_parameter('Reynolds Number', 3)
+    discretization.set_parameter('Rayleigh Number', 50)
+    A = discretization.jacobian(state)
+    rhs = discretization.rhs(state)
+
+    parameters['Reynolds Number'] = 3
+    parameters['Rayleigh Number'] = 50
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    atom = discretization.linear_part()
+    frc = discretization.boundaries(atom)
+    B = discretization.assemble_jacobian(atom)
+
+    atomJ, atomF = discretization.nonlinear_part(state)
+    B = B + discretization.assemble_jacobian(atomJ)
+    atomF += atom
+
+    assert numpy.allclose(A @ state, B @ state)
+    assert numpy.allclose(rhs, discretization.assemble_rhs(state, atomF) + frc)
+
+    # The boundary conditions are affine: they also set entries in an
+    # empty atom, which the cached operators have to account for
+    zero = Atom(nx, ny, nz, dof)
+    discretization.boundaries(zero)
+    assert zero.planes
+
+    nx = 5
+    ny = 4
+    nz = 3
+    dim = 3
+    dof = 4
+    n = dof * nx * ny * nz
+
+    parameters = {'Reynolds Number': 10}
+    state = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    discretization.rhs(state)
+    operators = discretization._linear_operators
+
+    discretization.set_parameter('Verbose', True)
+    assert not discretization.recompute_linear_part
+    assert not discretization.recompute_forcing
+
+    discretization.set_parameter('Lid Velocity', 3)
+    assert not discretization.recompute_linear_part
+    assert discretization.recompute_forcing
+
+    rhs = discretization.rhs(state)
+    assert discretization._linear_operators is operators
+
+    parameters['Lid Velocity'] = 3
+    discretization = Discretization(parameters, nx, ny, nz, dim, dof)
+    assert numpy.allclose(rhs, discretization.rhs(state))
+
 def read_matrix(fname):
     A = CrsMatrix([], [], [0])
 